@@ -0,0 +1,285 @@
+-- SQLite version of schema.sql, used by the SQLite ledger (`ledger: sqlite:` in the configuration)
+--
+-- Text columns compare case-insensitively like the latin1 columns of MySQL. Timestamps are in local time with
+-- microseconds. The triggers write the same log rows as the MySQL triggers, and keep `last_modified` up to date on the
+-- tables OMS updates.
+-- The foreign key of position_by_entry to order_ is left out, SQLite requires the referenced columns to be unique.
+
+PRAGMA foreign_keys = ON;
+
+CREATE TABLE account (
+  id varchar(100) NOT NULL COLLATE NOCASE,
+  cash decimal(20,5) DEFAULT NULL,
+  currency varchar(3) DEFAULT NULL COLLATE NOCASE,
+  created timestamp NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+  last_modified timestamp NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+  UNIQUE (id)
+);
+
+CREATE TABLE account_log (
+  pk integer PRIMARY KEY AUTOINCREMENT,
+  table_action varchar(6) NOT NULL COLLATE NOCASE,
+  id varchar(100) NOT NULL COLLATE NOCASE,
+  cash decimal(20,5) DEFAULT NULL,
+  currency varchar(3) DEFAULT NULL COLLATE NOCASE,
+  created timestamp NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime'))
+);
+
+CREATE TRIGGER log_insert_account AFTER INSERT ON account
+BEGIN
+  INSERT INTO account_log (table_action, id, cash, currency) VALUES ('INSERT', NEW.id, NEW.cash, NEW.currency);
+END;
+
+CREATE TRIGGER log_update_account AFTER UPDATE ON account
+WHEN NEW.last_modified IS OLD.last_modified
+BEGIN
+  INSERT INTO account_log (table_action, id, cash, currency) VALUES ('UPDATE', NEW.id, NEW.cash, NEW.currency);
+  UPDATE account SET last_modified = strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime') WHERE rowid = NEW.rowid;
+END;
+
+CREATE TRIGGER log_delete_account AFTER DELETE ON account
+BEGIN
+  INSERT INTO account_log (table_action, id, cash, currency) VALUES ('DELETE', OLD.id, OLD.cash, OLD.currency);
+END;
+
+CREATE TABLE broker (
+  id varchar(100) NOT NULL COLLATE NOCASE,
+  description varchar(500) NOT NULL COLLATE NOCASE,
+  created timestamp NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+  last_modified timestamp NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+  PRIMARY KEY (id)
+);
+
+CREATE TABLE execution (
+  broker_id varchar(100) NOT NULL COLLATE NOCASE,
+  broker_order_id varchar(100) NOT NULL COLLATE NOCASE,
+  broker_execution_id varchar(100) NOT NULL COLLATE NOCASE,
+  gateway_order_id varchar(100) NOT NULL COLLATE NOCASE,
+  is_buy tinyint(1) NOT NULL,
+  contract varchar(50) NOT NULL COLLATE NOCASE,
+  quantity int(11) NOT NULL,
+  price decimal(20,5) NOT NULL,
+  leave_quantity int(11) DEFAULT NULL,
+  commission decimal(20,5) NOT NULL,
+  currency varchar(10) NOT NULL COLLATE NOCASE,
+  execution_datetime datetime NOT NULL,
+  created timestamp NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+  UNIQUE (broker_id, broker_execution_id)
+);
+
+CREATE INDEX execution_broker_id_broker_order_id_index ON execution (broker_id, broker_order_id);
+
+CREATE TABLE market (
+  market varchar(10) NOT NULL COLLATE NOCASE,
+  PRIMARY KEY (market)
+);
+
+CREATE TABLE instrument (
+  market varchar(10) NOT NULL COLLATE NOCASE REFERENCES market (market),
+  symbol varchar(10) NOT NULL COLLATE NOCASE,
+  code varchar(50) NOT NULL COLLATE NOCASE,
+  expiry date NOT NULL,
+  created timestamp NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+  last_modified timestamp NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+  PRIMARY KEY (market, symbol)
+);
+
+CREATE TRIGGER touch_instrument AFTER UPDATE ON instrument
+WHEN NEW.last_modified IS OLD.last_modified
+BEGIN
+  UPDATE instrument SET last_modified = strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime') WHERE rowid = NEW.rowid;
+END;
+
+CREATE TABLE portfolio (
+  id varchar(100) NOT NULL COLLATE NOCASE,
+  account_id varchar(100) NOT NULL COLLATE NOCASE REFERENCES account (id),
+  created timestamp NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+  last_modified timestamp NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+  UNIQUE (id)
+);
+
+CREATE INDEX portfolio_account_id_fk ON portfolio (account_id);
+
+CREATE TABLE strategy (
+  id varchar(100) NOT NULL COLLATE NOCASE,
+  description varchar(500) NOT NULL COLLATE NOCASE,
+  created timestamp NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+  last_modified timestamp NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+  PRIMARY KEY (id)
+);
+
+CREATE TABLE order_ (
+  session_id varchar(100) NOT NULL COLLATE NOCASE,
+  order_id int(25) NOT NULL,
+  parent_order_id int(25) DEFAULT NULL,
+  broker_id varchar(100) NOT NULL COLLATE NOCASE,
+  broker_order_id varchar(100) NOT NULL COLLATE NOCASE,
+  market varchar(10) NOT NULL COLLATE NOCASE REFERENCES market (market),
+  symbol varchar(10) DEFAULT NULL COLLATE NOCASE,
+  type varchar(7) NOT NULL COLLATE NOCASE,
+  is_buy tinyint(1) NOT NULL,
+  quantity int(11) NOT NULL,
+  price decimal(20,5) NOT NULL,
+  state varchar(17) DEFAULT NULL COLLATE NOCASE,
+  filled_quantity int(11) DEFAULT NULL,
+  remaining_quantity int(11) DEFAULT NULL,
+  qualifier varchar(6) DEFAULT NULL COLLATE NOCASE,
+  action varchar(16) DEFAULT NULL COLLATE NOCASE,
+  portfolio varchar(100) NOT NULL COLLATE NOCASE REFERENCES portfolio (id),
+  strategy varchar(100) DEFAULT NULL COLLATE NOCASE REFERENCES strategy (id),
+  reference varchar(100) DEFAULT NULL COLLATE NOCASE,
+  comment varchar(1000) DEFAULT NULL COLLATE NOCASE,
+  created timestamp NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+  last_modified timestamp NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+  PRIMARY KEY (broker_id, broker_order_id)
+);
+
+CREATE INDEX order__portfolio_id_fk ON order_ (portfolio);
+CREATE INDEX order__strategy_id_fk ON order_ (strategy);
+CREATE INDEX order_market_market_fk ON order_ (market);
+CREATE INDEX order_session_id_order_id_index ON order_ (session_id, order_id);
+
+CREATE TABLE order_log (
+  pk integer PRIMARY KEY AUTOINCREMENT,
+  table_action varchar(6) NOT NULL COLLATE NOCASE,
+  order_id int(25) NOT NULL,
+  parent_order_id int(25) DEFAULT NULL,
+  broker_id varchar(100) DEFAULT NULL COLLATE NOCASE,
+  broker_order_id varchar(100) NOT NULL COLLATE NOCASE,
+  session_id varchar(100) NOT NULL COLLATE NOCASE,
+  market varchar(10) NOT NULL COLLATE NOCASE,
+  symbol varchar(10) DEFAULT NULL COLLATE NOCASE,
+  type varchar(7) NOT NULL COLLATE NOCASE,
+  is_buy tinyint(1) NOT NULL,
+  quantity int(11) NOT NULL,
+  price decimal(20,5) NOT NULL,
+  state varchar(17) DEFAULT NULL COLLATE NOCASE,
+  filled_quantity int(11) DEFAULT NULL,
+  remaining_quantity int(11) DEFAULT NULL,
+  qualifier varchar(6) DEFAULT NULL COLLATE NOCASE,
+  portfolio varchar(100) DEFAULT NULL COLLATE NOCASE,
+  action varchar(16) DEFAULT NULL COLLATE NOCASE,
+  strategy varchar(100) DEFAULT NULL COLLATE NOCASE,
+  reference varchar(100) DEFAULT NULL COLLATE NOCASE,
+  comment varchar(1000) DEFAULT NULL COLLATE NOCASE,
+  created timestamp NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime'))
+);
+
+CREATE TRIGGER log_insert_order AFTER INSERT ON order_
+BEGIN
+  INSERT INTO order_log (table_action, session_id, order_id, parent_order_id, broker_id, broker_order_id, market,
+                         symbol, type, is_buy, quantity, price, state, filled_quantity, remaining_quantity, qualifier,
+                         action, portfolio, strategy, reference, comment)
+  VALUES ('INSERT', NEW.session_id, NEW.order_id, NEW.parent_order_id, NEW.broker_id, NEW.broker_order_id, NEW.market,
+          NEW.symbol, NEW.type, NEW.is_buy, NEW.quantity, NEW.price, NEW.state, NEW.filled_quantity,
+          NEW.remaining_quantity, NEW.qualifier, NEW.action, NEW.portfolio, NEW.strategy, NEW.reference, NEW.comment);
+END;
+
+CREATE TRIGGER log_update_order AFTER UPDATE ON order_
+WHEN NEW.last_modified IS OLD.last_modified
+BEGIN
+  INSERT INTO order_log (table_action, session_id, order_id, parent_order_id, broker_id, broker_order_id, market,
+                         symbol, type, is_buy, quantity, price, state, filled_quantity, remaining_quantity, qualifier,
+                         action, portfolio, strategy, reference, comment)
+  VALUES ('UPDATE', NEW.session_id, NEW.order_id, NEW.parent_order_id, NEW.broker_id, NEW.broker_order_id, NEW.market,
+          NEW.symbol, NEW.type, NEW.is_buy, NEW.quantity, NEW.price, NEW.state, NEW.filled_quantity,
+          NEW.remaining_quantity, NEW.qualifier, NEW.action, NEW.portfolio, NEW.strategy, NEW.reference, NEW.comment);
+  UPDATE order_ SET last_modified = strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime') WHERE rowid = NEW.rowid;
+END;
+
+CREATE TRIGGER log_delete_order AFTER DELETE ON order_
+BEGIN
+  INSERT INTO order_log (table_action, session_id, order_id, parent_order_id, broker_id, broker_order_id, market,
+                         symbol, type, is_buy, quantity, price, state, filled_quantity, remaining_quantity, qualifier,
+                         action, portfolio, strategy, reference, comment)
+  VALUES ('DELETE', OLD.session_id, OLD.order_id, OLD.parent_order_id, OLD.broker_id, OLD.broker_order_id, OLD.market,
+          OLD.symbol, OLD.type, OLD.is_buy, OLD.quantity, OLD.price, OLD.state, OLD.filled_quantity,
+          OLD.remaining_quantity, OLD.qualifier, OLD.action, OLD.portfolio, OLD.strategy, OLD.reference, OLD.comment);
+END;
+
+CREATE TABLE position (
+  portfolio_id varchar(100) NOT NULL COLLATE NOCASE REFERENCES portfolio (id),
+  strategy varchar(100) NOT NULL COLLATE NOCASE,
+  market varchar(10) NOT NULL COLLATE NOCASE,
+  symbol varchar(10) NOT NULL COLLATE NOCASE,
+  position int(11) NOT NULL,
+  avg_price decimal(20,5) DEFAULT NULL,
+  created timestamp NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+  last_modified timestamp NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+  PRIMARY KEY (portfolio_id, strategy)
+);
+
+CREATE TABLE position_log (
+  pk integer PRIMARY KEY AUTOINCREMENT,
+  table_action varchar(6) NOT NULL COLLATE NOCASE,
+  portfolio_id varchar(100) NOT NULL COLLATE NOCASE,
+  strategy varchar(100) NOT NULL COLLATE NOCASE,
+  market varchar(10) NOT NULL COLLATE NOCASE,
+  symbol varchar(10) NOT NULL COLLATE NOCASE,
+  position int(11) NOT NULL,
+  created timestamp NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime'))
+);
+
+CREATE TRIGGER log_insert_position AFTER INSERT ON position
+BEGIN
+  INSERT INTO position_log (table_action, portfolio_id, strategy, market, symbol, position)
+  VALUES ('INSERT', NEW.portfolio_id, NEW.strategy, NEW.market, NEW.symbol, NEW.position);
+END;
+
+CREATE TRIGGER log_update_position AFTER UPDATE ON position
+WHEN NEW.last_modified IS OLD.last_modified
+BEGIN
+  INSERT INTO position_log (table_action, portfolio_id, strategy, market, symbol, position)
+  VALUES ('UPDATE', NEW.portfolio_id, NEW.strategy, NEW.market, NEW.symbol, NEW.position);
+  UPDATE position SET last_modified = strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime') WHERE rowid = NEW.rowid;
+END;
+
+CREATE TRIGGER log_delete_position AFTER DELETE ON position
+BEGIN
+  INSERT INTO position_log (table_action, portfolio_id, strategy, market, symbol, position)
+  VALUES ('DELETE', OLD.portfolio_id, OLD.strategy, OLD.market, OLD.symbol, OLD.position);
+END;
+
+CREATE TABLE position_by_entry (
+  portfolio_id varchar(100) NOT NULL COLLATE NOCASE,
+  strategy varchar(100) NOT NULL COLLATE NOCASE,
+  market varchar(10) NOT NULL COLLATE NOCASE REFERENCES market (market),
+  symbol varchar(10) NOT NULL COLLATE NOCASE,
+  position int(11) NOT NULL,
+  avg_price decimal(20,5) DEFAULT NULL,
+  session_id varchar(100) NOT NULL COLLATE NOCASE,
+  order_id int(25) NOT NULL,
+  state varchar(12) DEFAULT NULL COLLATE NOCASE,
+  order_reference varchar(100) NOT NULL COLLATE NOCASE,
+  created timestamp NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+  PRIMARY KEY (portfolio_id, strategy, market, symbol, session_id, order_id)
+);
+
+CREATE INDEX position_by_entry_order_id_fk ON position_by_entry (session_id, order_id);
+
+CREATE TABLE session (
+  id varchar(100) NOT NULL COLLATE NOCASE,
+  next_request_id int(11) NOT NULL DEFAULT 0,
+  ip varchar(100) NOT NULL COLLATE NOCASE,
+  created timestamp NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+  last_modified timestamp NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+  PRIMARY KEY (id)
+);
+
+CREATE TRIGGER touch_session AFTER UPDATE ON session
+WHEN NEW.last_modified IS OLD.last_modified
+BEGIN
+  UPDATE session SET last_modified = strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime') WHERE rowid = NEW.rowid;
+END;
+
+CREATE TABLE operation (
+  portfolio_id varchar(100) NOT NULL COLLATE NOCASE,
+  strategy varchar(100) NOT NULL COLLATE NOCASE,
+  action varchar(100) NOT NULL COLLATE NOCASE,
+  position int(11) NOT NULL,
+  price decimal(20,5) DEFAULT NULL,
+  identity varchar(100) DEFAULT NULL COLLATE NOCASE,
+  order_reference varchar(100) NOT NULL COLLATE NOCASE,
+  created timestamp NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+  id integer PRIMARY KEY AUTOINCREMENT
+);
@@ -0,0 +1,15 @@
+-- Sample setup of the SQLite ledger, same as setup.samples.sql
+
+-- Setup account
+INSERT INTO account (id, cash, currency) VALUES ('WRCA001', 10000000.00000, 'USD');
+
+-- Setup portfolio
+INSERT INTO portfolio (id, account_id) VALUES ('WRCP001', 'WRCA001');
+
+-- Setup strategy details for auto contract roll
+INSERT INTO strategy (id, description) VALUES ('OMS', '');
+
+-- Setup markets
+INSERT INTO market (market) VALUES ('CME');
+INSERT INTO market (market) VALUES ('GLOBEX');
+INSERT INTO market (market) VALUES ('NYMEX');
@@ -4,6 +4,7 @@ import logging.handlers
 from datetime import datetime
 from logging import debug, info
 
+from oms.common.log import install_queue_logging, stop_queue_logging
 from oms.server.oms import Oms
 from oms.server.proxy import LocalBroker
 from smartquant.common.instrument import InstrumentRepository
@@ -41,6 +42,8 @@ def main():
     args = preprocessing()
     config = yamls2dict(args.cfg)
     setup_logging(args.log_level, config)
+    # the handlers are written by a background thread from now on
+    install_queue_logging()
     broker = LocalBroker(config)
     oms = Oms(config)
 
@@ -53,6 +56,7 @@ def main():
         start_loop(loop)
 
     oms.close()
+    stop_queue_logging()
     return 0
 
 
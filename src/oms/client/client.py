@@ -1,22 +1,30 @@
 import asyncio
+import itertools
 import logging
 import time
 from asyncio import AbstractEventLoop
 from datetime import datetime, timedelta
-from threading import Lock
-from typing import Callable, Dict
+from typing import Callable, Dict, List, Optional
 
 import zmq
 from zmq.asyncio import Context, Poller
 
+from oms.client.send_queue import SendQueue
+from oms.common.codec import CODECS, Codec, supported_codecs
 from oms.common.message import (ErrorCode, Heartbeat, MsgType, OmsMessage, OmsMessageError, OmsMessageExecution,
-                                OmsMessageHeartbeat, OmsMessageInit, OmsMessageNewOrder, OmsMessagePosition)
+                                OmsMessageHeartbeat, OmsMessageInit, OmsMessageNewOrder, OmsMessageNewOrderBatch,
+                                OmsMessagePosition, OmsMessagePositionDelta)
 from smartquant.common.market import Market
 from smartquant.execution.base import Action, OrderType
 
 
 class OmsClient:
-    def __init__(self, uri: str, session_name: str, account: str, strategies: Dict[str, str]):
+    """
+    The messages are queued and written to the socket on the event loop, the methods which send can be called from any
+    thread and never block. When the send queue is full, `place_order` and the other requests raise `SendQueueFull`.
+    """
+    def __init__(self, uri: str, session_name: str, account: str, strategies: Dict[str, str],
+                 send_high_water_mark: int = SendQueue.HIGH_WATER_MARK):
         self._logger = logging.getLogger(__name__)
         self._uri = uri
         self._session = session_name
@@ -26,12 +34,19 @@ class OmsClient:
         self._socket = None
         self._is_connected = False
         self._is_connection_ready = False
-        self._request_id = None
-        self._lock = Lock()
+        # next() of a count is atomic, the request IDs are taken without a lock
+        self._request_ids = None
+        self._send_queue = SendQueue(self._write, send_high_water_mark)
         self._callback_connection_state: Callable[[bool, str], None] = None
         self._callback_error: Callable[[OmsMessageError], None] = None
         self._callback_execution: Callable[[OmsMessageExecution], None] = None
         self._callback_position: Callable[[OmsMessagePosition], None] = None
+        self._callback_position_delta: Callable[[OmsMessagePositionDelta], None] = None
+        # local copy of the positions, kept up to date with the deltas sent by OMS
+        self._position: OmsMessagePosition = None
+        # request of the snapshot not answered yet, the deltas received meanwhile do not request another one
+        self._position_request_id: Optional[int] = None
+        self._codec: Codec = None
 
     @property
     def is_connected(self):
@@ -47,8 +62,34 @@ class OmsClient:
         self._callback_execution = callback
 
     def set_position_callback(self, callback: Callable[[OmsMessagePosition], None]):
+        """
+        The callback receives the whole position, also when OMS only sends what has changed
+        """
         self._callback_position = callback
 
+    def set_position_delta_callback(self, callback: Callable[[OmsMessagePositionDelta], None]):
+        self._callback_position_delta = callback
+
+    def set_send_queue_full_callback(self, callback: Callable[[bool], None]):
+        """
+        The callback receives True when the send queue is full, and False once it is drained
+        """
+        self._send_queue.set_full_callback(callback)
+
+    @property
+    def send_queue(self) -> SendQueue:
+        return self._send_queue
+
+    async def wait_writable(self):
+        """
+        Wait for the send queue to be drained if it is full
+        """
+        await self._send_queue.wait_writable()
+
+    @property
+    def position(self) -> OmsMessagePosition:
+        return self._position
+
     def install_loop(self, loop: asyncio.AbstractEventLoop):
         asyncio.ensure_future(self.run(loop))
         asyncio.ensure_future(self.run_heartbeat(loop))
@@ -60,8 +101,10 @@ class OmsClient:
 
         self._logger.info(f'Start to connect to {self._uri}...')
         self._socket = self._context.socket(zmq.DEALER)
-        self._socket.setsockopt(zmq.SNDHWM, 1)
+        # the messages beyond it wait in the send queue
+        self._socket.setsockopt(zmq.SNDHWM, self._send_queue.high_water_mark)
         self._socket.connect(self._uri)
+        self._send_queue.attach(loop)
         poller = Poller()
         poller.register(self._socket, zmq.POLLIN)
 
@@ -75,7 +118,7 @@ class OmsClient:
                 if socks.get(self._socket) == zmq.POLLIN:
                     msg = await self._socket.recv()
 
-                    decoded = OmsMessage.from_json(msg)
+                    decoded = OmsMessage.from_bytes(msg)
 
                     lvl = logging.DEBUG if decoded.msg_type == MsgType.HEARTBEAT else logging.INFO
                     self._logger.log(lvl, f'Received message: {decoded}')
@@ -94,6 +137,8 @@ class OmsClient:
                             self._logger.warning(f'Login rejected, will retry in {retry_interval} seconds...')
                             retry_interval = await self._wait_to_retry(retry_interval)
                             break
+                        if decoded.request_id is not None and decoded.request_id == self._position_request_id:
+                            self._position_request_id = None
                         if self._callback_error is not None:
                             self._callback_error(decoded)
                     elif decoded.msg_type == MsgType.EXECUTION:
@@ -113,15 +158,20 @@ class OmsClient:
                     elif decoded.msg_type == MsgType.NEW_ORDER:
                         raise NotImplementedError(f'{decoded.msg_type}')
                     elif decoded.msg_type == MsgType.NEXT_REQUEST_ID:
-                        self._request_id = decoded.next_request_id
+                        self._request_ids = itertools.count(decoded.next_request_id)
+                        self._codec = CODECS.get(decoded.codec) if decoded.codec else None
                         self._is_connected = True
+                        # the deltas of a new session are not based on the positions received so far
+                        self._position = None
+                        self._position_request_id = None
                         retry_interval = Heartbeat.RETRY_INTERVAL
                         self._call_connection_state_callback('Connected to OMS')
                     elif decoded.msg_type == MsgType.ORDER_STATUS:
                         raise NotImplementedError(f'{decoded.msg_type}')
                     elif decoded.msg_type == MsgType.POSITION:
-                        if self._callback_position is not None:
-                            self._callback_position(decoded)
+                        self._handle_position(decoded)
+                    elif decoded.msg_type == MsgType.POSITION_DELTA:
+                        self._handle_position_delta(decoded)
 
                 if Heartbeat.is_expired(last_server_heartbeat):
                     if self._is_connected:
@@ -145,7 +195,7 @@ class OmsClient:
                 out_msg = OmsMessageHeartbeat()
                 out_msg.timestamp = datetime.now().isoformat()
                 out_msg.next = datetime.fromtimestamp(time.time() + Heartbeat.INTERVAL).isoformat()
-                self._send(out_msg)
+                self._send(out_msg, force=True)
             await asyncio.sleep(Heartbeat.INTERVAL)
 
     def send_init(self):
@@ -153,7 +203,11 @@ class OmsClient:
         message.account_id = self._account
         message.session_id = self._session
         message.strategies = self._strategies
-        self._send(message)
+        message.features = [MsgType.POSITION_DELTA]
+        message.codecs = supported_codecs()
+        # the session starts in JSON until OMS replies with the codec it picks
+        self._codec = None
+        self._send(message, force=True)
 
     def place_order(self, market: Market, symbol: str, order_type: OrderType, is_buy: bool, quantity: int, price: float,
                     portfolio: str, action: Action, strategy: str, reference: str, comment: Dict[str, str]):
@@ -173,10 +227,29 @@ class OmsClient:
         self._send(msg)
         return msg.request_id
 
+    def place_orders(self, orders: List[OmsMessageNewOrderBatch.ItemOrder]) -> List[int]:
+        """
+        Send orders in one `new_order_batch` message
+
+        :return: the request ID of each order, the errors of an order are replied with it
+        """
+        msg = OmsMessageNewOrderBatch()
+        msg.request_id = self._next_request_id()
+        for order in orders:
+            order.request_id = self._next_request_id()
+        msg.orders = orders
+        self._send(msg)
+        return [order.request_id for order in orders]
+
     def request_position(self):
+        return self._request_position()
+
+    def _request_position(self, force: bool = False) -> int:
         msg = OmsMessagePosition()
         msg.request_id = self._next_request_id()
-        self._send(msg)
+        self._send(msg, force)
+        self._position_request_id = msg.request_id
+        return msg.request_id
 
     async def wait_till_ready(self, loop: AbstractEventLoop = None):
         while not self._is_connected and (loop is None or loop.is_running()):
@@ -195,12 +268,101 @@ class OmsClient:
         if self._callback_connection_state is not None:
             self._callback_connection_state(self.is_ready, *args)
 
-    def _next_request_id(self):
-        with self._lock:
-            r = self._request_id
-            self._request_id += 1
-        return r
+    def _handle_position(self, position: OmsMessagePosition):
+        if position.request_id == self._position_request_id:
+            self._position_request_id = None
+        self._position = position
+        if self._callback_position is not None:
+            self._callback_position(position)
 
-    def _send(self, msg: OmsMessage):
-        self._logger.debug(f'Send message: {msg}')
-        self._socket.send(msg.to_bytes())
+    def _handle_position_delta(self, delta: OmsMessagePositionDelta):
+        if self._position is None or self._position.version != delta.base_version:
+            if self._position_request_id is not None:
+                # the snapshot requested is not received yet, the deltas sent before it are dropped
+                self._logger.debug('Drop position delta based on version %s, waiting for the snapshot of request %s',
+                                   delta.base_version, self._position_request_id)
+                self._position = None
+                return
+
+            # a delta is lost or the snapshot is not received yet, start over from a snapshot
+            self._logger.warning(f'Expect position delta based on version '
+                                 f'{self._position.version if self._position else None}, got {delta.base_version}, '
+                                 f'request the full position')
+            self._position = None
+            if self._is_connected:
+                # the listener must not fail on a full send queue, the positions are not updated until it is sent
+                self._request_position(force=True)
+            return
+
+        self.apply_position_delta(self._position, delta)
+        if self._callback_position_delta is not None:
+            self._callback_position_delta(delta)
+        if self._callback_position is not None:
+            self._callback_position(self._position)
+
+    @staticmethod
+    def apply_position_delta(position: OmsMessagePosition, delta: OmsMessagePositionDelta):
+        """
+        Update a position snapshot in place with a delta
+        """
+        account = position.account
+        account.cash = delta.cash
+        account.currency = delta.currency
+        portfolios = {p.id: p for p in account.portfolios}
+        for p in account.portfolios:
+            for item in p.positions:
+                item.force_renew = False
+
+        for item in delta.positions:
+            portfolio = portfolios.get(item.portfolio)
+            if portfolio is None:
+                portfolio = portfolios[item.portfolio] = OmsMessagePosition.ItemPortfolio()
+                portfolio.id = item.portfolio
+                account.portfolios.append(portfolio)
+
+            current = next((p for p in portfolio.positions
+                            if p.market == item.market and p.symbol == item.symbol), None)
+            if item.is_removed:
+                if current is not None:
+                    portfolio.positions.remove(current)
+                continue
+            if current is None:
+                current = OmsMessagePosition.ItemPosition()
+                current.market = item.market
+                current.symbol = item.symbol
+                current.positions_by_entry = []
+                portfolio.positions.append(current)
+
+            current.strategy = item.strategy
+            current.position = item.position
+            current.avg_price = item.avg_price
+            current.force_renew = item.force_renew
+
+            changed = {e.order.order_id: e for e in item.positions_by_entry}
+            removed = set(item.removed_order_ids)
+            entries = [changed.pop(e.order.order_id, e) for e in current.positions_by_entry
+                       if e.order.order_id not in removed]
+            # entries are ordered from the latest, the remaining ones are new
+            current.positions_by_entry = list(changed.values()) + entries
+        position.version = delta.version
+
+    def _next_request_id(self) -> int:
+        return next(self._request_ids)
+
+    def _send(self, msg: OmsMessage, force: bool = False):
+        """
+        Encode the message in the calling thread and queue it
+
+        :param force: queue it even if the send queue is full, for the messages which keep the session alive
+        """
+        self._logger.debug('Send message: %s', msg)
+        self._send_queue.put(msg.encode(self._codec), force)
+
+    def _write(self, payload: bytes) -> bool:
+        if self._socket is None or self._socket.closed:
+            return False
+        try:
+            self._socket.send(payload, zmq.NOBLOCK)
+        except zmq.Again:
+            return False
+        return True
@@ -0,0 +1,258 @@
+import argparse
+import asyncio
+import logging
+import random
+from collections import Counter, deque
+from datetime import datetime
+from logging import debug, info
+from typing import Deque, Dict, List, Tuple
+
+from oms.client.client import OmsClient
+from oms.client.send_queue import SendQueueFull
+from oms.common.latency import LatencyRecorder, now
+from oms.common.message import OmsMessageError, OmsMessageExecution, OmsMessagePosition
+from oms.server.ledger.statement import TableOrder
+from smartquant.common.market import Market
+from smartquant.common.utils import create_loop, start_loop
+from smartquant.execution.base import Action, OrderType
+
+_logger = logging.getLogger(__name__)
+
+LOGGING_FORMAT = '%(asctime)s;%(levelname)s;%(name)s;%(process)d;%(threadName)s;%(funcName)s;%(message)s'
+DEFAULT_MIX = 'entry-mkt=4,exit-mkt=4,entry-lmt=1,exit-lmt=1'
+
+OrderKind = Tuple[Action, OrderType]
+
+
+class LoadSession:
+    """
+    One OMS client session sending orders and position requests at fixed rates.
+
+    There is no acknowledgement message for new orders, the ack latency is the time to the first message about the
+    order, i.e. an execution or an error. The execution latency is the time to the order being fully filled, and the
+    position latency the time to the reply of a position request.
+    """
+    def __init__(self, args, index: int, mix: Dict[OrderKind, int], latency: LatencyRecorder, counters: Counter):
+        self._args = args
+        self._mix = mix
+        self._latency = latency
+        self._counters = counters
+        self._strategy = f'{args.strategy}_{index:03d}'
+        self._client = OmsClient(args.conn, f'{args.session}_{index:03d}', args.account,
+                                 {self._strategy: args.portfolio})
+        self._client.set_error_callback(self._on_error)
+        self._client.set_execution_callback(self._on_execution)
+        self._client.set_position_callback(self._on_position)
+        # stamps of the orders and of the position requests in flight, by request ID
+        self._orders: Dict[int, int] = dict()
+        self._acked: Dict[int, int] = dict()
+        self._positions: Dict[int, int] = dict()
+        # references of the filled entries which are not exited yet, with their side
+        self._entries: Deque[Tuple[str, bool]] = deque()
+        self._n_orders = 0
+
+    @property
+    def n_in_flight(self) -> int:
+        return len(self._orders) + len(self._acked)
+
+    def install_loop(self, loop: asyncio.AbstractEventLoop):
+        self._client.install_loop(loop)
+
+    async def run(self, loop: asyncio.AbstractEventLoop, until: float):
+        await self._client.wait_till_ready(loop)
+        await asyncio.gather(self._run_orders(loop, until), self._run_positions(loop, until))
+
+    async def _run_orders(self, loop: asyncio.AbstractEventLoop, until: float):
+        kinds = list(self._mix.keys())
+        weights = list(self._mix.values())
+
+        def send():
+            self._place_order(*random.choices(kinds, weights)[0])
+
+        await self._run_at_rate(loop, until, self._args.rate, send)
+
+    async def _run_positions(self, loop: asyncio.AbstractEventLoop, until: float):
+        await self._run_at_rate(loop, until, self._args.position_rate, self._request_position)
+
+    @staticmethod
+    async def _run_at_rate(loop: asyncio.AbstractEventLoop, until: float, rate: float, send):
+        if rate <= 0:
+            return
+        interval = 1 / rate
+        # spread the sessions over the first interval
+        next_time = loop.time() + random.uniform(0, interval)
+        while loop.is_running() and next_time < until:
+            await asyncio.sleep(max(0.0, next_time - loop.time()))
+            send()
+            # the schedule does not drift when a send is late
+            next_time += interval
+
+    def _place_order(self, action: Action, order_type: OrderType):
+        if not self._client.is_ready:
+            self._counters['skipped'] += 1
+            return
+
+        self._n_orders += 1
+        comment = {}
+        if action == Action.ENTRY:
+            is_buy = random.random() < 0.5
+            comment[TableOrder.COMMENT_ORDER_REFERENCE] = f'{self._strategy}_{self._n_orders}'
+            comment[TableOrder.COMMENT_STOP_LOSS_OFFSET] = -self._args.stop_offset if is_buy else self._args.stop_offset
+        elif self._entries:
+            order_ref, is_buy = self._entries.popleft()
+            is_buy = not is_buy
+            comment[TableOrder.COMMENT_ORDER_REFERENCE] = order_ref
+        else:
+            is_buy = random.random() < 0.5
+
+        price = self._args.limit_price if order_type == OrderType.LMT else 0
+        try:
+            request_id = self._client.place_order(market=Market[self._args.market], symbol=self._args.symbol,
+                                                  order_type=order_type, is_buy=is_buy, quantity=1, price=price,
+                                                  portfolio=self._args.portfolio, action=action,
+                                                  strategy=self._strategy, reference='load_client', comment=comment)
+        except SendQueueFull:
+            self._counters['send-queue-full'] += 1
+            return
+        self._orders[request_id] = now()
+        self._counters[f'{action.value.lower()}-{order_type.value.lower()}'] += 1
+
+    def _request_position(self):
+        if not self._client.is_ready:
+            self._counters['skipped'] += 1
+            return
+        try:
+            request_id = self._client.request_position()
+        except SendQueueFull:
+            self._counters['send-queue-full'] += 1
+            return
+        self._positions[request_id] = now()
+        self._counters['position'] += 1
+
+    def _on_error(self, msg: OmsMessageError):
+        self._counters['error'] += 1
+        sent = self._orders.pop(msg.request_id, None)
+        if sent is not None:
+            self._latency.record('ack', 'error', sent)
+
+    def _on_execution(self, msg: OmsMessageExecution):
+        for item in msg.items:
+            self._counters['execution'] += 1
+            sent = self._orders.pop(item.order_id, None)
+            if sent is not None:
+                self._latency.record('ack', 'execution', sent)
+                self._acked[item.order_id] = sent
+            if item.remaining_quantity == 0:
+                sent = self._acked.pop(item.order_id, None)
+                if sent is not None:
+                    self._latency.record('execution', str(item.action).lower(), sent)
+                if item.action == Action.ENTRY.value and item.comment:
+                    order_ref = item.comment.get(TableOrder.COMMENT_ORDER_REFERENCE)
+                    if order_ref:
+                        self._entries.append((order_ref, item.is_buy))
+
+    def _on_position(self, msg: OmsMessagePosition):
+        sent = self._positions.pop(msg.request_id, None)
+        if sent is not None:
+            self._latency.record('position', 'reply', sent)
+
+
+def parse_mix(mix: str) -> Dict[OrderKind, int]:
+    """
+    :param mix: weights of the kinds of orders, e.g. `entry-mkt=4,exit-lmt=1`
+    """
+    result = dict()
+    for item in mix.split(','):
+        kind, weight = item.split('=')
+        action, order_type = kind.strip().upper().split('-')
+        result[(Action[action], OrderType[order_type])] = int(weight)
+    return result
+
+
+def report(latency: LatencyRecorder, counters: Counter, duration: float, sessions: List[LoadSession]):
+    _logger.info(f'Load test of {len(sessions)} session(s) over {duration:.1f} seconds')
+    for name, count in sorted(counters.items()):
+        _logger.info(f'{name}: {count} ({count / duration:.1f}/s)')
+    _logger.info(f'Orders in flight: {sum(s.n_in_flight for s in sessions)}')
+    _logger.info('Latency in microseconds:')
+    for line in latency.report():
+        _logger.info(line)
+
+
+async def run_load(sessions: List[LoadSession], latency: LatencyRecorder, counters: Counter, args,
+                   loop: asyncio.AbstractEventLoop):
+    _logger.info(f'Wait for {len(sessions)} OMS client(s) to be ready...')
+    start = loop.time()
+    until = start + args.duration
+    await asyncio.gather(*(s.run(loop, until) for s in sessions))
+    # wait for the replies of the last requests
+    await asyncio.sleep(args.drain)
+    report(latency, counters, loop.time() - start, sessions)
+    loop.stop()
+
+
+def configure_logging(args):
+    level = getattr(logging, args.log_level) if args.log_level else logging.INFO
+    logging.basicConfig(format=LOGGING_FORMAT, level=level)
+
+
+def configure_parser():
+    parser = argparse.ArgumentParser(prog=__package__)
+    parser.add_argument('--log-level', choices=['CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG'], default='WARNING',
+                        help='Log level, the report is logged at INFO level')
+    parser.add_argument('--conn', type=str, help='Connection string')
+    parser.add_argument('--clients', type=int, default=10, help='Number of concurrent sessions')
+    parser.add_argument('--session', type=str, default='load_client', help='Prefix of the session IDs')
+    parser.add_argument('--account', type=str, default='WRCA001', help='Account of the sessions')
+    parser.add_argument('--portfolio', type=str, default='WRCP001', help='Portfolio of the strategies')
+    parser.add_argument('--strategy', type=str, default='load_strategy',
+                        help='Prefix of the strategies, each session has its own strategy')
+    parser.add_argument('--market', type=str, default=Market.GLOBEX.name, help='Market of the orders')
+    parser.add_argument('--symbol', type=str, default='NQ', help='Symbol of the orders')
+    parser.add_argument('--mix', type=str, default=DEFAULT_MIX,
+                        help=f'Weights of the kinds of orders, default: {DEFAULT_MIX}')
+    parser.add_argument('--rate', type=float, default=1, help='Orders per second of each session')
+    parser.add_argument('--position-rate', type=float, default=0.2,
+                        help='Position requests per second of each session')
+    parser.add_argument('--limit-price', type=float, default=0,
+                        help='Price of the LMT orders, a price far from the market keeps them working')
+    parser.add_argument('--stop-offset', type=float, default=100, help='Stop-loss offset of the ENTRY orders')
+    parser.add_argument('--duration', type=float, default=60, help='Duration of the test in seconds')
+    parser.add_argument('--drain', type=float, default=5,
+                        help='Seconds to wait for the replies after the last request')
+    return parser
+
+
+def preprocessing():
+    parser = configure_parser()
+    args = parser.parse_args()
+    configure_logging(args)
+    debug(args)
+    return args
+
+
+def main():
+    args = preprocessing()
+    # the report is logged regardless of the log level of the clients
+    _logger.setLevel(logging.INFO)
+
+    latency = LatencyRecorder()
+    counters = Counter()
+    mix = parse_mix(args.mix)
+    sessions = [LoadSession(args, i, mix, latency, counters) for i in range(args.clients)]
+
+    with create_loop() as loop:
+        for s in sessions:
+            s.install_loop(loop)
+        asyncio.ensure_future(run_load(sessions, latency, counters, args, loop))
+        start_loop(loop)
+
+    return 0
+
+
+if __name__ == "__main__":
+    start_time = datetime.now()
+    try:
+        exit(main())
+    finally:
+        info(f'Finished. Total time elapsed: {datetime.now() - start_time}')
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Callable, Deque, List, Optional
+
+
+class SendQueueFull(Exception):
+    """
+    The message is not queued, the send queue is at its high-water mark
+    """
+
+
+class SendQueue:
+    """
+    Outbound messages of a client, queued from any thread and written to the socket in batches on the event loop, so
+    the threads which send never wait for the socket.
+
+    When the queue reaches its high-water mark, `put` raises `SendQueueFull` and the full callback is called with True,
+    it is called with False once the queue is drained below the low-water mark. Coroutines can await `wait_writable`
+    instead. The control messages, e.g. heartbeats, are always queued.
+    """
+    HIGH_WATER_MARK = 1000
+    # messages written per turn of the event loop, the rest are written on the next turn
+    BATCH_SIZE = 100
+    # delay before writing again when the socket would block
+    RETRY_DELAY_IN_SEC = 0.01
+
+    def __init__(self, write: Callable[[bytes], bool], high_water_mark: int = HIGH_WATER_MARK,
+                 batch_size: int = BATCH_SIZE):
+        """
+        :param write: writes a message without blocking, it returns False if the socket would block
+        """
+        self._logger = logging.getLogger(__name__)
+        self._write = write
+        self.high_water_mark = high_water_mark
+        self.low_water_mark = high_water_mark // 2
+        self._batch_size = batch_size
+        self._queue: Deque[bytes] = deque()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # a flush is scheduled on the loop, a thread which queues a message only wakes the loop up if it is not
+        self._scheduled = False
+        self._is_full = False
+        self._callback_full: Optional[Callable[[bool], None]] = None
+        self._waiters: List[asyncio.Future] = []
+
+    def __len__(self):
+        return len(self._queue)
+
+    @property
+    def is_full(self) -> bool:
+        return self._is_full
+
+    def set_full_callback(self, callback: Callable[[bool], None]):
+        """
+        The callback is called with True from the thread which finds the queue full, and with False from the event
+        loop once the queue is drained
+        """
+        self._callback_full = callback
+
+    def attach(self, loop: asyncio.AbstractEventLoop):
+        """
+        Write the messages on the loop, including those queued before
+        """
+        self._loop = loop
+        self._scheduled = True
+        loop.call_soon_threadsafe(self._flush)
+
+    def put(self, payload: bytes, force: bool = False):
+        """
+        Queue a message, it can be called from any thread
+
+        :param force: queue the message even if the queue is full
+        :raise SendQueueFull: if the queue is at its high-water mark
+        """
+        if not force and len(self._queue) >= self.high_water_mark:
+            if not self._is_full:
+                self._is_full = True
+                self._logger.warning('Send queue is full with %d messages', len(self._queue))
+                if self._callback_full is not None:
+                    self._callback_full(True)
+                if self._loop is not None:
+                    # the queue may be drained already, the flush tells the waiters
+                    self._loop.call_soon_threadsafe(self._flush)
+            raise SendQueueFull(f'{len(self._queue)} messages are waiting to be sent')
+
+        self._queue.append(payload)
+        # the flag is cleared by the flush before it drains the queue, the message is written either by the flush in
+        # progress or by the one scheduled here
+        if not self._scheduled and self._loop is not None:
+            self._scheduled = True
+            self._loop.call_soon_threadsafe(self._flush)
+
+    async def wait_writable(self):
+        """
+        Wait for the queue to be drained below the low-water mark if it is full, to be awaited on the loop
+        """
+        if not self._is_full:
+            return
+        future = self._loop.create_future()
+        self._waiters.append(future)
+        await future
+
+    def _flush(self):
+        self._scheduled = False
+        queue = self._queue
+        for _ in range(self._batch_size):
+            if not queue:
+                break
+            payload = queue.popleft()
+            if not self._write(payload):
+                queue.appendleft(payload)
+                self._scheduled = True
+                self._loop.call_later(self.RETRY_DELAY_IN_SEC, self._flush)
+                break
+        else:
+            if queue and not self._scheduled:
+                # let the other tasks of the loop run before the next batch
+                self._scheduled = True
+                self._loop.call_soon(self._flush)
+
+        if self._is_full and len(queue) <= self.low_water_mark:
+            self._notify_writable()
+
+    def _notify_writable(self):
+        if not self._is_full:
+            return
+        self._is_full = False
+        self._logger.info('Send queue is drained, %d messages are waiting to be sent', len(self._queue))
+        waiters, self._waiters = self._waiters, []
+        for w in waiters:
+            if not w.done():
+                w.set_result(None)
+        if self._callback_full is not None:
+            self._callback_full(False)
@@ -95,15 +95,15 @@ def connection_state_callback(flag: bool, msg: str):
 
 
 def error_callback(msg: OmsMessageError):
-    info(ujson.dumps(msg, indent=2))
+    info(ujson.dumps(msg.to_dict(), indent=2))
 
 
 def execution_callback(msg: OmsMessageExecution):
-    info(ujson.dumps(msg, indent=2))
+    info(ujson.dumps(msg.to_dict(), indent=2))
 
 
 def position_callback(msg: OmsMessagePosition):
-    info(ujson.dumps(msg, indent=2))
+    info(ujson.dumps(msg.to_dict(), indent=2))
 
 
 def main():
@@ -0,0 +1,37 @@
+import itertools
+
+from oms.client.client import OmsClient
+from oms.common.message import Msg, MsgType, OmsMessage
+
+
+def position(request_id, version):
+    return OmsMessage.from_dict({Msg.GROUP: Msg.OMS, Msg.MSG_TYPE: MsgType.POSITION, 'request_id': request_id,
+                                 'version': version, Msg.ACCOUNT: {'id': 'account_1', 'portfolios': []}})
+
+
+def position_delta(base_version):
+    return OmsMessage.from_dict({Msg.GROUP: Msg.OMS, Msg.MSG_TYPE: MsgType.POSITION_DELTA,
+                                 'base_version': base_version, 'version': base_version + 1, Msg.POSITIONS: []})
+
+
+class TestOmsClient:
+    def test_request_position_once(self):
+        client = OmsClient('tcp://localhost:5555', 'session_1', 'account_1', dict(), send_high_water_mark=1)
+        client._request_ids = itertools.count(1)
+        client._is_connected = True
+        client.send_queue.put(b'order')
+
+        # the send queue is full, the snapshot is requested all the same
+        client._handle_position_delta(position_delta(0))
+        client._handle_position_delta(position_delta(1))
+        assert len(client.send_queue) == 2
+        assert client.position is None
+
+        client._handle_position(position(1, 2))
+        client._handle_position_delta(position_delta(2))
+        assert client.position.version == 3
+
+        # the snapshot is answered, a lost delta requests a new one
+        client._handle_position_delta(position_delta(5))
+        assert len(client.send_queue) == 3
+        assert client.position is None
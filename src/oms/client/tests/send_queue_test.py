@@ -0,0 +1,85 @@
+import asyncio
+import threading
+
+import pytest
+
+from oms.client.send_queue import SendQueue, SendQueueFull
+
+
+class Socket:
+    def __init__(self):
+        self.sent = []
+        self.is_blocked = False
+
+    def write(self, payload: bytes) -> bool:
+        if self.is_blocked:
+            return False
+        self.sent.append(payload)
+        return True
+
+
+class TestSendQueue:
+    def test_flush_in_batches(self):
+        socket = Socket()
+        queue = SendQueue(socket.write, high_water_mark=10, batch_size=2)
+        for i in range(5):
+            queue.put(b'%d' % i)
+
+        async def run():
+            queue.attach(asyncio.get_running_loop())
+            await asyncio.sleep(0)
+            assert socket.sent == [b'0', b'1']
+            for _ in range(3):
+                await asyncio.sleep(0)
+
+        asyncio.run(run())
+        assert socket.sent == [b'0', b'1', b'2', b'3', b'4']
+        assert len(queue) == 0
+
+    def test_backpressure(self):
+        socket = Socket()
+        socket.is_blocked = True
+        queue = SendQueue(socket.write, high_water_mark=4)
+        states = []
+        queue.set_full_callback(states.append)
+
+        async def run():
+            queue.attach(asyncio.get_running_loop())
+            for i in range(4):
+                queue.put(b'%d' % i)
+            with pytest.raises(SendQueueFull):
+                queue.put(b'4')
+            assert queue.is_full and states == [True]
+            # the control messages are queued regardless
+            queue.put(b'heartbeat', force=True)
+
+            waiter = asyncio.ensure_future(queue.wait_writable())
+            await asyncio.sleep(0.05)
+            assert not waiter.done()
+            socket.is_blocked = False
+            await asyncio.wait_for(waiter, 1)
+
+        asyncio.run(run())
+        assert socket.sent == [b'0', b'1', b'2', b'3', b'heartbeat']
+        assert states == [True, False]
+        assert not queue.is_full
+
+    def test_put_from_threads(self):
+        socket = Socket()
+        queue = SendQueue(socket.write, high_water_mark=10000)
+
+        async def run():
+            queue.attach(asyncio.get_running_loop())
+            threads = [threading.Thread(target=lambda t=t: [queue.put(b'%d-%d' % (t, i)) for i in range(500)])
+                       for t in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                await asyncio.get_running_loop().run_in_executor(None, t.join)
+            while len(queue) > 0:
+                await asyncio.sleep(0.01)
+
+        asyncio.run(run())
+        assert len(socket.sent) == 2000
+        # the messages of a thread are sent in order
+        assert [p for p in socket.sent if p.startswith(b'0-')] == [b'0-%d' % i for i in range(500)]
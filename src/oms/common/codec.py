@@ -0,0 +1,95 @@
+from datetime import datetime
+from decimal import Decimal
+from enum import Enum
+from typing import Dict, List, Optional
+
+import ujson
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class Codec:
+    """
+    Wire encoding of OMS messages, a message is encoded from and decoded to a dict of plain values
+    """
+    JSON = 'json'
+    MSGPACK = 'msgpack'
+
+    name: str = None
+
+    def encode(self, msg) -> bytes:
+        raise NotImplementedError
+
+    def decode(self, payload: bytes) -> dict:
+        raise NotImplementedError
+
+
+class JsonCodec(Codec):
+    name = Codec.JSON
+
+    def encode(self, msg) -> bytes:
+        return msg.to_bytes()
+
+    def decode(self, payload: bytes) -> dict:
+        return ujson.loads(payload)
+
+
+class MsgPackCodec(Codec):
+    """
+    Same structure as the JSON encoding. Like ujson, datetimes are encoded as UNIX timestamps in seconds.
+    """
+    name = Codec.MSGPACK
+
+    def encode(self, msg) -> bytes:
+        return msgpack.packb(msg.to_dict(), default=self._default, use_bin_type=True)
+
+    def decode(self, payload: bytes) -> dict:
+        return msgpack.unpackb(payload, raw=False)
+
+    @staticmethod
+    def _default(v):
+        if isinstance(v, Decimal):
+            return float(v)
+        elif isinstance(v, datetime):
+            return int(v.timestamp())
+        elif isinstance(v, Enum):
+            return v.value
+        raise TypeError(f'Cannot encode {type(v)} with msgpack')
+
+
+JSON_CODEC = JsonCodec()
+
+CODECS: Dict[str, Codec] = {JSON_CODEC.name: JSON_CODEC}
+if msgpack is not None:
+    CODECS[Codec.MSGPACK] = MsgPackCodec()
+
+
+def supported_codecs() -> List[str]:
+    """
+    :return: names of the codecs available in this process, the most compact first
+    """
+    return [name for name in [Codec.MSGPACK, Codec.JSON] if name in CODECS]
+
+
+def choose_codec(names: Optional[List[str]]) -> Codec:
+    """
+    :param names: codecs supported by the peer, in order of preference
+    :return: the first codec of the peer available in this process, JSON if there is none
+    """
+    for name in names or []:
+        codec = CODECS.get(name)
+        if codec is not None:
+            return codec
+    return JSON_CODEC
+
+
+def detect_codec(payload: bytes) -> Codec:
+    """
+    Messages are encoded as maps, a JSON object starts with `{` which is never the first byte of a msgpack map
+    """
+    if payload[:1] == b'{' or Codec.MSGPACK not in CODECS:
+        return JSON_CODEC
+    return CODECS[Codec.MSGPACK]
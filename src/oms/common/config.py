@@ -1,12 +1,19 @@
+CFG_ACK_LATENCY_IN_MS = 'ack_latency_in_ms'
 CFG_BACKEND = 'backend'
+CFG_BATCH_SIZE = 'batch_size'
 CFG_BROKER = 'broker'
 CFG_BROKERS = 'brokers'
 CFG_CLIENT_ID = 'client_id'
+CFG_COMMISSION = 'commission'
 CFG_CONNECTION = 'connection'
+CFG_DATABASE = 'database'
+CFG_DISCONNECT_INTERVAL_IN_SEC = 'disconnect_interval_in_sec'
+CFG_FILL_LATENCY_IN_MS = 'fill_latency_in_ms'
 CFG_FRONTEND = 'frontend'
 CFG_HOST = 'host'
 CFG_INTERACTIVE_BROKER = 'interactive_broker'
 CFG_JOURNAL_FILE = 'journal_file'
+CFG_LEAST_OUTSTANDING = 'least_outstanding'
 CFG_LEDGER = 'ledger'
 CFG_LOCAL = 'local'
 CFG_MESSAGING = 'messaging'
@@ -14,7 +21,23 @@ CFG_MYSQL = 'mysql'
 CFG_NAME = 'name'
 CFG_NUM_OF_WORKERS = 'num_of_workers'
 CFG_OMS = 'oms'
+CFG_PARTIAL_FILLS = 'partial_fills'
+CFG_POOL_SIZE = 'pool_size'
 CFG_PORT = 'port'
+CFG_PRICES = 'prices'
 CFG_PROXY = 'proxy'
 CFG_RECONNECT_INTERVAL_IN_SEC = 'reconnect_interval_in_sec'
+CFG_REJECT_RATE = 'reject_rate'
+CFG_ROUND_ROBIN = 'round_robin'
+CFG_ROUTING = 'routing'
+CFG_SCHEMA = 'schema'
+CFG_SCRIPTS = 'scripts'
+CFG_SEED = 'seed'
+CFG_SIMULATED = 'simulated'
+CFG_SQLITE = 'sqlite'
+CFG_TICK_INTERVAL_IN_MS = 'tick_interval_in_ms'
+CFG_TICK_SIZE = 'tick_size'
 CFG_TYPE = 'type'
+CFG_VOLATILITY_IN_TICKS = 'volatility_in_ticks'
+CFG_WINDOW_IN_MS = 'window_in_ms'
+CFG_WRITE_BEHIND = 'write_behind'
@@ -0,0 +1,141 @@
+import time
+from contextlib import contextmanager
+from threading import Lock
+from typing import Dict, List, Tuple
+
+# monotonic clock stamps, in nanoseconds
+now = time.monotonic_ns
+
+
+class LatencyHistogram:
+    """
+    Histogram of latencies in microseconds with log-linear buckets, like HdrHistogram: values below `SUB_BUCKETS` have
+    their own bucket, above that every power of two is split in `SUB_BUCKETS / 2` buckets, i.e. a value is counted with
+    a precision of about 3%. The number of buckets is fixed, latencies above `MAX_VALUE_IN_US` are counted as the max.
+    """
+    SUB_BUCKET_BITS = 5
+    SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+    HALF_SUB_BUCKETS = SUB_BUCKETS >> 1
+    MAX_VALUE_IN_US = 60 * 1000 * 1000
+
+    def __init__(self):
+        self._lock = Lock()
+        self._counts = [0] * (self._index(self.MAX_VALUE_IN_US) + 1)
+        self._count = 0
+        self._total = 0
+        self._min = None
+        self._max = None
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @property
+    def mean(self) -> float:
+        return self._total / self._count if self._count else 0
+
+    @property
+    def min(self) -> int:
+        return self._min
+
+    @property
+    def max(self) -> int:
+        return self._max
+
+    def record(self, value_in_us: int):
+        value_in_us = min(max(int(value_in_us), 0), self.MAX_VALUE_IN_US)
+        index = self._index(value_in_us)
+        with self._lock:
+            self._counts[index] += 1
+            self._count += 1
+            self._total += value_in_us
+            if self._min is None or value_in_us < self._min:
+                self._min = value_in_us
+            if self._max is None or value_in_us > self._max:
+                self._max = value_in_us
+
+    def percentile(self, p: float) -> int:
+        """
+        :param p: percentile between 0 and 100
+        :return: upper bound of the bucket holding the percentile, in microseconds, 0 if nothing is recorded
+        """
+        with self._lock:
+            if self._count == 0:
+                return 0
+            rank = max(1, round(self._count * p / 100))
+            seen = 0
+            for index, count in enumerate(self._counts):
+                seen += count
+                if seen >= rank:
+                    return min(self._upper_bound(index), self._max)
+        return self._max
+
+    @classmethod
+    def _index(cls, value: int) -> int:
+        if value < cls.SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - cls.SUB_BUCKET_BITS
+        return (shift + 1) * cls.HALF_SUB_BUCKETS + (value >> shift) - cls.HALF_SUB_BUCKETS
+
+    @classmethod
+    def _upper_bound(cls, index: int) -> int:
+        if index < cls.SUB_BUCKETS:
+            return index
+        shift = index // cls.HALF_SUB_BUCKETS - 1
+        sub_bucket = index % cls.HALF_SUB_BUCKETS + cls.HALF_SUB_BUCKETS
+        return ((sub_bucket + 1) << shift) - 1
+
+
+class LatencyRecorder:
+    """
+    Latency histograms per stage of the request path and per label, e.g. the message type or the kind of statement
+    """
+    PERCENTILES = (50, 90, 99, 99.9)
+
+    def __init__(self):
+        self._lock = Lock()
+        self._histograms: Dict[Tuple[str, str], LatencyHistogram] = dict()
+
+    def record(self, stage: str, label: str, start: int, end: int = None):
+        """
+        :param start: stamp taken with `now()` when the stage starts
+        :param end: stamp when the stage ends, now if not given
+        """
+        elapsed = (now() if end is None else end) - start
+        self._histogram(stage, label).record(elapsed // 1000)
+
+    @contextmanager
+    def measure(self, stage: str, label: str):
+        start = now()
+        try:
+            yield
+        finally:
+            self.record(stage, label, start)
+
+    def report(self, reset: bool = False) -> List[str]:
+        """
+        :param reset: start over with empty histograms
+        :return: one line per stage and label, latencies in microseconds
+        """
+        with self._lock:
+            histograms = self._histograms
+            if reset:
+                self._histograms = dict()
+
+        lines = []
+        for (stage, label), h in sorted(histograms.items()):
+            percentiles = ', '.join(f'p{p:g}={h.percentile(p)}' for p in self.PERCENTILES)
+            lines.append(f'{stage}/{label}: count={h.count}, min={h.min}, mean={h.mean:.0f}, {percentiles}, '
+                         f'max={h.max}')
+        return lines
+
+    def _histogram(self, stage: str, label: str) -> LatencyHistogram:
+        key = (stage, label)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, LatencyHistogram())
+        return histogram
+
+
+LATENCY = LatencyRecorder()
@@ -0,0 +1,98 @@
+import atexit
+import logging
+import logging.handlers
+import time
+from queue import SimpleQueue
+from threading import Lock
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler which leaves the formatting of the records to the writer thread, the logging thread only enqueues
+    them. The arguments of a record are formatted later, they must not be modified after the call to the logger.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+_lock = Lock()
+_listener: Optional[logging.handlers.QueueListener] = None
+_handlers: List[logging.Handler] = []
+
+
+def install_queue_logging() -> bool:
+    """
+    Move the handlers of the root logger behind a queue written by a background thread, so the threads which log do
+    not wait for the I/O. Call it once the handlers are configured, the queue is flushed on exit.
+
+    :return: False if it is installed already or there is no handler
+    """
+    global _listener, _handlers
+    root = logging.getLogger()
+    with _lock:
+        if _listener is not None or not root.handlers:
+            return False
+        _handlers = list(root.handlers)
+        queue = SimpleQueue()
+        _listener = logging.handlers.QueueListener(queue, *_handlers, respect_handler_level=True)
+        for h in _handlers:
+            root.removeHandler(h)
+        root.addHandler(DeferredQueueHandler(queue))
+        _listener.start()
+    return True
+
+
+@atexit.register
+def stop_queue_logging():
+    """
+    Write the queued records and put the handlers back on the root logger
+    """
+    global _listener, _handlers
+    with _lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        root = logging.getLogger()
+        for h in list(root.handlers):
+            if isinstance(h, DeferredQueueHandler):
+                root.removeHandler(h)
+        for h in _handlers:
+            root.addHandler(h)
+        _listener = None
+        _handlers = []
+
+
+class RateLimitedLog:
+    """
+    Log at most `rate` records per second for each key, e.g. each kind of SQL statement, with bursts of up to `burst`
+    records. The number of records dropped for a key is logged with the next record of the key.
+    """
+    def __init__(self, logger: logging.Logger, level: int = logging.INFO, rate: float = 10, burst: int = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self._logger = logger
+        self._level = level
+        self._rate = rate
+        self._burst = burst if burst is not None else max(int(rate), 1)
+        self._clock = clock
+        self._lock = Lock()
+        # tokens left, time of the last refill and records dropped, by key
+        self._buckets: Dict[str, Tuple[float, float, int]] = dict()
+
+    def log(self, key: str, msg: str, *args):
+        if not self._logger.isEnabledFor(self._level):
+            return
+
+        now = self._clock()
+        with self._lock:
+            tokens, last, dropped = self._buckets.get(key, (self._burst, now, 0))
+            tokens = min(self._burst, tokens + (now - last) * self._rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now, dropped + 1)
+                return
+            self._buckets[key] = (tokens - 1, now, 0)
+
+        if dropped:
+            self._logger.log(self._level, msg + ' (%d dropped)', *args, dropped, stacklevel=2)
+        else:
+            self._logger.log(self._level, msg, *args, stacklevel=2)
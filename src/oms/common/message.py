@@ -1,10 +1,11 @@
+import copy
 from datetime import datetime, timedelta
 from decimal import Decimal
-from typing import Dict, List
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
 
 import ujson
+from oms.common.codec import Codec, detect_codec
 from oms.server.ledger.statement import TableOperation
-from smartquant.common.message import JsonMessage
 
 
 class Heartbeat:
@@ -57,49 +58,173 @@ class MsgType:
     INIT = 'init'
     MODIFY_ORDER = 'modify_order'
     NEW_ORDER = 'new_order'
+    NEW_ORDER_BATCH = 'new_order_batch'
     NEXT_REQUEST_ID = 'next_request_id'
     ORDER_STATUS = 'order_status'
     POSITION = 'position'
+    POSITION_DELTA = 'position_delta'
 
 
 ENCODING = 'utf-8'
 
 
-class OmsMessage(JsonMessage):
+_MISSING = object()
+
+
+class _Field(NamedTuple):
+    name: str
+    default: Any
+    # class of the nested message(s) held by the field, if any
+    item_class: Optional[type]
+    is_list: bool
+
+
+class Message:
+    """
+    Base of the OMS messages and of their items.
+
+    Fields are declared in `__slots__`. The field table of a class, i.e. the name, the default value and the class of
+    the nested messages of each field, is built once when the class is first decoded. `_items` names the class of the
+    items of the fields holding a list of messages, `_objects` the class of the fields holding one message.
+    """
+    __slots__ = ()
+    _items: Dict[str, str] = {}
+    _objects: Dict[str, str] = {}
+
+    def __init__(self, msg: dict = None):
+        self.read_msg(msg)
+
+    def read_msg(self, msg: Optional[dict]):
+        if msg is None:
+            return
+        for field in self._field_table():
+            value = msg.get(field.name, _MISSING)
+            if value is not _MISSING:
+                setattr(self, field.name, self._decode_value(field, value))
+        self._after_read()
+
+    def to_dict(self) -> dict:
+        return {field.name: _to_plain(getattr(self, field.name, None)) for field in self._field_table()}
+
+    def __str__(self):
+        return str(self.to_dict())
+
+    def _after_read(self):
+        pass
+
+    @classmethod
+    def _decode(cls, msg: dict):
+        """
+        Build a message directly from a parsed dict, without going through `__init__`
+        """
+        obj = cls.__new__(cls)
+        for field in cls._field_table():
+            value = msg.get(field.name, _MISSING)
+            if value is _MISSING:
+                value = copy.copy(field.default) if isinstance(field.default, (list, dict)) else field.default
+            else:
+                value = cls._decode_value(field, value)
+            setattr(obj, field.name, value)
+        obj._after_read()
+        return obj
+
+    @staticmethod
+    def _decode_value(field: _Field, value):
+        if field.item_class is None or value is None:
+            return value
+        if field.is_list:
+            return [field.item_class._decode(item) for item in value]
+        return field.item_class._decode(value)
+
+    @classmethod
+    def _field_table(cls) -> Tuple[_Field, ...]:
+        table = cls.__dict__.get('_table')
+        if table is None:
+            names = []
+            for klass in reversed(cls.__mro__):
+                for name in klass.__dict__.get('__slots__', ()):
+                    if name not in names:
+                        names.append(name)
+
+            prototype = cls()
+            table = []
+            for name in names:
+                item_class = cls._items.get(name) or cls._objects.get(name)
+                table.append(_Field(name, getattr(prototype, name, None),
+                                    _resolve(item_class) if item_class else None, name in cls._items))
+            table = tuple(table)
+            cls._table = table
+        return table
+
+
+def _resolve(path: str) -> type:
+    """
+    :param path: class name in this module, e.g. `OmsMessagePosition.ItemPosition`
+    """
+    names = path.split('.')
+    obj = globals()[names[0]]
+    for name in names[1:]:
+        obj = getattr(obj, name)
+    return obj
+
+
+def _to_plain(v):
+    if isinstance(v, Message):
+        return v.to_dict()
+    elif isinstance(v, (list, tuple)):
+        return [_to_plain(item) for item in v]
+    elif isinstance(v, dict):
+        return {k: _to_plain(item) for k, item in v.items()}
+    return v
+
+
+class OmsMessage(Message):
+    __slots__ = ('group', 'msg_type')
+
+    # message types which can be decoded, filled once all message classes are defined
+    TYPES: Dict[str, type] = {}
+
+    @staticmethod
+    def from_bytes(payload: bytes):
+        """
+        Decode a message in any supported encoding
+        """
+        return OmsMessage.from_dict(detect_codec(payload).decode(payload))
+
     @staticmethod
     def from_json(json_str: str):
-        msg = ujson.loads(json_str)
+        return OmsMessage.from_dict(ujson.loads(json_str))
+
+    @staticmethod
+    def from_dict(msg: dict):
         if msg[Msg.GROUP] != Msg.OMS:
             raise ValueError(f'Expect message group {Msg.OMS}, get {msg[Msg.GROUP]}')
         msg_type = msg[Msg.MSG_TYPE]
 
-        if msg_type == MsgType.INIT:
-            return OmsMessageInit(msg)
-        elif msg_type == MsgType.NEXT_REQUEST_ID:
-            return OmsMessageNextRequestId(msg)
-        elif msg_type == MsgType.NEW_ORDER:
-            return OmsMessageNewOrder(msg)
-        # elif msg_type == MsgType.ORDER_STATUS:
-        #     return OmsMessageOrderStatus(msg)
-        elif msg_type == MsgType.EXECUTION:
-            return OmsMessageExecution(msg)
-        elif msg_type == MsgType.POSITION:
-            return OmsMessagePosition(msg)
-        elif msg_type == MsgType.HEARTBEAT:
-            return OmsMessageHeartbeat(msg)
-        elif msg_type == MsgType.ERROR:
-            return OmsMessageError(msg)
-
-        raise ValueError(f'Unsupported message type: {msg_type}')
+        cls = OmsMessage.TYPES.get(msg_type)
+        if cls is None:
+            raise ValueError(f'Unsupported message type: {msg_type}')
+        return cls._decode(msg)
 
     def __init__(self, msg_type: str):
-        super().__init__(Msg.OMS, msg_type)
+        self.group = Msg.OMS
+        self.msg_type = msg_type
 
-    def __str__(self):
-        return str(self.__dict__)
+    def encode(self, codec: Codec = None) -> bytes:
+        """
+        :param codec: JSON if not given
+        """
+        if codec is None:
+            return self.to_bytes()
+        return codec.encode(self)
+
+    def to_bytes(self) -> bytes:
+        return ujson.dumps(self.to_dict()).encode(ENCODING)
 
 
 class OmsMessageError(OmsMessage):
+    __slots__ = ('error_code', 'message', 'session_id', 'request_id')
+
     def __init__(self, msg: dict = None):
         super().__init__(MsgType.ERROR)
         self.error_code: int = None
@@ -110,22 +235,34 @@ class OmsMessageError(OmsMessage):
 
 
 class OmsMessageInit(OmsMessage):
+    __slots__ = ('session_id', 'account_id', 'strategies', 'features', 'codecs')
+
     def __init__(self, msg: dict = None):
         super().__init__(MsgType.INIT)
         self.session_id: str = None
         self.account_id: str = None
         self.strategies: Dict[str, str] = None
+        # optional message types supported by the client, e.g. `MsgType.POSITION_DELTA`
+        self.features: List[str] = None
+        # encodings supported by the client in order of preference, JSON if not given
+        self.codecs: List[str] = None
         self.read_msg(msg)
 
 
 class OmsMessageNextRequestId(OmsMessage):
+    __slots__ = ('next_request_id', 'codec')
+
     def __init__(self, msg: dict = None):
         super().__init__(MsgType.NEXT_REQUEST_ID)
         self.next_request_id: int = None
+        # encoding of the following messages in both directions
+        self.codec: str = None
         self.read_msg(msg)
 
 
 class OmsMessageExecutionHistory(OmsMessage):
+    __slots__ = ()
+
     def __init__(self, msg: dict = None):
         super().__init__(MsgType.EXECUTION_HISTORY)
         self.read_msg(msg)
@@ -133,6 +270,8 @@ class OmsMessageExecutionHistory(OmsMessage):
 
 
 class OmsMessageOrderStatus(OmsMessage):
+    __slots__ = ()
+
     def __init__(self, msg: dict = None):
         super().__init__(MsgType.ORDER_STATUS)
         self.read_msg(msg)
@@ -140,6 +279,9 @@ class OmsMessageOrderStatus(OmsMessage):
 
 
 class OmsMessageNewOrder(OmsMessage):
+    __slots__ = ('request_id', 'market', 'symbol', 'order_type', 'is_buy', 'quantity', 'price', 'portfolio', 'action',
+                 'strategy', 'reference', 'comment')
+
     def __init__(self, msg: dict = None):
         super().__init__(MsgType.NEW_ORDER)
         self.request_id: int = None
@@ -157,7 +299,42 @@ class OmsMessageNewOrder(OmsMessage):
         self.read_msg(msg)
 
 
+class OmsMessageNewOrderBatch(OmsMessage):
+    """
+    New orders sent at once, e.g. to rebalance a portfolio. Each order has its own request ID, the errors of an order
+    are replied with that ID.
+    """
+    class ItemOrder(Message):
+        __slots__ = OmsMessageNewOrder.__slots__
+
+        def __init__(self, msg: dict = None):
+            self.request_id: int = None
+            self.market: str = None
+            self.symbol: str = None
+            self.order_type: str = None
+            self.is_buy: bool = None
+            self.quantity: int = None
+            self.price: Decimal = None
+            self.portfolio: str = None
+            self.action: str = None
+            self.strategy: str = None
+            self.reference: str = None
+            self.comment: Dict[str, str] = None
+            super().__init__(msg)
+
+    __slots__ = ('request_id', 'orders')
+    _items = {Msg.ORDERS: 'OmsMessageNewOrderBatch.ItemOrder'}
+
+    def __init__(self, msg: dict = None):
+        super().__init__(MsgType.NEW_ORDER_BATCH)
+        self.request_id: int = None
+        self.orders: List[OmsMessageNewOrderBatch.ItemOrder] = []
+        self.read_msg(msg)
+
+
 class OmsMessageModifyOrder(OmsMessage):
+    __slots__ = ()
+
     def __init__(self, msg: dict = None):
         super().__init__(MsgType.MODIFY_ORDER)
         self.read_msg(msg)
@@ -165,6 +342,8 @@ class OmsMessageModifyOrder(OmsMessage):
 
 
 class OmsMessageDeleteOrder(OmsMessage):
+    __slots__ = ('request_id', 'order_id')
+
     def __init__(self, msg: dict = None):
         super().__init__(MsgType.DELETE_ORDER)
         self.request_id = None
@@ -174,7 +353,10 @@ class OmsMessageDeleteOrder(OmsMessage):
 
 
 class OmsMessageExecution(OmsMessage):
-    class ItemExecution(JsonMessage):
+    class ItemExecution(Message):
+        __slots__ = ('order_id', 'execution_id', 'execution_time', 'market', 'symbol', 'is_buy', 'quantity', 'price',
+                     'remaining_quantity', 'portfolio', 'strategy', 'action', 'reference', 'comment')
+
         def __init__(self, msg: dict = None):
             self.order_id: str = None
             self.execution_id: str = None
@@ -190,21 +372,23 @@ class OmsMessageExecution(OmsMessage):
             self.action: str = None
             self.reference: str = None
             self.comment: Dict[str, str] = {}
-            self.read_msg(msg)
+            super().__init__(msg)
+
+    __slots__ = ('request_id', 'items')
+    _items = {Msg.ITEMS: 'OmsMessageExecution.ItemExecution'}
 
     def __init__(self, msg: dict = None):
         super().__init__(MsgType.EXECUTION)
         self.request_id: int = None
         self.items: List[OmsMessageExecution.ItemExecution] = []
         self.read_msg(msg)
-        if msg is not None:
-            self.items = []
-            for item in msg[Msg.ITEMS]:
-                self.items.append(self.ItemExecution(item))
 
 
 class OmsMessagePosition(OmsMessage):
-    class ItemOrder(JsonMessage):
+    class ItemOrder(Message):
+        __slots__ = ('order_id', 'market', 'symbol', 'order_type', 'is_buy', 'quantity', 'price', 'portfolio', 'action',
+                     'strategy', 'reference', 'comment')
+
         def __init__(self, msg: dict = None):
             self.order_id: int = None
             self.market = None
@@ -218,27 +402,31 @@ class OmsMessagePosition(OmsMessage):
             self.strategy: str = None
             self.reference: str = None
             self.comment: Dict[str, str] = None
-            self.read_msg(msg)
+            super().__init__(msg)
+
+    class ItemPositionByEntry(Message):
+        __slots__ = ('position', 'avg_price', 'state', 'created', 'operations', 'order')
+        _objects = {Msg.ORDER: 'OmsMessagePosition.ItemOrder'}
 
-    class ItemPositionByEntry(JsonMessage):
         def __init__(self, msg: dict = None):
             self.position: int = None
             self.avg_price: float = None
             self.state = None
             self.created = None
             self.operations = None
-            self.read_msg(msg)
-            if msg is not None:
-                try:
-                    self.order = OmsMessagePosition.ItemOrder(msg[Msg.ORDER])
-                except KeyError:
-                    self.order = None
+            self.order: OmsMessagePosition.ItemOrder = None
+            super().__init__(msg)
+
+        def _after_read(self):
             if self.operations:
                 for item in self.operations:
                     if TableOperation.CREATED in item:
                         item[TableOperation.CREATED] = datetime.fromtimestamp(item[TableOperation.CREATED])
 
-    class ItemPosition(JsonMessage):
+    class ItemPosition(Message):
+        __slots__ = ('strategy', 'market', 'symbol', 'position', 'avg_price', 'force_renew', 'positions_by_entry')
+        _items = {Msg.POSITIONS_BY_ENTRY: 'OmsMessagePosition.ItemPositionByEntry'}
+
         def __init__(self, msg: dict = None):
             self.strategy: str = None
             self.market: str = None
@@ -246,47 +434,71 @@ class OmsMessagePosition(OmsMessage):
             self.position: int = None
             self.avg_price: float = None
             self.force_renew: bool = False
-            self.read_msg(msg)
-            if msg is not None:
-                self.positions_by_entry = []
-                try:
-                    for item in msg[Msg.POSITIONS_BY_ENTRY]:
-                        self.positions_by_entry.append(OmsMessagePosition.ItemPositionByEntry(item))
-                except KeyError:
-                    pass
-
-    class ItemPortfolio(JsonMessage):
+            self.positions_by_entry: List[OmsMessagePosition.ItemPositionByEntry] = []
+            super().__init__(msg)
+
+    class ItemPortfolio(Message):
+        __slots__ = ('id', 'positions')
+        _items = {Msg.POSITIONS: 'OmsMessagePosition.ItemPosition'}
+
         def __init__(self, msg: dict = None):
             self.id: str = None
             self.positions: List[OmsMessagePosition.ItemPosition] = []
-            self.read_msg(msg)
-            if msg is not None:
-                self.positions = []
-                for item in msg[Msg.POSITIONS]:
-                    self.positions.append(OmsMessagePosition.ItemPosition(item))
+            super().__init__(msg)
+
+    class ItemAccount(Message):
+        __slots__ = ('id', 'cash', 'currency', 'portfolios')
+        _items = {Msg.PORTFOLIOS: 'OmsMessagePosition.ItemPortfolio'}
 
-    class ItemAccount(JsonMessage):
         def __init__(self, msg: dict = None):
             self.id: str = None
             self.cash: float = None
             self.currency: str = None
             self.portfolios: List[OmsMessagePosition.ItemPortfolio] = []
-            self.read_msg(msg)
-            if msg is not None:
-                self.portfolios: List[OmsMessagePosition.ItemPortfolio] = []
-                for item in msg[Msg.PORTFOLIOS]:
-                    self.portfolios.append(OmsMessagePosition.ItemPortfolio(item))
+            super().__init__(msg)
+
+    __slots__ = ('request_id', 'version', 'account')
+    _objects = {Msg.ACCOUNT: 'OmsMessagePosition.ItemAccount'}
 
     def __init__(self, msg: dict = None):
         super().__init__(MsgType.POSITION)
         self.request_id: int = None
+        self.version: int = None
         self.account: OmsMessagePosition.ItemAccount = None
         self.read_msg(msg)
-        if msg is not None:
-            self.account = self.ItemAccount(msg[Msg.ACCOUNT])
+
+
+class OmsMessagePositionDelta(OmsMessage):
+    """
+    Positions which have changed since the message of version `base_version`, each with only its new or changed
+    entries, and the order IDs of the entries which are gone
+    """
+    class ItemPosition(OmsMessagePosition.ItemPosition):
+        __slots__ = ('portfolio', 'removed_order_ids', 'is_removed')
+
+        def __init__(self, msg: dict = None):
+            self.portfolio: str = None
+            self.removed_order_ids: List[int] = []
+            self.is_removed: bool = False
+            super().__init__(msg)
+
+    __slots__ = ('version', 'base_version', 'account', 'cash', 'currency', 'positions')
+    _items = {Msg.POSITIONS: 'OmsMessagePositionDelta.ItemPosition'}
+
+    def __init__(self, msg: dict = None):
+        super().__init__(MsgType.POSITION_DELTA)
+        self.version: int = None
+        self.base_version: int = None
+        self.account: str = None
+        self.cash: float = None
+        self.currency: str = None
+        self.positions: List[OmsMessagePositionDelta.ItemPosition] = []
+        self.read_msg(msg)
 
 
 class OmsMessageHeartbeat(OmsMessage):
+    __slots__ = ('timestamp', 'next', 'is_ready', 'message')
+
     def __init__(self, msg: dict = None):
         super().__init__(MsgType.HEARTBEAT)
         self.timestamp: str = None
@@ -294,3 +506,16 @@ class OmsMessageHeartbeat(OmsMessage):
         self.is_ready: bool = None
         self.message: str = None
         self.read_msg(msg)
+
+
+OmsMessage.TYPES = {
+    MsgType.INIT: OmsMessageInit,
+    MsgType.NEXT_REQUEST_ID: OmsMessageNextRequestId,
+    MsgType.NEW_ORDER: OmsMessageNewOrder,
+    MsgType.NEW_ORDER_BATCH: OmsMessageNewOrderBatch,
+    MsgType.EXECUTION: OmsMessageExecution,
+    MsgType.POSITION: OmsMessagePosition,
+    MsgType.POSITION_DELTA: OmsMessagePositionDelta,
+    MsgType.HEARTBEAT: OmsMessageHeartbeat,
+    MsgType.ERROR: OmsMessageError,
+}
@@ -0,0 +1,43 @@
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from oms.common.codec import CODECS, JSON_CODEC, Codec, choose_codec, detect_codec
+from oms.common.message import MsgType, OmsMessage, OmsMessageExecution, OmsMessageHeartbeat
+
+msgpack = pytest.importorskip('msgpack')
+
+
+class TestCodec:
+    def test_choose_codec(self):
+        assert choose_codec(None) is JSON_CODEC
+        assert choose_codec(['unknown']) is JSON_CODEC
+        assert choose_codec(['unknown', Codec.MSGPACK, Codec.JSON]) is CODECS[Codec.MSGPACK]
+
+    def test_detect_codec(self):
+        assert detect_codec(b'{"group":"oms"}') is JSON_CODEC
+        assert detect_codec(msgpack.packb({'group': 'oms'})) is CODECS[Codec.MSGPACK]
+
+    def test_msgpack_round_trip(self):
+        msg = OmsMessageExecution()
+        msg.request_id = 123
+        item = OmsMessageExecution.ItemExecution()
+        item.order_id = 456
+        item.quantity = 2
+        item.price = Decimal('7000.25')
+        item.comment = {'order_reference': 'ref_001'}
+        msg.items.append(item)
+
+        decoded = OmsMessage.from_bytes(msg.encode(CODECS[Codec.MSGPACK]))
+        assert decoded.msg_type == MsgType.EXECUTION
+        assert decoded.request_id == 123
+        assert decoded.items[0].order_id == 456
+        assert decoded.items[0].price == 7000.25
+        assert decoded.items[0].comment == {'order_reference': 'ref_001'}
+
+    def test_msgpack_datetime(self):
+        msg = OmsMessageHeartbeat()
+        msg.timestamp = datetime(2019, 8, 6, 16, 5, 2)
+        decoded = CODECS[Codec.MSGPACK].decode(msg.encode(CODECS[Codec.MSGPACK]))
+        assert decoded['timestamp'] == int(datetime(2019, 8, 6, 16, 5, 2).timestamp())
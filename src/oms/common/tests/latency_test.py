@@ -0,0 +1,45 @@
+from oms.common.latency import LatencyHistogram, LatencyRecorder
+
+
+class TestLatencyHistogram:
+    def test_buckets(self):
+        h = LatencyHistogram
+        for value in [0, 1, 31, 32, 33, 63, 64, 1000, 123456, h.MAX_VALUE_IN_US]:
+            index = h._index(value)
+            assert value <= h._upper_bound(index)
+            # precision of about 3%
+            assert h._upper_bound(index) - value <= max(value * 0.07, 1)
+            assert index == 0 or h._upper_bound(index - 1) < value
+
+    def test_percentile(self):
+        h = LatencyHistogram()
+        assert h.percentile(99) == 0
+        for value in range(1, 1001):
+            h.record(value)
+        assert h.count == 1000
+        assert h.min == 1
+        assert h.max == 1000
+        assert abs(h.percentile(50) - 500) <= 500 * 0.04
+        assert abs(h.percentile(99) - 990) <= 990 * 0.04
+        assert h.percentile(100) == 1000
+
+    def test_record_out_of_range(self):
+        h = LatencyHistogram()
+        h.record(-1)
+        h.record(h.MAX_VALUE_IN_US * 2)
+        assert h.min == 0
+        assert h.max == h.MAX_VALUE_IN_US
+
+
+class TestLatencyRecorder:
+    def test_report(self):
+        recorder = LatencyRecorder()
+        recorder.record('process', 'new_order', 0, 2000000)
+        with recorder.measure('decode', 'heartbeat'):
+            pass
+
+        lines = recorder.report(reset=True)
+        assert len(lines) == 2
+        assert lines[0].startswith('decode/heartbeat: count=1')
+        assert lines[1].startswith('process/new_order: count=1, min=2000')
+        assert recorder.report() == []
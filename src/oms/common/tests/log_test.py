@@ -0,0 +1,90 @@
+import logging
+import threading
+
+import pytest
+
+from oms.common.log import DeferredQueueHandler, RateLimitedLog, install_queue_logging, stop_queue_logging
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(self.format(record))
+
+
+class Formatted:
+    """
+    Records the thread formatting it
+    """
+    def __init__(self):
+        self.thread = None
+
+    def __str__(self):
+        self.thread = threading.current_thread()
+        return 'formatted'
+
+
+@pytest.fixture
+def root_handler():
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    for h in handlers:
+        root.removeHandler(h)
+    handler = ListHandler()
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    yield handler
+    stop_queue_logging()
+    root.removeHandler(handler)
+    for h in handlers:
+        root.addHandler(h)
+    root.setLevel(level)
+
+
+class TestQueueLogging:
+    def test_install(self, root_handler):
+        assert install_queue_logging()
+        assert not install_queue_logging()
+        root = logging.getLogger()
+        assert [type(h) for h in root.handlers] == [DeferredQueueHandler]
+
+        arg = Formatted()
+        logging.getLogger(__name__).info('message %s', arg)
+        stop_queue_logging()
+
+        assert root_handler.messages == ['message formatted']
+        # formatted by the writer thread
+        assert arg.thread is not threading.current_thread()
+        assert root_handler in root.handlers
+        assert not any(isinstance(h, DeferredQueueHandler) for h in root.handlers)
+
+
+class TestRateLimitedLog:
+    def test_rate(self):
+        logger = logging.getLogger('rate_limited')
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        handler = ListHandler()
+        logger.addHandler(handler)
+        clock = [0.0]
+        log = RateLimitedLog(logger, rate=2, clock=lambda: clock[0])
+
+        for i in range(5):
+            log.log('INSERT order_', 'Execute: %d', i)
+        log.log('SELECT order_', 'Execute: %s', 'select')
+        assert handler.messages == ['Execute: 0', 'Execute: 1', 'Execute: select']
+
+        clock[0] = 0.5
+        log.log('INSERT order_', 'Execute: %d', 5)
+        log.log('INSERT order_', 'Execute: %d', 6)
+        assert handler.messages[3:] == ['Execute: 5 (3 dropped)']
+
+    def test_disabled_level(self):
+        logger = logging.getLogger('rate_limited_debug')
+        logger.setLevel(logging.INFO)
+        log = RateLimitedLog(logger, level=logging.DEBUG, rate=1, clock=lambda: 0.0)
+        log.log('key', 'message')
+        assert log._buckets == dict()
@@ -0,0 +1,95 @@
+from datetime import datetime
+
+import pytest
+import ujson
+
+from oms.common.message import (ENCODING, Msg, MsgType, OmsMessage, OmsMessageExecution, OmsMessageHeartbeat,
+                                OmsMessageNewOrderBatch, OmsMessagePosition, OmsMessagePositionDelta)
+
+
+class TestOmsMessage:
+    @staticmethod
+    def _position_dict():
+        return {
+            Msg.GROUP: Msg.OMS,
+            Msg.MSG_TYPE: MsgType.POSITION,
+            'request_id': 1,
+            'version': 3,
+            Msg.ACCOUNT: {
+                'id': 'account_1',
+                'cash': 1000.0,
+                'currency': 'HKD',
+                Msg.PORTFOLIOS: [{
+                    'id': 'portfolio_1',
+                    Msg.POSITIONS: [{
+                        'strategy': 'strategy_1',
+                        'market': 'HKFE',
+                        'symbol': 'HSIZ9',
+                        'position': 2,
+                        'avg_price': 26000.0,
+                        Msg.POSITIONS_BY_ENTRY: [{
+                            'position': 2,
+                            'avg_price': 26000.0,
+                            'operations': [{'created': 1565078702}],
+                            Msg.ORDER: {'order_id': 7, 'symbol': 'HSIZ9'},
+                        }],
+                    }],
+                }],
+            },
+        }
+
+    def test_from_json_nested(self):
+        msg = OmsMessage.from_json(ujson.dumps(self._position_dict()))
+        assert isinstance(msg, OmsMessagePosition)
+        assert msg.version == 3
+        position = msg.account.portfolios[0].positions[0]
+        assert isinstance(position, OmsMessagePosition.ItemPosition)
+        assert position.force_renew is False
+        entry = position.positions_by_entry[0]
+        assert entry.order.order_id == 7
+        assert entry.operations[0]['created'] == datetime.fromtimestamp(1565078702)
+
+    def test_missing_fields_take_defaults(self):
+        msg = OmsMessage.from_dict({Msg.GROUP: Msg.OMS, Msg.MSG_TYPE: MsgType.POSITION_DELTA,
+                                    Msg.POSITIONS: [{'symbol': 'HSIZ9'}]})
+        other = OmsMessage.from_dict({Msg.GROUP: Msg.OMS, Msg.MSG_TYPE: MsgType.POSITION_DELTA,
+                                      Msg.POSITIONS: [{'symbol': 'HSIZ9'}]})
+        item = msg.positions[0]
+        assert isinstance(item, OmsMessagePositionDelta.ItemPosition)
+        assert item.removed_order_ids == []
+        assert item.positions_by_entry == []
+        # defaults are not shared between messages
+        item.removed_order_ids.append(1)
+        assert other.positions[0].removed_order_ids == []
+
+    def test_round_trip(self):
+        msg = OmsMessageExecution()
+        msg.request_id = 5
+        item = OmsMessageExecution.ItemExecution()
+        item.order_id = 6
+        item.quantity = 1
+        msg.items.append(item)
+
+        payload = msg.to_bytes()
+        assert ujson.loads(payload.decode(ENCODING))[Msg.ITEMS][0]['order_id'] == 6
+        decoded = OmsMessage.from_bytes(payload)
+        assert decoded.to_dict() == msg.to_dict()
+
+    def test_new_order_batch(self):
+        msg = OmsMessage.from_dict({Msg.GROUP: Msg.OMS, Msg.MSG_TYPE: MsgType.NEW_ORDER_BATCH, 'request_id': 1,
+                                    Msg.ORDERS: [{'request_id': 2, 'symbol': 'NQ', 'quantity': 1},
+                                                 {'request_id': 3, 'symbol': 'ES', 'quantity': 2}]})
+        assert isinstance(msg, OmsMessageNewOrderBatch)
+        assert [o.request_id for o in msg.orders] == [2, 3]
+        assert isinstance(msg.orders[1], OmsMessageNewOrderBatch.ItemOrder)
+        assert OmsMessage.from_bytes(msg.to_bytes()).to_dict() == msg.to_dict()
+
+    def test_slots(self):
+        msg = OmsMessageHeartbeat()
+        assert not hasattr(msg, '__dict__')
+        with pytest.raises(AttributeError):
+            msg.unknown = 1
+
+    def test_unsupported_type(self):
+        with pytest.raises(ValueError):
+            OmsMessage.from_dict({Msg.GROUP: Msg.OMS, Msg.MSG_TYPE: MsgType.MODIFY_ORDER})
@@ -1,11 +1,13 @@
 import logging
 from collections import OrderedDict
 from datetime import datetime, timedelta
-from threading import RLock
+from threading import Condition, RLock
+from typing import Callable, Iterable, List, Set
 
 import gateway_lib as gl
 from oms.common.config import (CFG_CLIENT_ID, CFG_HOST, CFG_INTERACTIVE_BROKER, CFG_JOURNAL_FILE, CFG_NAME, CFG_PORT,
-                               CFG_RECONNECT_INTERVAL_IN_SEC, CFG_TYPE)
+                               CFG_RECONNECT_INTERVAL_IN_SEC, CFG_SIMULATED, CFG_TYPE)
+from .simulated import SimulatedGateway
 
 
 class Broker:
@@ -18,6 +20,13 @@ class Broker:
         self._is_connected = False
         self._is_connecting = False
         self._lock = RLock()
+        # IDs taken for orders which are not sent yet, the orders are sent in the order of their IDs
+        self._reserved: Set[int] = set()
+        self._turn = Condition(self._lock)
+        # order references of the orders sent and not done yet
+        self._outstanding: Set[str] = set()
+        # cancels requested while disconnected, sent on reconnection
+        self._deferred: List[Callable] = []
 
     def connect(self):
         self._is_connecting = True
@@ -45,6 +54,10 @@ class Broker:
         if val and changed:
             self._gateway.request_executions()
             self._gateway.request_open_orders()
+            with self._lock:
+                deferred, self._deferred = self._deferred, []
+            for call in deferred:
+                call()
 
     @property
     def is_connecting(self):
@@ -54,6 +67,10 @@ class Broker:
     def is_healthy(self):
         return self.gateway.is_healthy
 
+    @property
+    def n_outstanding(self) -> int:
+        return len(self._outstanding)
+
     @property
     def name(self):
         return self.gateway.name
@@ -63,6 +80,11 @@ class Broker:
         return self._reconnect_interval_in_sec
 
     def cancel_order(self, *args, **kwargs):
+        with self._lock:
+            if not self._is_connected:
+                self._logger.info(f'Broker {self.name} is disconnected, cancel the order on reconnection: {args}')
+                self._deferred.append(lambda: self.cancel_order(*args, **kwargs))
+                return
         try:
             self.gateway.cancel_order(*args, **kwargs)
         except BrokenPipeError as e:
@@ -94,12 +116,62 @@ class Broker:
             except BrokenPipeError as e:
                 self._handle_broken_pipe(e)
 
-    def place_order(self, *args, **kwargs):
+    def order_done(self, order_ref):
+        with self._lock:
+            self._outstanding.discard(str(order_ref))
+
+    def place_order(self, order_ref: str, order: gl.Order) -> bool:
+        """
+        Send an order, if its ID is taken by `reserve_id`, once the orders with a lower ID are sent or released
+
+        :return: False if the order could not be sent
+        """
         with self._lock:
+            order_id = int(order_ref) if str(order_ref).isdigit() else None
+            if order_id in self._reserved:
+                while min(self._reserved) != order_id:
+                    self._turn.wait()
+            # the order can be done before the gateway returns, e.g. it is filled at once
+            self._outstanding.add(str(order_ref))
             try:
-                self.gateway.place_order(*args, **kwargs)
+                self.gateway.place_order(order_ref, order)
+                return True
             except BrokenPipeError as e:
+                self._outstanding.discard(str(order_ref))
                 self._handle_broken_pipe(e)
+                return False
+            finally:
+                self.release_id(order_id)
+
+    def release_id(self, order_id: int):
+        """
+        Release an ID taken by `reserve_id` for an order which is not sent
+        """
+        with self._lock:
+            if order_id in self._reserved:
+                self._reserved.discard(order_id)
+                self._turn.notify_all()
+
+    def reserve_id(self, next_id: Callable[[], int]) -> int:
+        """
+        Take the ID of an order to be sent. IB requires the order IDs of a connection to be sent in increasing order,
+        the order is sent after the orders with a lower ID, so the order can be recorded before it is sent without
+        holding the lock. The order must be sent with `place_order`, or its ID released with `release_id`.
+
+        :param next_id: takes the next order ID
+        """
+        with self._lock:
+            order_id = next_id()
+            self._reserved.add(order_id)
+            return order_id
+
+    def reset_outstanding(self, order_refs: Iterable[str]):
+        """
+        :param order_refs: references of the open orders of the broker
+        """
+        outstanding = set(str(r) for r in order_refs)
+        with self._lock:
+            self._outstanding = outstanding
 
     def _handle_broken_pipe(self, e: BrokenPipeError):
         self.is_connected = False
@@ -121,4 +193,8 @@ class BrokerFactory:
 
             return Broker(config, gw)
 
+        if config[CFG_TYPE] == CFG_SIMULATED:
+            BrokerFactory._logger.info('Initialize simulated gateway...')
+            return Broker(config, SimulatedGateway.from_config(config))
+
         raise ValueError('Can\'t find any gateway configuration')
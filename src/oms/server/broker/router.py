@@ -0,0 +1,57 @@
+import logging
+from threading import Lock
+from typing import Dict, Optional
+
+from oms.common.config import CFG_LEAST_OUTSTANDING, CFG_ROUND_ROBIN
+from . import Broker
+
+
+class BrokerRouter:
+    """
+    Spread the new orders across the healthy brokers, so the order flow is not capped by the message rate of a single
+    gateway connection.
+
+    Policies:
+        least_outstanding: the broker with the fewest outstanding orders, ties are broken round robin
+        round_robin: the brokers in turn
+
+    An order stays with the broker it was sent to, cancels go to that broker even if it is disconnected. An unhealthy
+    broker only stops receiving new orders.
+    """
+    POLICIES = (CFG_LEAST_OUTSTANDING, CFG_ROUND_ROBIN)
+
+    def __init__(self, brokers: Dict[str, Broker], policy: str = CFG_LEAST_OUTSTANDING):
+        self._logger = logging.getLogger(__name__)
+        if policy not in self.POLICIES:
+            raise ValueError(f'Unknown routing policy {policy}, expect one of {self.POLICIES}')
+        self._brokers = brokers
+        self._policy = policy
+        self._lock = Lock()
+        self._next = 0
+
+    @property
+    def policy(self) -> str:
+        return self._policy
+
+    def get(self, name: str) -> Optional[Broker]:
+        """
+        Broker which owns the orders sent with the name, healthy or not
+        """
+        return self._brokers.get(name)
+
+    def select(self) -> Optional[Broker]:
+        """
+        Broker of a new order, None if no broker is healthy
+        """
+        brokers = list(self._brokers.values())
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % max(len(brokers), 1)
+
+        # rotate the brokers so the first healthy one, or the first of the least loaded ones, changes every time
+        candidates = [b for b in brokers[start:] + brokers[:start] if b.is_healthy]
+        if not candidates:
+            return None
+        if self._policy == CFG_ROUND_ROBIN:
+            return candidates[0]
+        return min(candidates, key=lambda b: b.n_outstanding)
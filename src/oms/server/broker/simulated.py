@@ -0,0 +1,473 @@
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+import gateway_lib as gl
+from oms.common.config import (CFG_ACK_LATENCY_IN_MS, CFG_CLIENT_ID, CFG_COMMISSION, CFG_DISCONNECT_INTERVAL_IN_SEC,
+                               CFG_FILL_LATENCY_IN_MS, CFG_NAME, CFG_PARTIAL_FILLS, CFG_PRICES, CFG_REJECT_RATE,
+                               CFG_SEED, CFG_TICK_INTERVAL_IN_MS, CFG_TICK_SIZE, CFG_VOLATILITY_IN_TICKS)
+
+# IB error codes of the simulated failures
+CODE_ORDER_REJECTED = 201
+CODE_CANCEL_REJECTED = 10148
+
+ACTIVE_STATUSES = (gl.OrderStatus.SUBMITTED, gl.OrderStatus.PARTIAL_FILLED)
+
+
+@dataclass
+class ConnectionUpdate:
+    gateway_id: str
+    status: gl.ConnectionStatus
+
+
+@dataclass
+class ErrorMessage:
+    gateway_id: str
+    code: int
+    msg: str
+
+
+@dataclass
+class OrderError(ErrorMessage):
+    order_id: str = None
+
+
+@dataclass
+class SimulatedOrder:
+    gateway_id: str
+    order_ref: str
+    broker_order_id: int
+    symbol: str
+    order_type: gl.OrderType
+    action: gl.OrderAction
+    quantity: int
+    price: Optional[float]
+    stop_price: Optional[float]
+    status: gl.OrderStatus = gl.OrderStatus.UNDEFINED
+    filled: int = 0
+    # a modified order is added to the book again, the entries of the older versions are skipped
+    version: int = 0
+
+    @property
+    def is_active(self) -> bool:
+        return self.status in ACTIVE_STATUSES
+
+    @property
+    def is_buy(self) -> bool:
+        return self.action == gl.OrderAction.BUY
+
+    @property
+    def is_stop(self) -> bool:
+        return self.order_type in (gl.OrderType.STP, gl.OrderType.STP_LMT)
+
+    @property
+    def remaining(self) -> int:
+        return self.quantity - self.filled
+
+
+@dataclass
+class OrderUpdate:
+    gateway_id: str
+    client_id: int
+    order_ref: str
+    status: gl.OrderStatus
+    filled: int
+    remaining: int
+    order: SimulatedOrder
+    is_historical: bool = False
+
+
+@dataclass
+class ExecutionUpdate:
+    gateway_id: str
+    client_id: int
+    exec_id: str
+    order_ref: str
+    broker_order_id: int
+    symbol: str
+    # BUY or SELL, like the IB executions
+    side: str
+    filled: int
+    cum_qty: int
+    # price of this execution, the OMS averages the position itself
+    avg_price: float
+    commission: float
+    currency: str
+    timestamp: datetime = field(default_factory=datetime.now)
+
+
+@dataclass
+class OpenOrdersUpdate:
+    gateway_id: str
+    open_orders: List[SimulatedOrder]
+
+
+class SimulatedEvents:
+    """
+    Event subscriptions with the same interface as the events of the `gateway_lib` gateways, the callbacks are called
+    with the gateway and the event
+    """
+    def __init__(self):
+        self._callbacks: Dict[str, List[Callable]] = defaultdict(list)
+
+    def emit(self, name: str, src, event):
+        for callback in self._callbacks[name]:
+            callback(src, event)
+
+    def on_account_info_update(self, callback: Callable):
+        self._callbacks['account_info_update'].append(callback)
+
+    def on_connection_update(self, callback: Callable):
+        self._callbacks['connection_update'].append(callback)
+
+    def on_error(self, callback: Callable):
+        self._callbacks['error'].append(callback)
+
+    def on_execution(self, callback: Callable):
+        self._callbacks['execution'].append(callback)
+
+    def on_open_order_end(self, callback: Callable):
+        self._callbacks['open_order_end'].append(callback)
+
+    def on_order_update(self, callback: Callable):
+        self._callbacks['order_update'].append(callback)
+
+    def on_position_update(self, callback: Callable):
+        self._callbacks['position_update'].append(callback)
+
+
+class OrderBook:
+    """
+    Resting LMT and STP orders of a symbol, in one heap per side and kind of order so a price move only visits the
+    orders it triggers.
+
+    A buy limit and a sell stop trigger when the price falls to their level, a sell limit and a buy stop when it rises
+    to it. The heaps are ordered by `-sign * level`, their top is the first order to trigger.
+    """
+    def __init__(self):
+        self._heaps: Dict[Tuple[bool, bool], list] = {(b, s): [] for b in (True, False) for s in (True, False)}
+        self._seq = itertools.count()
+
+    @staticmethod
+    def _sign(is_buy: bool, is_stop: bool) -> int:
+        return 1 if is_buy != is_stop else -1
+
+    def add(self, order: SimulatedOrder):
+        level = order.stop_price if order.is_stop else order.price
+        sign = self._sign(order.is_buy, order.is_stop)
+        heapq.heappush(self._heaps[(order.is_buy, order.is_stop)],
+                       (-sign * level, next(self._seq), order.version, order))
+
+    def match(self, price: float) -> List[SimulatedOrder]:
+        """
+        Remove the orders triggered at the price
+        """
+        triggered = []
+        for (is_buy, is_stop), heap in self._heaps.items():
+            sign = self._sign(is_buy, is_stop)
+            while heap and -heap[0][0] >= sign * price:
+                _, _, version, order = heapq.heappop(heap)
+                if order.is_active and order.version == version:
+                    triggered.append(order)
+        return triggered
+
+
+class SimulatedGateway:
+    """
+    Matching engine standing in for a broker gateway, with the interface and the events of the `gateway_lib`
+    gateways used by `Broker` and `Oms`.
+
+    Every symbol follows a random walk of `volatility_in_ticks` ticks every `tick_interval_in_ms`, starting at its
+    price in `prices`. MKT orders are filled at the current price after `fill_latency_in_ms`, LMT and STP orders rest in
+    the book until the price path triggers them, an order is filled in up to `partial_fills` executions. A share of the
+    orders is rejected, and the connection drops every `disconnect_interval_in_sec` on average, it is restored when the
+    broker reconnects. Executions and open orders are replayed on request like the IB gateway does after a reconnection.
+
+    The events are emitted by one thread of the gateway, in the order of their scheduled time.
+    """
+    DEFAULT_PRICE = 100.0
+    CURRENCY = 'USD'
+    MAX_EXECUTIONS = 100000
+
+    def __init__(self, name: str, identity: int = 0, prices: Dict[str, float] = None, tick_size: float = 0.25,
+                 tick_interval_in_ms: float = 100, volatility_in_ticks: float = 1, ack_latency_in_ms: float = 0,
+                 fill_latency_in_ms: float = 0, partial_fills: int = 1, reject_rate: float = 0,
+                 disconnect_interval_in_sec: float = 0, commission: float = 0, seed: int = None):
+        self._logger = logging.getLogger(__name__)
+        self._name = name
+        self._identity = identity
+        self._tick_size = tick_size
+        self._tick_interval = tick_interval_in_ms / 1000
+        self._volatility_in_ticks = volatility_in_ticks
+        self._ack_latency = ack_latency_in_ms / 1000
+        self._fill_latency = fill_latency_in_ms / 1000
+        self._partial_fills = max(int(partial_fills), 1)
+        self._reject_rate = reject_rate
+        self._disconnect_interval = disconnect_interval_in_sec
+        self._commission = commission
+        self._random = random.Random(seed)
+        self._events = SimulatedEvents()
+
+        self._prices: Dict[str, float] = dict(prices or dict())
+        self._books: Dict[str, OrderBook] = defaultdict(OrderBook)
+        self._orders: Dict[str, SimulatedOrder] = dict()
+        self._executions: Deque[ExecutionUpdate] = deque(maxlen=self.MAX_EXECUTIONS)
+        self._broker_order_ids = itertools.count(1)
+        self._exec_ids = itertools.count(1)
+
+        self._is_connected = False
+        self._schedule: List[Tuple[float, int, Callable, tuple]] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._is_running = False
+
+    @classmethod
+    def from_config(cls, config: OrderedDict) -> 'SimulatedGateway':
+        options = dict(prices=CFG_PRICES, tick_size=CFG_TICK_SIZE, tick_interval_in_ms=CFG_TICK_INTERVAL_IN_MS,
+                       volatility_in_ticks=CFG_VOLATILITY_IN_TICKS, ack_latency_in_ms=CFG_ACK_LATENCY_IN_MS,
+                       fill_latency_in_ms=CFG_FILL_LATENCY_IN_MS, partial_fills=CFG_PARTIAL_FILLS,
+                       reject_rate=CFG_REJECT_RATE, disconnect_interval_in_sec=CFG_DISCONNECT_INTERVAL_IN_SEC,
+                       commission=CFG_COMMISSION, seed=CFG_SEED)
+        kwargs = {arg: config[key] for arg, key in options.items() if key in config}
+        return cls(name=config[CFG_NAME], identity=config.get(CFG_CLIENT_ID, 0), **kwargs)
+
+    @property
+    def events(self) -> SimulatedEvents:
+        return self._events
+
+    @property
+    def identity(self) -> int:
+        return self._identity
+
+    @property
+    def is_healthy(self) -> bool:
+        return self._is_connected
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    def cancel_order(self, order_ref):
+        self._check_connected()
+        self._schedule_in(self._ack_latency, self._cancel, str(order_ref))
+
+    def close(self):
+        """
+        Stop the thread of the gateway, the orders are lost
+        """
+        with self._cond:
+            self._is_running = False
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def connect(self):
+        with self._cond:
+            if self._thread is None:
+                self._is_running = True
+                self._thread = threading.Thread(target=self._run, name=f'Simulated-{self._name}', daemon=True)
+                self._thread.start()
+                if self._tick_interval > 0:
+                    self._schedule_in(self._tick_interval, self._tick)
+        self._schedule_in(0, self._set_connected, True)
+
+    def disconnect(self):
+        self._schedule_in(0, self._set_connected, False)
+
+    def load_state(self):
+        pass
+
+    def modify_order(self, order_ref, order: gl.Order):
+        self._check_connected()
+        self._schedule_in(self._ack_latency, self._modify, str(order_ref), order)
+
+    def ping(self):
+        self._check_connected()
+
+    def place_order(self, order_ref: str, order: gl.Order):
+        self._check_connected()
+        sim_order = SimulatedOrder(gateway_id=self._name, order_ref=str(order_ref),
+                                   broker_order_id=next(self._broker_order_ids), symbol=order.symbol,
+                                   order_type=gl.OrderType(order.orderType), action=gl.OrderAction(order.action),
+                                   quantity=int(order.quantity), price=order.limit_price, stop_price=order.stop_price)
+        self._schedule_in(self._ack_latency, self._accept, sim_order)
+
+    def request_executions(self):
+        self._schedule_in(0, self._replay_executions)
+
+    def request_open_orders(self):
+        self._schedule_in(0, self._replay_open_orders)
+
+    def set_price(self, symbol: str, price: float):
+        """
+        Move the price of a symbol, e.g. to trigger the resting orders of a test
+        """
+        self._schedule_in(0, self._move_price, symbol, price)
+
+    def _check_connected(self):
+        # the IB gateway fails the same way when the socket to TWS is closed
+        if not self._is_connected:
+            raise BrokenPipeError(f'Simulated gateway {self._name} is disconnected')
+
+    def _schedule_in(self, delay: float, fn: Callable, *args: Any):
+        with self._cond:
+            heapq.heappush(self._schedule, (time.monotonic() + delay, next(self._seq), fn, args))
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._is_running and (not self._schedule or self._schedule[0][0] > time.monotonic()):
+                    self._cond.wait(self._schedule[0][0] - time.monotonic() if self._schedule else None)
+                if not self._is_running:
+                    return
+                _, _, fn, args = heapq.heappop(self._schedule)
+            try:
+                fn(*args)
+            except Exception as e:
+                self._logger.exception(e)
+
+    def _emit(self, name: str, event):
+        if self._is_connected:
+            self._events.emit(name, self, event)
+
+    def _emit_order_update(self, order: SimulatedOrder, is_historical: bool = False):
+        self._emit('order_update', OrderUpdate(self._name, self._identity, order.order_ref, order.status, order.filled,
+                                               order.remaining, order, is_historical))
+
+    def _set_connected(self, val: bool):
+        if self._is_connected == val:
+            return
+        self._logger.info(f'Simulated gateway {self._name}, set connected to {val}')
+        status = gl.ConnectionStatus.CONNECTED if val else gl.ConnectionStatus.DISCONNECTED
+        self._is_connected = val
+        self._events.emit('connection_update', self, ConnectionUpdate(self._name, status))
+        if val and self._disconnect_interval > 0:
+            self._schedule_in(self._random.expovariate(1 / self._disconnect_interval), self._set_connected, False)
+
+    def _price(self, symbol: str) -> float:
+        price = self._prices.get(symbol)
+        if price is None:
+            price = self._prices[symbol] = self.DEFAULT_PRICE
+        return price
+
+    def _tick(self):
+        for symbol, price in list(self._prices.items()):
+            move = round(self._random.gauss(0, self._volatility_in_ticks)) * self._tick_size
+            self._move_price(symbol, max(price + move, self._tick_size))
+        self._schedule_in(self._tick_interval, self._tick)
+
+    def _move_price(self, symbol: str, price: float):
+        self._prices[symbol] = price
+        book = self._books.get(symbol)
+        if book is not None:
+            for order in book.match(price):
+                self._trigger(order, price)
+
+    def _accept(self, order: SimulatedOrder):
+        if self._random.random() < self._reject_rate:
+            order.status = gl.OrderStatus.INACTIVE
+            self._emit('error', OrderError(self._name, CODE_ORDER_REJECTED, 'Order rejected - simulated',
+                                           order.order_ref))
+            return
+
+        order.status = gl.OrderStatus.SUBMITTED
+        self._orders[order.order_ref] = order
+        self._emit_order_update(order)
+        self._rest(order)
+
+    def _rest(self, order: SimulatedOrder):
+        if order.order_type == gl.OrderType.MKT:
+            self._fill(order, None)
+        else:
+            book = self._books[order.symbol]
+            book.add(order)
+            for o in book.match(self._price(order.symbol)):
+                self._trigger(o, self._prices[order.symbol])
+
+    def _trigger(self, order: SimulatedOrder, price: float):
+        if order.order_type == gl.OrderType.STP_LMT:
+            # the stop turns into a limit order
+            order.order_type = gl.OrderType.LMT
+            self._rest(order)
+        elif order.order_type == gl.OrderType.LMT:
+            self._fill(order, order.price)
+        else:
+            self._fill(order, price)
+
+    def _fill(self, order: SimulatedOrder, price: Optional[float]):
+        """
+        Fill the remaining quantity in up to `partial_fills` executions
+
+        :param price: price of the executions, the market price at the time of each execution if not given
+        """
+        n_fills = min(self._partial_fills, order.remaining)
+        quantity, extra = divmod(order.remaining, n_fills)
+        for i in range(n_fills):
+            self._schedule_in(self._fill_latency * (i + 1), self._execute, order, order.version,
+                              quantity + (1 if i < extra else 0), price)
+
+    def _execute(self, order: SimulatedOrder, version: int, quantity: int, price: Optional[float]):
+        # a cancelled or modified order is not filled any further
+        if not order.is_active or order.version != version:
+            return
+
+        order.filled += quantity
+        order.status = gl.OrderStatus.FILLED if order.remaining == 0 else gl.OrderStatus.PARTIAL_FILLED
+        if order.remaining == 0:
+            del self._orders[order.order_ref]
+
+        execution = ExecutionUpdate(self._name, self._identity, f'{self._name}.{next(self._exec_ids):010d}',
+                                    order.order_ref, order.broker_order_id, order.symbol, order.action.name, quantity,
+                                    order.filled, self._price(order.symbol) if price is None else price,
+                                    self._commission * quantity, self.CURRENCY)
+        self._executions.append(execution)
+        self._emit('execution', execution)
+        self._emit_order_update(order)
+
+    def _cancel(self, order_ref: str):
+        order = self._orders.pop(order_ref, None)
+        if order is None:
+            self._emit('error', OrderError(self._name, CODE_CANCEL_REJECTED,
+                                           f'OrderId {order_ref} that needs to be cancelled cannot be cancelled',
+                                           order_ref))
+            return
+        order.status = gl.OrderStatus.CANCELLED
+        self._emit_order_update(order)
+
+    def _modify(self, order_ref: str, new_order: gl.Order):
+        order = self._orders.get(order_ref)
+        if order is None:
+            self._emit('error', OrderError(self._name, CODE_ORDER_REJECTED, f'Unable to modify order {order_ref}',
+                                           order_ref))
+            return
+        order.quantity = max(int(new_order.quantity), order.filled)
+        order.price = new_order.limit_price
+        order.stop_price = new_order.stop_price
+        order.version += 1
+        self._emit_order_update(order)
+        if order.remaining == 0:
+            order.status = gl.OrderStatus.FILLED
+            del self._orders[order_ref]
+            self._emit_order_update(order)
+        else:
+            self._rest(order)
+
+    def _replay_executions(self):
+        for execution in list(self._executions):
+            self._emit('execution', execution)
+
+    def _replay_open_orders(self):
+        orders = list(self._orders.values())
+        for order in orders:
+            self._emit_order_update(order, is_historical=True)
+        self._emit('open_order_end', OpenOrdersUpdate(self._name, orders))
@@ -0,0 +1,106 @@
+import threading
+from collections import OrderedDict
+from queue import Queue
+
+import pytest
+
+import gateway_lib as gl
+from oms.server.broker import Broker
+from oms.server.broker.router import BrokerRouter
+from oms.server.broker.simulated import SimulatedGateway
+
+
+class MockBroker:
+    def __init__(self, name: str, n_outstanding: int = 0, is_healthy: bool = True):
+        self.name = name
+        self.n_outstanding = n_outstanding
+        self.is_healthy = is_healthy
+
+
+def create_router(policy: str, *brokers: MockBroker) -> BrokerRouter:
+    return BrokerRouter({b.name: b for b in brokers}, policy)
+
+
+class TestBrokerRouter:
+    def test_round_robin(self):
+        router = create_router('round_robin', MockBroker('a'), MockBroker('b'), MockBroker('c', is_healthy=False))
+        assert [router.select().name for _ in range(4)] == ['a', 'b', 'a', 'a']
+
+    def test_least_outstanding(self):
+        a, b = MockBroker('a', 3), MockBroker('b', 1)
+        router = create_router('least_outstanding', a, b)
+        assert router.select() is b
+        b.n_outstanding = 5
+        assert router.select() is a
+
+        # failover only affects new orders
+        a.is_healthy = False
+        assert router.select() is b
+        assert router.get('a') is a
+        b.is_healthy = False
+        assert router.select() is None
+
+    def test_ties_are_spread(self):
+        router = create_router('least_outstanding', MockBroker('a'), MockBroker('b'))
+        assert {router.select().name for _ in range(2)} == {'a', 'b'}
+
+    def test_unknown_policy(self):
+        with pytest.raises(ValueError):
+            create_router('random', MockBroker('a'))
+
+
+class TestBroker:
+    def test_outstanding_and_deferred_cancel(self):
+        gateway = SimulatedGateway('sim', prices={'NQH1': 7000}, tick_interval_in_ms=0)
+        broker = Broker(OrderedDict(reconnect_interval_in_sec=5), gateway)
+        events = Queue()
+        gateway.events.on_connection_update(lambda src, event: events.put(event))
+        gateway.events.on_order_update(lambda src, event: events.put(event))
+
+        # cancelled when the broker is connected again
+        broker.cancel_order('1')
+        gateway.connect()
+        assert events.get(timeout=1).status == gl.ConnectionStatus.CONNECTED
+
+        order = gl.Order(symbol='NQH1', orderType=int(gl.OrderType.LMT), action=int(gl.OrderAction.BUY), quantity=1,
+                         limit_price=6900, stop_price=None)
+        broker.place_order('1', order)
+        assert broker.n_outstanding == 1
+        assert events.get(timeout=1).status == gl.OrderStatus.SUBMITTED
+
+        # the open orders are replayed first
+        broker.is_connected = True
+        update = events.get(timeout=1)
+        while update.is_historical:
+            update = events.get(timeout=1)
+        assert update.status == gl.OrderStatus.CANCELLED
+
+        broker.order_done('1')
+        assert broker.n_outstanding == 0
+        broker.reset_outstanding(['2', '3'])
+        assert broker.n_outstanding == 2
+        gateway.close()
+
+    def test_reserved_ids_are_sent_in_order(self):
+        gateway = SimulatedGateway('sim', prices={'NQH1': 7000}, tick_interval_in_ms=0)
+        broker = Broker(OrderedDict(reconnect_interval_in_sec=5), gateway)
+        sent = []
+        gateway.place_order = lambda order_ref, order: sent.append(order_ref)
+        ids = iter(range(1, 10))
+        first, second, third = (broker.reserve_id(lambda: next(ids)) for _ in range(3))
+
+        # the second order waits for the first one, which is still being recorded
+        thread = threading.Thread(target=broker.place_order, args=(f'{second}', None))
+        thread.start()
+        thread.join(0.1)
+        assert thread.is_alive() and sent == []
+
+        # the first order is not sent, e.g. its record failed
+        broker.release_id(first)
+        thread.join(1)
+        assert sent == ['2']
+        broker.place_order(f'{third}', None)
+        assert sent == ['2', '3']
+        # an order without a reserved ID is sent at once
+        broker.place_order('101', None)
+        assert sent == ['2', '3', '101']
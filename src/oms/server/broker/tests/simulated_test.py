@@ -0,0 +1,159 @@
+from collections import OrderedDict
+from queue import Queue
+
+import pytest
+
+import gateway_lib as gl
+from oms.server.broker import BrokerFactory
+from oms.server.broker.simulated import (CODE_CANCEL_REJECTED, CODE_ORDER_REJECTED, OrderBook, OrderError,
+                                         SimulatedGateway, SimulatedOrder)
+
+
+def create_gateway(**kwargs) -> SimulatedGateway:
+    options = dict(name='sim', identity=1, prices={'NQH1': 7000}, tick_interval_in_ms=0, seed=1)
+    options.update(kwargs)
+    return SimulatedGateway(**options)
+
+
+def create_order(order_type: gl.OrderType, is_buy: bool, quantity: int, limit_price: float = None,
+                 stop_price: float = None) -> gl.Order:
+    return gl.Order(symbol='NQH1', orderType=int(order_type),
+                    action=int(gl.OrderAction.BUY if is_buy else gl.OrderAction.SELL), quantity=quantity,
+                    limit_price=limit_price, stop_price=stop_price)
+
+
+class Recorder:
+    def __init__(self, gateway: SimulatedGateway):
+        self.events = Queue()
+        for name in ('error', 'connection_update', 'order_update', 'execution', 'open_order_end'):
+            getattr(gateway.events, f'on_{name}')(lambda src, event, name=name: self.events.put((name, event)))
+
+    def next(self, name: str = None):
+        while True:
+            event_name, event = self.events.get(timeout=1)
+            if name is None or event_name == name:
+                return event
+
+
+@pytest.fixture
+def gateway():
+    gateway = create_gateway(partial_fills=3)
+    recorder = Recorder(gateway)
+    gateway.connect()
+    assert recorder.next('connection_update').status == gl.ConnectionStatus.CONNECTED
+    yield gateway, recorder
+    gateway.close()
+
+
+class TestOrderBook:
+    def test_match(self):
+        book = OrderBook()
+        orders = []
+        for i, (order_type, action, price, stop_price) in enumerate([
+                (gl.OrderType.LMT, gl.OrderAction.BUY, 99, None),
+                (gl.OrderType.LMT, gl.OrderAction.SELL, 101, None),
+                (gl.OrderType.STP, gl.OrderAction.BUY, None, 102),
+                (gl.OrderType.STP, gl.OrderAction.SELL, None, 98)]):
+            order = SimulatedOrder('sim', str(i), i, 'NQH1', order_type, action, 1, price, stop_price,
+                                   gl.OrderStatus.SUBMITTED)
+            book.add(order)
+            orders.append(order)
+
+        assert book.match(100) == []
+        assert book.match(99) == [orders[0]]
+        assert book.match(101.5) == [orders[1]]
+        assert book.match(97) == [orders[3]]
+        assert book.match(102) == [orders[2]]
+        assert book.match(90) == []
+
+
+class TestSimulatedGateway:
+    def test_market_order(self, gateway):
+        gateway, recorder = gateway
+        gateway.place_order('1', create_order(gl.OrderType.MKT, True, 5))
+
+        assert recorder.next('order_update').status == gl.OrderStatus.SUBMITTED
+        executions = [recorder.next('execution') for _ in range(3)]
+        assert [e.filled for e in executions] == [2, 2, 1]
+        assert [e.cum_qty for e in executions] == [2, 4, 5]
+        assert {e.avg_price for e in executions} == {7000}
+        assert all(e.client_id == gateway.identity and e.order_ref == '1' for e in executions)
+        assert len({e.exec_id for e in executions}) == 3
+
+        update = recorder.next('order_update')
+        while update.status != gl.OrderStatus.FILLED:
+            update = recorder.next('order_update')
+        assert update.remaining == 0
+
+    def test_limit_and_stop_orders(self, gateway):
+        gateway, recorder = gateway
+        gateway.place_order('1', create_order(gl.OrderType.LMT, True, 1, limit_price=6990))
+        gateway.place_order('2', create_order(gl.OrderType.STP, False, 1, stop_price=6980))
+        assert recorder.next('order_update').order_ref == '1'
+        assert recorder.next('order_update').order_ref == '2'
+
+        gateway.set_price('NQH1', 6985)
+        execution = recorder.next('execution')
+        assert (execution.order_ref, execution.avg_price) == ('1', 6990)
+
+        gateway.set_price('NQH1', 6975)
+        execution = recorder.next('execution')
+        assert (execution.order_ref, execution.avg_price, execution.side) == ('2', 6975, 'SELL')
+
+    def test_cancel_order(self, gateway):
+        gateway, recorder = gateway
+        gateway.place_order('1', create_order(gl.OrderType.LMT, True, 1, limit_price=6990))
+        assert recorder.next('order_update').status == gl.OrderStatus.SUBMITTED
+
+        gateway.cancel_order('1')
+        assert recorder.next('order_update').status == gl.OrderStatus.CANCELLED
+        gateway.cancel_order('1')
+        assert recorder.next('error').code == CODE_CANCEL_REJECTED
+
+        # a cancelled order is not filled
+        gateway.set_price('NQH1', 6900)
+        gateway.request_open_orders()
+        assert recorder.next().open_orders == []
+
+    def test_reject(self):
+        gateway = create_gateway(reject_rate=1)
+        recorder = Recorder(gateway)
+        gateway.connect()
+        recorder.next('connection_update')
+        gateway.place_order('1', create_order(gl.OrderType.MKT, True, 1))
+        error = recorder.next('error')
+        assert type(error) is OrderError
+        assert (error.code, error.order_id) == (CODE_ORDER_REJECTED, '1')
+        gateway.close()
+
+    def test_reconnect(self, gateway):
+        gateway, recorder = gateway
+        gateway.place_order('1', create_order(gl.OrderType.MKT, True, 3))
+        gateway.place_order('2', create_order(gl.OrderType.LMT, True, 1, limit_price=6990))
+        for _ in range(3):
+            recorder.next('execution')
+
+        gateway.disconnect()
+        assert recorder.next('connection_update').status == gl.ConnectionStatus.DISCONNECTED
+        with pytest.raises(BrokenPipeError):
+            gateway.place_order('3', create_order(gl.OrderType.MKT, True, 1))
+
+        gateway.connect()
+        assert recorder.next('connection_update').status == gl.ConnectionStatus.CONNECTED
+        gateway.request_executions()
+        assert [recorder.next('execution').cum_qty for _ in range(3)] == [1, 2, 3]
+        gateway.request_open_orders()
+        update = recorder.next('order_update')
+        assert (update.order_ref, update.is_historical) == ('2', True)
+        assert [o.order_ref for o in recorder.next('open_order_end').open_orders] == ['2']
+
+
+class TestBrokerFactory:
+    def test_create_simulated_broker(self):
+        config = OrderedDict(name='sim', type='simulated', client_id=1, reconnect_interval_in_sec=5, seed=1,
+                             prices={'NQH1': 7000}, fill_latency_in_ms=1)
+        broker = BrokerFactory.create_broker(config)
+        assert broker.name == 'sim'
+        assert isinstance(broker.gateway, SimulatedGateway)
+        assert broker.gateway.identity == 1
+        assert not broker.is_healthy
@@ -0,0 +1,75 @@
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, NamedTuple, Optional, Tuple
+
+import gateway_lib as gl
+from smartquant.common.instrument import Instrument, InstrumentRepository
+from smartquant.common.market import Market
+
+
+class Contract(NamedTuple):
+    instrument: Optional[Instrument]
+    # contract the orders are sent for, e.g. the front month of the instrument
+    symbol: str
+    # fields of `gl.Order` which only depend on the contract
+    order_fields: Dict[str, Any]
+
+
+class ContractTable:
+    """
+    Front month contract of every instrument of the repository, by market and symbol, so sending an order does not
+    search the repository and resolve the front month every time.
+
+    The table is rebuilt when a roll is detected, and on the first lookup of every day as the front month moves with the
+    date. A rebuild replaces the table as a whole, a lookup sees either the old or the new table without locking.
+    """
+    def __init__(self, instruments: Callable[[], Iterable[Instrument]] = None):
+        """
+        :param instruments: instruments of the table, those of `InstrumentRepository` if not given
+        """
+        self._logger = logging.getLogger(__name__)
+        self._instruments = instruments or (lambda: InstrumentRepository().instruments)
+        self._contracts: Dict[Tuple[Market, str], Contract] = dict()
+        self._expires = 0.0
+
+    def __len__(self):
+        return len(self._contracts)
+
+    def instrument(self, market: Market, symbol: str) -> Optional[Instrument]:
+        contract = self._lookup(market, symbol)
+        if contract is not None:
+            return contract.instrument
+        return InstrumentRepository().find(market=market, symbol=symbol)
+
+    def rebuild(self):
+        contracts = dict()
+        for instrument in self._instruments():
+            contracts[(instrument.market, instrument.symbol)] = self._contract(instrument.market,
+                                                                               instrument.front_month.symbol,
+                                                                               instrument)
+        tomorrow = datetime.combine(datetime.now().date() + timedelta(days=1), datetime.min.time())
+        self._contracts = contracts
+        self._expires = time.monotonic() + (tomorrow - datetime.now()).total_seconds()
+        self._logger.info('Front month contracts: ' +
+                          ', '.join(f'{s}@{m}: {c.symbol}' for (m, s), c in sorted(contracts.items(), key=str)))
+
+    def resolve(self, market: Market, symbol: str) -> Contract:
+        """
+        Contract of the orders of a symbol, the front month of an instrument, otherwise the symbol as is, e.g. the
+        contract code of a roll order
+        """
+        contract = self._lookup(market, symbol)
+        if contract is None:
+            contract = self._contract(market, symbol, None)
+        return contract
+
+    def _lookup(self, market: Market, symbol: str) -> Optional[Contract]:
+        if time.monotonic() >= self._expires:
+            self.rebuild()
+        return self._contracts.get((market, symbol))
+
+    @staticmethod
+    def _contract(market: Market, symbol: str, instrument: Optional[Instrument]) -> Contract:
+        return Contract(instrument, symbol, dict(symbol=symbol, exchange=gl.Exchange.from_str(market.value),
+                                                 contractType=gl.ContractType.Future))
@@ -0,0 +1,50 @@
+import itertools
+import zlib
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Callable, List
+
+
+class ShardedExecutor(Executor):
+    """
+    Executor made of single-threaded lanes.
+
+    Tasks submitted with the same key always run on the same lane, one at a time and in the order they are submitted,
+    e.g. the messages of a client session are processed in the order they are received without any lock. Tasks of
+    different keys run in parallel unless their keys share a lane.
+    """
+
+    def __init__(self, n_lanes: int, thread_name_prefix: str = 'Lane'):
+        if n_lanes < 1:
+            raise ValueError(f'Number of lanes must be at least 1, got {n_lanes}')
+        self._lanes: List[ThreadPoolExecutor] = [
+            ThreadPoolExecutor(1, thread_name_prefix=f'{thread_name_prefix}-{i}') for i in range(n_lanes)]
+        self._next_lane = itertools.count()
+
+    @property
+    def n_lanes(self):
+        return len(self._lanes)
+
+    def lane_of(self, key: bytes) -> int:
+        """
+        :param key: e.g. the ZMQ source ID of a client
+        :return: index of the lane the key is pinned to
+        """
+        if isinstance(key, str):
+            key = key.encode()
+        return zlib.crc32(key) % len(self._lanes)
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """
+        Run a task without ordering constraint, lanes are picked in turn
+        """
+        return self._lanes[next(self._next_lane) % len(self._lanes)].submit(fn, *args, **kwargs)
+
+    def submit_to(self, key: bytes, fn: Callable, *args, **kwargs) -> Future:
+        """
+        Run a task after all tasks submitted before with the same key
+        """
+        return self._lanes[self.lane_of(key)].submit(fn, *args, **kwargs)
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False):
+        for lane in self._lanes:
+            lane.shutdown(wait=wait, cancel_futures=cancel_futures)
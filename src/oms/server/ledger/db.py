@@ -1,48 +1,119 @@
 import copy
 import logging
+import threading
 from collections import OrderedDict
+from concurrent import futures
+from concurrent.futures import Future
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from threading import RLock
-from typing import Any, Dict
+from typing import Any, Callable, Dict, List, Tuple, TypeVar, Union
 
 import mysql.connector
 
-from oms.common.config import CFG_MYSQL
+from oms.common.config import CFG_BATCH_SIZE, CFG_MYSQL, CFG_POOL_SIZE, CFG_WINDOW_IN_MS, CFG_WRITE_BEHIND
+from oms.common.log import RateLimitedLog
 from smartquant.execution.base import Action, OrderState, OrderType
-from .statement import TableAccount, TableSession, Statement
+from .pool import ConnectionPool
+from .statement import PreparedStatement, TableAccount, TableSession, Statement, statement_kind, statement_sql
+from .store import ExecutionStore, OrderCheckpoint, OrderStore, StopCoverage
+from .writer import LedgerWriter
+
+
+T = TypeVar('T')
 
 
 class DbMySql:
-    N_RETRY = 5
-    RETRY_DELAY = 2
+    DEFAULT_POOL_SIZE = 1
+    INSTRUMENT_BATCH_SIZE = 500
+    # statements logged per second for each kind of statement
+    SQL_LOG_RATE = 10
 
     def __init__(self, config: OrderedDict):
         self._logger = logging.getLogger(__name__)
         cfg = copy.copy(config[CFG_MYSQL])
-        self._logger.info(f'Connect to MySQL database with configuration: {cfg}')
-        self._cnx = mysql.connector.connect(**cfg)
-        self._lock = RLock()
+        pool_size = int(cfg.pop(CFG_POOL_SIZE, self.DEFAULT_POOL_SIZE))
+        write_behind = cfg.pop(CFG_WRITE_BEHIND, None)
+        self._logger.info(f'Connect to MySQL database with configuration: {cfg}, pool size: {pool_size}')
+        self._pool = ConnectionPool(cfg, pool_size)
 
-    def close(self):
-        self._cnx.close()
+        self._writer = None
+        if write_behind:
+            opts = write_behind if isinstance(write_behind, dict) else dict()
+            batch_size = int(opts.get(CFG_BATCH_SIZE, LedgerWriter.DEFAULT_BATCH_SIZE))
+            window_in_ms = float(opts.get(CFG_WINDOW_IN_MS, LedgerWriter.DEFAULT_WINDOW_IN_MS))
+            self._logger.info(f'Write-behind is enabled, batch size: {batch_size}, window: {window_in_ms} ms')
+            self._writer = LedgerWriter(cfg, batch_size, window_in_ms)
 
-    def get_cursor(self):
-        self._cnx.ping(True, self.N_RETRY, self.RETRY_DELAY)
-        return self._cnx.cursor(dictionary=True)
+        self._load()
 
-    def increment_next_request_id(self, session_id: str):
-        stmt = Statement.build_stmt_session_increment_next_request_id(session_id)
-        self._exec_stmt(stmt)
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._pool.close()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run all statements issued by the current thread inside the block on one connection, and commit them at once.
+        Transactions are re-entrant, only the outermost block commits or rolls back. In write-behind mode the
+        statements are handed to the writer as one unit when the block exits, and dropped if the block raises.
+
+        Changes to the order store are applied after the commit (or after the hand-over in write-behind mode), i.e.
+        `query_order` does not see the orders written in the block until then. In write-behind mode they are rolled
+        back if the writer fails to commit the block.
+        """
+        if getattr(self._local, 'future', None) is not None:
+            yield
+            return
+
+        future = self._local.future = Future()
+        self._local.after_commit = []
+        try:
+            if self._writer is not None:
+                self._local.stmts = []
+                yield
+                self._local.last_write = self._writer.submit(self._local.stmts)
+                self._local.last_write.add_done_callback(lambda f: self._resolve(future, f))
+            else:
+                with self._pool.connection() as cnx:
+                    self._local.cnx = cnx
+                    # nothing is lost yet if the connection is, the transaction is started on a new one
+                    self._pool.retry(cnx, cnx.start_transaction)
+                    try:
+                        yield
+                        cnx.commit()
+                    except Exception:
+                        self._pool.rollback(cnx)
+                        raise
+                future.set_result(None)
+            for callback in self._local.after_commit:
+                callback()
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._local.cnx = None
+            self._local.stmts = None
+            self._local.after_commit = None
+            self._local.future = None
+
+    def increment_next_request_id(self, session_id: str, count: int = 1):
+        stmt = Statement.prepare_session_increment_next_request_id(session_id, count)
+        return self._exec_stmt(stmt)
 
     def insert_session(self, session_id: str):
-        stmt = Statement.build_stmt_session_insert(session_id, 'dummy')
-        self._exec_stmt(stmt)
+        stmt = Statement.prepare_session_insert(session_id, 'dummy')
+        return self._exec_stmt(stmt)
 
     def insert_execution(self, broker_id: str, broker_order_id: str, broker_execution_id: str, gateway_order_id: str,
                          is_buy: bool, symbol: str, quantity: int, price: float, leave_quantity: int, commission: float, currency: str, execution_datetime: datetime):
-        stmt = Statement.build_stmt_execution_insert(broker_id, broker_order_id, broker_execution_id, gateway_order_id,
+        stmt = Statement.prepare_execution_insert(broker_id, broker_order_id, broker_execution_id, gateway_order_id,
                                                      is_buy, symbol, quantity, price, leave_quantity, commission, currency, execution_datetime)
-        self._exec_stmt(stmt)
+        future = self._exec_stmt(stmt)
+        self._after_commit(lambda: self._executions.add(broker_id, broker_execution_id, execution_datetime),
+                           future, lambda: self._executions.discard(broker_id, broker_execution_id,
+                                                                     execution_datetime))
+        return future
 
     def insert_order(self, session_id: str, order_id: int, parent_order_id: int, broker_id: str, broker_order_id: str,
                      market: str, symbol: str, order_type: OrderType, is_buy: bool, quantity: int, price: float,
@@ -50,94 +121,120 @@ class DbMySql:
         if price is None and order_type == OrderType.MKT:
             price = 0
 
-        stmt = Statement.build_stmt_order_insert(session_id, order_id, parent_order_id, broker_id, broker_order_id,
+        stmt = Statement.prepare_order_insert(session_id, order_id, parent_order_id, broker_id, broker_order_id,
                                                  market, symbol, order_type, is_buy, quantity, price, 'none', portfolio,
                                                  action, strategy, reference, comment)
-        self._exec_stmt(stmt)
+        with self._order_write_lock:
+            future = self._exec_stmt(stmt)
+            self._write_order_store(future, broker_id, broker_order_id,
+                                    lambda: self._orders.insert(session_id, order_id, parent_order_id, broker_id,
+                                                                broker_order_id, market, symbol, order_type, is_buy,
+                                                                quantity, price, 'none', portfolio, action, strategy,
+                                                                reference, comment),
+                                    update_coverage=order_type == OrderType.STP)
+        return future
 
     def insert_position_by_entry(self, portfolio_id: str, strategy: str, market: str, symbol: str, position: int,
                                  session_id: str, order_id: int, order_reference: str, avg_price: float=0.0, state: str='PENDING'):
-        stmt = Statement.build_stmt_position_by_entry_insert(portfolio_id, strategy, market, symbol, position, avg_price,
+        stmt = Statement.prepare_position_by_entry_insert(portfolio_id, strategy, market, symbol, position, avg_price,
                                                              session_id, order_id, state, order_reference)
-        self._exec_stmt(stmt)
+        return self._exec_stmt(stmt)
 
     def update_position_by_entry(self, session_id: str = None, order_id: int = None, portfolio_id: str = None,
                                  strategy: str = None, order_reference: str = None, avg_price: float = None,
                                  state: str = None, position: int = None):
-        stmt = Statement.build_stmt_position_by_entry_update(session_id=session_id, order_id=order_id,
+        stmt = Statement.prepare_position_by_entry_update(session_id=session_id, order_id=order_id,
                                                              portfolio_id=portfolio_id, strategy=strategy,
                                                              order_reference=order_reference, avg_price=avg_price,
                                                              state=state, position=position)
-        self._exec_stmt(stmt)
+        return self._exec_stmt(stmt)
 
     def delete_position_by_entry(self, session_id: str, order_id: int):
-        stmt = f"delete from oms.position_by_entry where session_id = '{session_id}' and order_id = {order_id}"
-        self._exec_stmt(stmt)
+        stmt = Statement.prepare_position_by_entry_delete(session_id, order_id)
+        return self._exec_stmt(stmt)
 
     def insert_operation(self, portfolio_id: str, strategy: str, action: str, position: int, order_reference: str,
                          price: float = None, identity: str = None):
-        stmt = Statement.build_stmt_operation_insert(portfolio_id, strategy, action, position, order_reference, price, identity)
-        self._exec_stmt(stmt)
+        stmt = Statement.prepare_operation_insert(portfolio_id, strategy, action, position, order_reference, price, identity)
+        return self._exec_stmt(stmt)
 
     def insert_strategy(self, strategy: str):
-        stmt = Statement.build_stmt_strategy_insert(strategy)
-        self._exec_stmt(stmt)
+        stmt = Statement.prepare_strategy_insert(strategy)
+        return self._exec_stmt(stmt)
 
     def query_account(self, account_id: str):
-        stmt = Statement.build_stmt_account_select_by_id(account_id)
+        stmt = Statement.prepare_account_select_by_id(account_id)
         result = self._exec_query(stmt)
         if len(result) == 1:
             return result[0][TableAccount.ID], result[0][TableAccount.CASH], result[0][TableAccount.CURRENCY]
         return None, None, None
 
     def verify_account_portfolio_strategy(self, account_id: str, portfolio_id: str, strategy: str):
-        stmt = Statement.build_stmt_find_account_portfolio_strategy(account_id, portfolio_id, strategy)
+        stmt = Statement.prepare_find_account_portfolio_strategy(account_id, portfolio_id, strategy)
         result = self._exec_query(stmt)
         if len(result) > 0:
             return True
         return False
 
+    def has_execution(self, broker_id: str, broker_execution_id: str, execution_datetime: datetime = None) -> bool:
+        """
+        Whether the execution is in the ledger already, the database is only queried for an execution older than the
+        days kept by the execution store
+        """
+        if self._executions.covers(execution_datetime):
+            return (broker_id, str(broker_execution_id)) in self._executions
+        return len(self.query_executions(broker_id, broker_execution_id)) > 0
+
     def query_executions(self, broker_id: str, broker_execution_id: str = None, lookback: timedelta = None):
         if lookback:
             last_time = datetime.now() - lookback
         else:
             last_time = None
-        stmt = Statement.build_stmt_execution_select_by_broker_id_and_date(broker_id, broker_execution_id, last_time)
+        stmt = Statement.prepare_execution_select_by_broker_id_and_date(broker_id, broker_execution_id, last_time)
         return self._exec_query(stmt)
 
     def query_instruments(self):
-        stmt = Statement.build_stmt_instrument_select()
+        stmt = Statement.prepare_instrument_select()
         return self._exec_query(stmt)
 
     def query_order(self, broker_id: str = None, session_id: str = None, order_id: int = None,
                     broker_order_id: str = None, symbol: str = None, action: Action = None, portfolio: str = None,
                     strategy: str = None, order_type: OrderType = None, active_orders_only: bool = False,
                     order_by_last_modified=False, order_by_created=False):
-        stmt = Statement.build_stmt_order_select(broker_id, session_id, order_id, broker_order_id, symbol, action,
-                                                 portfolio, strategy,
-                                                 order_type.value if order_type is not None else None,
-                                                 active_orders_only, order_by_last_modified, order_by_created)
-        return self._exec_query(stmt)
+        return self._orders.query(broker_id, session_id, order_id, broker_order_id, symbol, action, portfolio,
+                                  strategy, order_type, active_orders_only, order_by_last_modified, order_by_created)
 
     def query_portfolio(self, portfolio_id: str = None, account_id: str = None):
-        stmt = Statement.build_stmt_portfolio_select_by_id_and_account_id(portfolio_id, account_id)
+        stmt = Statement.prepare_portfolio_select_by_id_and_account_id(portfolio_id, account_id)
         return self._exec_query(stmt)
 
     def query_position(self, portfolio_id: str = None, strategy: str = None, market: str = None, symbol: str = None):
-        stmt = Statement.build_stmt_position_select(portfolio_id, strategy, market, symbol)
+        stmt = Statement.prepare_position_select(portfolio_id, strategy, market, symbol)
+        return self._exec_query(stmt)
+
+    def query_position_by_account(self, account_id: str, strategy: str):
+        stmt = Statement.prepare_position_select_by_account(account_id, strategy)
         return self._exec_query(stmt)
 
     def query_position_by_entry(self, portfolio_id: str = None, strategy: str = None, market: str = None,
                                 symbol: str = None):
-        stmt = Statement.build_stmt_position_by_entry_select_by_position(portfolio_id, strategy, market, symbol)
+        stmt = Statement.prepare_position_by_entry_select_by_position(portfolio_id, strategy, market, symbol)
+        return self._exec_query(stmt)
+
+    def query_position_by_entry_by_account(self, account_id: str, strategy: str):
+        stmt = Statement.prepare_position_by_entry_select_by_account(account_id, strategy)
         return self._exec_query(stmt)
 
     def query_operation(self, portfolio_id: str, strategy: str, order_reference: str):
-        stmt = Statement.build_stmt_operation_select(portfolio_id, strategy, order_reference)
+        stmt = Statement.prepare_operation_select(portfolio_id, strategy, order_reference)
+        return self._exec_query(stmt)
+
+    def query_operation_by_account(self, account_id: str, strategy: str):
+        stmt = Statement.prepare_operation_select_by_account(account_id, strategy)
         return self._exec_query(stmt)
 
     def query_session(self, session_id: str):
-        stmt = Statement.build_stmt_session_select_by_id(session_id)
+        stmt = Statement.prepare_session_select_by_id(session_id)
         results = self._exec_query(stmt)
         if len(results) == 1:
             row = results[0]
@@ -145,45 +242,203 @@ class DbMySql:
         return None, None, None
 
     def query_total_position(self, symbol: str):
-        stmt = Statement.build_stmt_position_sum(symbol)
+        stmt = Statement.prepare_position_sum(symbol)
         return self._exec_query(stmt)
 
     def update_instrument(self, market: str, symbol: str, code: str, expiry: datetime):
-        stmt = Statement.build_stmt_instrument_insert_or_update(market, symbol, code, expiry)
-        self._exec_stmt(stmt)
+        stmt = Statement.prepare_instrument_insert_or_update(market, symbol, code, expiry)
+        return self._exec_stmt(stmt)
+
+    def update_instruments(self, instruments: List[Tuple[str, str, str, datetime]]) -> Future:
+        """
+        Insert or update instruments with one statement per `INSTRUMENT_BATCH_SIZE` instruments, committed at once
+
+        :param instruments: market, symbol, code and expiry of each instrument
+        """
+        future = None
+        with self.transaction():
+            for i in range(0, len(instruments), self.INSTRUMENT_BATCH_SIZE):
+                stmt = Statement.prepare_instrument_insert_or_update_many(instruments[i:i + self.INSTRUMENT_BATCH_SIZE])
+                future = self._exec_stmt(stmt)
+        if future is None:
+            future = Future()
+            future.set_result(None)
+        return future
 
     def update_order(self, broker_id: str, broker_order_id: str, quantity: int = None, price: float = None,
                      remaining_quantity: int = None, filled_quantity: int = None, state: OrderState = None,
                      action: Action = None):
-        stmt = Statement.build_stmt_order_update(broker_id, broker_order_id, quantity, price, remaining_quantity,
+        stmt = Statement.prepare_order_update(broker_id, broker_order_id, quantity, price, remaining_quantity,
                                                  filled_quantity, state, action)
-        self._exec_stmt(stmt)
+        with self._order_write_lock:
+            future = self._exec_stmt(stmt)
+            self._write_order_store(future, broker_id, broker_order_id,
+                                    lambda: self._orders.update(broker_id, broker_order_id, quantity, price,
+                                                                remaining_quantity, filled_quantity, state, action))
+        return future
 
     def update_position(self, portfolio_id: str, strategy: str, market: str, symbol: str, position: int,
                         avg_price: float = None):
-        stmt = Statement.build_stmt_position_insert_or_update(portfolio_id, strategy, market, symbol, position, avg_price)
-        self._exec_stmt(stmt)
-
-    def _exec_query(self, stmt: str):
-        with self._lock:
-            cursor = self.get_cursor()
-            try:
-                self._exec_stmt(stmt, cursor, False)
-                return cursor.fetchall()
-            finally:
-                cursor.close()
-
-    def _exec_stmt(self, stmt: str, cursor=None, commit: bool = True):
-        with self._lock:
-            self._logger.info(f'Execute: {stmt}')
-            local_cursor = cursor if cursor else self.get_cursor()
-            try:
-                local_cursor.execute(stmt)
-                if commit:
-                    self._cnx.commit()
-            except mysql.connector.Error as e:
-                self._logger.exception(f'MySQL exception when executing: {stmt}', e)
-                raise e
-            finally:
-                if not cursor:
-                    local_cursor.close()
+        stmt = Statement.prepare_position_insert_or_update(portfolio_id, strategy, market, symbol, position, avg_price)
+        future = self._exec_stmt(stmt)
+        self._after_commit(lambda: self._stop_coverage.add_position(portfolio_id, strategy, symbol, position),
+                           future, lambda: self._stop_coverage.add_position(portfolio_id, strategy, symbol, -position))
+        return future
+
+    @property
+    def stop_coverage(self) -> StopCoverage:
+        return self._stop_coverage
+
+    def _load(self):
+        """
+        Load the order and execution stores and the stop coverage, once the connection pool and the writer are set up
+        """
+        self._local = threading.local()
+        self._sql_log = RateLimitedLog(self._logger, rate=self.SQL_LOG_RATE)
+        # keeps the order of writes to the same order identical in the database and in the order store
+        self._order_write_lock = threading.Lock()
+        # undo of the writes applied in memory, by future of the write, in write-behind mode
+        self._undo_lock = threading.Lock()
+        self._undos: Dict[Future, List[Callable[[], None]]] = dict()
+        self._orders = OrderStore()
+        self._orders.load(self._exec_query(Statement.build_stmt_order_select_all()))
+        self._executions = ExecutionStore()
+        since = datetime.combine(self._executions.oldest_day, datetime.min.time())
+        self._executions.load(self._exec_query(Statement.prepare_execution_select_ids(since)))
+        self._stop_coverage = StopCoverage()
+        self._stop_coverage.load(self.query_position(),
+                                 self._orders.query(order_type=OrderType.STP, active_orders_only=True))
+
+    def _after_commit(self, callback: Callable[[], None], future: Future = None, undo: Callable[[], None] = None):
+        """
+        Apply a write to the in-memory stores once it is committed, or handed over to the writer in write-behind mode
+
+        :param future: future of the write, it fails if the writer cannot commit the write
+        :param undo: called if the future fails, once the write has been applied
+        """
+        if future is not None and undo is not None and self._writer is not None:
+            apply = callback
+
+            def callback():
+                apply()
+                self._undo_on_failure(future, undo)
+
+        after_commit = getattr(self._local, 'after_commit', None)
+        if after_commit is not None:
+            after_commit.append(callback)
+        else:
+            callback()
+
+    def _undo_on_failure(self, future: Future, undo: Callable[[], None]):
+        """
+        The writes of a transaction share its future, they are undone in reverse order
+        """
+        with self._undo_lock:
+            undos = self._undos.get(future)
+            is_new = undos is None
+            if is_new:
+                undos = self._undos[future] = []
+            undos.append(undo)
+        if is_new:
+            future.add_done_callback(self._undo)
+
+    def _undo(self, future: Future):
+        with self._undo_lock:
+            undos = self._undos.pop(future, [])
+        if future.exception() is None:
+            return
+        self._logger.error('%d write(s) are not committed, they are undone in memory: %r', len(undos),
+                           future.exception())
+        for undo in reversed(undos):
+            undo()
+
+    def _write_order_store(self, future: Future, broker_id: str, broker_order_id: str, apply: Callable[[], None],
+                           update_coverage: bool = True):
+        """
+        Apply a write of an order to the order store and the stop coverage, in write-behind mode the order is rolled
+        back if the writer fails to commit the write
+        """
+        def write():
+            before = self._orders.checkpoint(broker_id, broker_order_id) if self._writer is not None else None
+            apply()
+            if update_coverage:
+                self._update_stop_coverage(broker_id, broker_order_id)
+            if self._writer is not None:
+                after = self._orders.checkpoint(broker_id, broker_order_id)
+                self._undo_on_failure(future, lambda: self._rollback_order(broker_id, broker_order_id, before, after))
+        self._after_commit(write)
+
+    def _rollback_order(self, broker_id: str, broker_order_id: str, before: OrderCheckpoint, after: OrderCheckpoint):
+        if not self._orders.rollback(broker_id, broker_order_id, before, after):
+            self._logger.error('Order %s/%s has been written again since the write which is not committed, the order '
+                               'store may differ from the ledger', broker_id, broker_order_id)
+        if self._orders.checkpoint(broker_id, broker_order_id) is None:
+            self._stop_coverage.remove_stop(broker_id, broker_order_id)
+        else:
+            self._update_stop_coverage(broker_id, broker_order_id)
+
+    def _update_stop_coverage(self, broker_id: str, broker_order_id: str):
+        for row in self._orders.query(broker_id=broker_id, broker_order_id=broker_order_id):
+            self._stop_coverage.update_stop(row)
+
+    def _exec_query(self, stmt: Union[str, PreparedStatement]):
+        # read your own writes: wait for the statements queued by this thread to be committed
+        last_write = getattr(self._local, 'last_write', None)
+        if last_write is not None and not last_write.done():
+            futures.wait([last_write])
+
+        def query(cnx):
+            with self._pool.cursor(cnx, stmt) as cursor:
+                self._execute(cursor, stmt)
+                # prepared cursors return tuples
+                return [dict(zip(cursor.column_names, row)) for row in cursor.fetchall()]
+        return self._run(query)
+
+    def _exec_stmt(self, stmt: Union[str, PreparedStatement]) -> Future:
+        """
+        :return: a future resolved when the statement is committed, it is resolved already unless write-behind is
+                 enabled or the statement is part of a transaction
+        """
+        future = getattr(self._local, 'future', None)
+        if self._writer is not None:
+            if future is not None:
+                self._local.stmts.append(stmt)
+                return future
+            self._local.last_write = self._writer.submit([stmt])
+            return self._local.last_write
+
+        def execute(cnx):
+            with self._pool.cursor(cnx, stmt) as cursor:
+                self._execute(cursor, stmt)
+        self._run(execute)
+
+        if future is None:
+            future = Future()
+            future.set_result(None)
+        return future
+
+    def _run(self, fn: Callable[[Any], T]) -> T:
+        """
+        Run statements on the connection of the transaction of the current thread, otherwise on a connection from the
+        pool, retried on a new connection if the connection is lost
+        """
+        cnx = getattr(self._local, 'cnx', None)
+        if cnx is not None:
+            return fn(cnx)
+        with self._pool.connection() as cnx:
+            return self._pool.retry(cnx, lambda: fn(cnx))
+
+    def _execute(self, cursor, stmt: Union[str, PreparedStatement]):
+        self._sql_log.log(statement_kind(statement_sql(stmt)), 'Execute: %s', stmt)
+        try:
+            self._pool.execute(cursor, stmt)
+        except mysql.connector.Error as e:
+            self._logger.exception('MySQL exception when executing: %s', stmt)
+            raise e
+
+    @staticmethod
+    def _resolve(future: Future, done: Future):
+        if done.exception() is not None:
+            future.set_exception(done.exception())
+        else:
+            future.set_result(None)
@@ -1,7 +1,8 @@
 from collections import OrderedDict
 
-from oms.common.config import CFG_LEDGER, CFG_MYSQL
+from oms.common.config import CFG_LEDGER, CFG_MYSQL, CFG_SQLITE
 from .db import DbMySql
+from .sqlite import DbSqlite
 
 
 class LedgerFactory:
@@ -11,5 +12,7 @@ class LedgerFactory:
 
         if CFG_MYSQL in cfg:
             return DbMySql(cfg)
+        if CFG_SQLITE in cfg:
+            return DbSqlite(cfg)
 
         raise ValueError('Can\'t find any ledger configuration')
@@ -0,0 +1,142 @@
+import logging
+import time
+from contextlib import contextmanager
+from queue import Queue
+from typing import Any, Callable, Dict, TypeVar, Union
+
+import mysql.connector
+
+from oms.common.latency import LATENCY, now
+from .statement import PreparedStatement
+
+
+T = TypeVar('T')
+
+
+class ConnectionPool:
+    """
+    Fixed size pool of MySQL connections, or of connections with the same interface, e.g. SQLite connections.
+
+    Connections are opened in auto-commit mode, so a connection which only runs queries always reads the latest
+    committed data. Multi-statement transactions are started explicitly by the borrower.
+
+    Each connection keeps one prepared cursor per statement template, so a template is parsed by the server once per
+    connection and only the parameters are sent afterwards.
+
+    A connection is only pinged when it is borrowed after being idle for a while. A connection lost in between, e.g.
+    MySQL is restarted or fails over, is reconnected when a statement fails on it, see `retry`.
+    """
+    N_RETRY = 5
+    RETRY_DELAY = 2
+    IDLE_PING_INTERVAL_IN_SEC = 60
+    # errors raised when the connection to the server is lost
+    CONNECTION_ERRORS = (mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError)
+
+    def __init__(self, cfg: Dict[str, Any], size: int, connect: Callable[..., Any] = None):
+        self._logger = logging.getLogger(__name__)
+        if size < 1:
+            raise ValueError(f'Pool size must be at least 1, got {size}')
+
+        if connect is None:
+            connect = mysql.connector.connect
+            cfg = dict(cfg)
+            cfg.setdefault('autocommit', True)
+
+        self._size = size
+        self._last_used: Dict[int, float] = dict()
+        self._cursors: Dict[int, Dict[str, Any]] = dict()
+        self._connections = Queue()
+        for _ in range(size):
+            cnx = connect(**cfg)
+            self._last_used[id(cnx)] = time.monotonic()
+            self._cursors[id(cnx)] = dict()
+            self._connections.put(cnx)
+
+    @property
+    def size(self):
+        return self._size
+
+    def close(self):
+        for _ in range(self._size):
+            cnx = self._connections.get()
+            for cursor in self._cursors.pop(id(cnx), dict()).values():
+                cursor.close()
+            cnx.close()
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection, block until one is returned to the pool if all of them are in use
+        """
+        start = now()
+        cnx = self._connections.get()
+        LATENCY.record('pool', 'wait', start)
+        try:
+            # only check connections which have been idle for a while, it is a round trip to the server
+            if time.monotonic() - self._last_used[id(cnx)] > self.IDLE_PING_INTERVAL_IN_SEC:
+                self.reconnect(cnx)
+            yield cnx
+        finally:
+            self._last_used[id(cnx)] = time.monotonic()
+            self._connections.put(cnx)
+
+    def reconnect(self, cnx):
+        """
+        Reconnect a borrowed connection if it is lost
+        """
+        cnx.ping(True, self.N_RETRY, self.RETRY_DELAY)
+        # statements prepared before a reconnection are gone on the server side
+        self._cursors[id(cnx)] = dict()
+
+    def retry(self, cnx, fn: Callable[[], T]) -> T:
+        """
+        Run statements on a borrowed connection, once more after reconnecting if the connection is lost. The
+        statements must not be part of a transaction started before, it is lost with the connection.
+        """
+        try:
+            return fn()
+        except self.CONNECTION_ERRORS as e:
+            self._logger.warning(f'Connection to MySQL is lost, reconnect and retry: {e!r}')
+            self.reconnect(cnx)
+            return fn()
+
+    def rollback(self, cnx):
+        """
+        Roll back the transaction of a borrowed connection, the transaction is gone already if the connection is lost
+        """
+        try:
+            cnx.rollback()
+        except self.CONNECTION_ERRORS as e:
+            self._logger.warning(f'Unable to roll back, the connection to MySQL is lost: {e!r}')
+
+    @contextmanager
+    def cursor(self, cnx, stmt: Union[str, PreparedStatement]):
+        """
+        A cursor to execute the statement on a borrowed connection, the prepared cursor of the template if the
+        statement is a `PreparedStatement`, otherwise a plain cursor closed on exit
+        """
+        if isinstance(stmt, PreparedStatement):
+            cursors = self._cursors[id(cnx)]
+            cursor = cursors.get(stmt.template)
+            if cursor is None:
+                cursor = cursors[stmt.template] = cnx.cursor(prepared=True)
+            yield cursor
+            return
+
+        cursor = cnx.cursor()
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def execute(cursor, stmt: Union[str, PreparedStatement]):
+        start = now()
+        if isinstance(stmt, PreparedStatement):
+            cursor.execute(stmt.template, stmt.params)
+            sql = stmt.template
+        else:
+            cursor.execute(stmt)
+            sql = stmt
+        # histograms per kind of statement, e.g. SELECT or INSERT
+        LATENCY.record('mysql', sql.split(None, 1)[0].upper(), start)
@@ -0,0 +1,156 @@
+import logging
+import os
+import re
+import sqlite3
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+from pathlib import Path
+from typing import Dict, List, Sequence
+
+from oms.common.config import CFG_DATABASE, CFG_SCHEMA, CFG_SCRIPTS, CFG_SQLITE, CFG_WRITE_BEHIND
+from .db import DbMySql
+from .pool import ConnectionPool
+from .store import OrderStore
+
+MEMORY = ':memory:'
+
+# same representation of the values as MySQL: decimals with 5 digits, timestamps as naive datetimes
+sqlite3.register_adapter(Decimal, str)
+sqlite3.register_adapter(date, lambda v: v.isoformat())
+sqlite3.register_adapter(datetime, lambda v: v.isoformat(' '))
+sqlite3.register_converter('decimal', lambda v: Decimal(v.decode()).quantize(OrderStore.PRICE_SCALE))
+# MySQL truncates the datetimes stored in date columns
+sqlite3.register_converter('date', lambda v: datetime.fromisoformat(v.decode()).date())
+sqlite3.register_converter('datetime', lambda v: datetime.fromisoformat(v.decode()))
+sqlite3.register_converter('timestamp', lambda v: datetime.fromisoformat(v.decode()))
+
+
+class SqliteCursor:
+    """
+    Cursor with the interface of the MySQL cursors used by the ledger, it runs the MySQL statements translated to
+    SQLite
+    """
+    def __init__(self, cnx: 'SqliteConnection'):
+        self._cnx = cnx
+        self._cursor = cnx.raw.cursor()
+
+    @property
+    def column_names(self):
+        return tuple(d[0] for d in self._cursor.description) if self._cursor.description else ()
+
+    def execute(self, operation: str, params: Sequence = ()):
+        self._cursor.execute(self._cnx.translate(operation), tuple(params or ()))
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def close(self):
+        self._cursor.close()
+
+
+class SqliteConnection:
+    """
+    SQLite connection with the interface of the MySQL connections used by the ledger.
+
+    A new database is created from the schema, then the scripts are run, e.g. to add the accounts. The connection is
+    in auto-commit mode like the MySQL connections of the pool, transactions are started explicitly.
+    """
+    _DUPLICATE_KEY = re.compile(r' on duplicate key update ', re.IGNORECASE)
+    _INSERT = re.compile(r'^insert (ignore )?into (\w+)', re.IGNORECASE)
+    _VALUES = re.compile(r'values\((\w+)\)', re.IGNORECASE)
+
+    def __init__(self, database: str, schema: str, scripts: List[str]):
+        is_new = database == MEMORY or not os.path.exists(database)
+        self._cnx = sqlite3.connect(database, detect_types=sqlite3.PARSE_DECLTYPES, isolation_level=None,
+                                    check_same_thread=False)
+        self._cnx.execute('PRAGMA foreign_keys = ON')
+        if is_new:
+            for script in [schema] + list(scripts):
+                with open(script) as f:
+                    self._cnx.executescript(f.read())
+        self._statements: Dict[str, str] = dict()
+
+    @property
+    def raw(self) -> sqlite3.Connection:
+        return self._cnx
+
+    def close(self):
+        self._cnx.close()
+
+    def commit(self):
+        if self._cnx.in_transaction:
+            self._cnx.execute('commit')
+
+    def cursor(self, prepared: bool = False) -> SqliteCursor:
+        # SQLite caches the compiled statements of a connection, every cursor is "prepared"
+        return SqliteCursor(self)
+
+    def ping(self, *args, **kwargs):
+        pass
+
+    def rollback(self):
+        if self._cnx.in_transaction:
+            self._cnx.execute('rollback')
+
+    def start_transaction(self):
+        self._cnx.execute('begin')
+
+    def translate(self, operation: str) -> str:
+        """
+        SQLite version of a MySQL statement of `Statement`
+        """
+        stmt = self._statements.get(operation)
+        if stmt is None:
+            stmt = operation.replace('%s', '?')
+            insert = self._INSERT.match(stmt)
+            if insert is not None:
+                table = insert.group(2)
+                if insert.group(1):
+                    stmt = f'insert or ignore into {table}{stmt[insert.end():]}'
+
+                parts = self._DUPLICATE_KEY.split(stmt)
+                if len(parts) == 2:
+                    # `values(col)` is the value which would have been inserted
+                    assignments = self._VALUES.sub(r'excluded.\1', parts[1])
+                    key = ','.join(self._primary_key(table))
+                    stmt = f'{parts[0]} on conflict ({key}) do update set {assignments}'
+            self._statements[operation] = stmt
+        return stmt
+
+    def _primary_key(self, table: str) -> List[str]:
+        columns = sorted((row[5], row[1]) for row in self._cnx.execute(f'PRAGMA table_info({table})') if row[5])
+        if not columns:
+            raise ValueError(f'Table {table} has no primary key, unable to translate "on duplicate key update"')
+        return [name for _, name in columns]
+
+
+class DbSqlite(DbMySql):
+    """
+    Ledger backed by SQLite, in a file or in memory, with the same interface as `DbMySql`. Meant for benchmarks and
+    tests which run the whole OMS on one box: the statements are the MySQL statements translated to SQLite, and the
+    schema has the same log tables and triggers as the MySQL one.
+
+    Configuration:
+        database: path of the database file, created if it does not exist, in memory if not given
+        schema: schema of a new database, `sql/schema.sqlite.sql` if not given
+        scripts: scripts run after the schema when the database is created, e.g. to add accounts and portfolios
+    """
+    DEFAULT_SCHEMA = str(Path(__file__).resolve().parents[4] / 'sql' / 'schema.sqlite.sql')
+
+    def __init__(self, config: OrderedDict):
+        self._logger = logging.getLogger(__name__)
+        cfg = config[CFG_SQLITE] or dict()
+        database = cfg.get(CFG_DATABASE, MEMORY)
+        schema = cfg.get(CFG_SCHEMA, self.DEFAULT_SCHEMA)
+        scripts = cfg.get(CFG_SCRIPTS, [])
+        if cfg.get(CFG_WRITE_BEHIND):
+            self._logger.warning('Write-behind is not supported by the SQLite ledger, statements are committed '
+                                 'synchronously')
+        self._logger.info(f'Open SQLite database {database}')
+
+        # an in-memory database only lives in its connection, every thread goes through the same one
+        self._pool = ConnectionPool(dict(database=database, schema=schema, scripts=scripts), 1,
+                                    connect=SqliteConnection)
+        self._writer = None
+        self._load()
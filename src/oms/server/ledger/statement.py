@@ -1,7 +1,9 @@
+import re
 from datetime import datetime
 from enum import Enum
+from functools import lru_cache
 from numbers import Number
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, NamedTuple, Tuple
 
 import ujson
 
@@ -140,6 +142,7 @@ class TableOperation:
     ORDER_REFERENCE = 'order_reference'
     IDENTITY = 'identity'
     CREATED = 'created'
+    ID = 'id'
 
 
 class TableSession:
@@ -155,6 +158,32 @@ class TableStrategy:
     DESCRIPTION = 'description'
 
 
+class PreparedStatement(NamedTuple):
+    """
+    Statement template with `%s` placeholders and the parameters bound to them
+    """
+    template: str
+    params: tuple
+
+
+_STATEMENT_KIND = re.compile(r'^\s*(\w+)(?:\s+ignore)?(?:\s+into|.*?\s+from)?\s+(\w+)', re.IGNORECASE | re.DOTALL)
+
+
+@lru_cache(maxsize=1024)
+def statement_kind(sql: str) -> str:
+    """
+    Verb and table of a statement, e.g. `INSERT order_`
+    """
+    match = _STATEMENT_KIND.match(sql)
+    if match is None:
+        return sql.split(None, 1)[0].upper() if sql.strip() else ''
+    return f'{match.group(1).upper()} {match.group(2)}'
+
+
+def statement_sql(stmt) -> str:
+    return stmt.template if isinstance(stmt, PreparedStatement) else stmt
+
+
 class Statement:
     CONDITION_AND = ' and '
 
@@ -264,6 +293,17 @@ class Statement:
 
         return f"{stmt}{conditions}{order_by}"
 
+    @staticmethod
+    def build_stmt_order_select_all():
+        stmt = Statement._build_select_stmt(
+            [TableOrder.SESSION_ID, TableOrder.ORDER_ID, TableOrder.PARENT_ORDER_ID, TableOrder.BROKER_ID,
+             TableOrder.BROKER_ORDER_ID, TableOrder.MARKET, TableOrder.SYMBOL, TableOrder.TYPE, TableOrder.IS_BUY,
+             TableOrder.QUANTITY, TableOrder.PRICE, TableOrder.STATE, TableOrder.QUALIFIER, TableOrder.PORTFOLIO,
+             TableOrder.ACTION, TableOrder.STRATEGY, TableOrder.REFERENCE, TableOrder.COMMENT,
+             TableOrder.FILLED_QUANTITY, TableOrder.REMAINING_QUANTITY, AllTables.CREATED, AllTables.LAST_MODIFIED],
+            TableOrder.table_name, False)
+        return f"{stmt}order by {AllTables.CREATED}"
+
     @staticmethod
     def build_stmt_portfolio_select_by_id_and_account_id(portfolio_id: str = None, account_id: str = None):
         condition = False if portfolio_id is None and account_id is None else True
@@ -483,6 +523,11 @@ class Statement:
         stmt += Statement._build_simple_where_clause(where_items)
         return stmt
 
+    @staticmethod
+    def build_stmt_position_by_entry_delete(session_id: str, order_id: int):
+        return (f"delete from {TablePositionByEntry.table_name} where "
+                f"{TablePositionByEntry.SESSION_ID}='{session_id}' and {TablePositionByEntry.ORDER_ID}={order_id}")
+
     @staticmethod
     def build_stmt_session_insert(session_id: str, ip: str) -> str:
         return Statement._build_insert_stmt(['id', 'next_request_id', 'ip'], 'session', [session_id, '1', ip])
@@ -507,3 +552,409 @@ class Statement:
         if value is not None:
             cols.append(col_name)
             values.append(value)
+
+    # Prepared statements
+    #
+    # Each `prepare_*` method is the counterpart of the `build_stmt_*` method with the same suffix. It returns a
+    # template with `%s` placeholders and the parameters to bind, templates are cached per combination of filters so
+    # the server can reuse the prepared statement.
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _insert_template(cols: Tuple[str, ...], table: str, ignore: bool = False, suffix: str = '') -> str:
+        insert_keyword = 'insert ignore' if ignore else 'insert'
+        return f'{insert_keyword} into {table} ({",".join(cols)}) values ({",".join(["%s"] * len(cols))}){suffix}'
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _select_template(cols: Tuple[str, ...], table: str, conditions: Tuple[str, ...] = (), suffix: str = '') -> str:
+        where = f' where {" and ".join(conditions)}' if conditions else ''
+        return f'select {",".join(cols)} from {table}{where}{suffix}'
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _update_template(table: str, cols: Tuple[str, ...], conditions: Tuple[str, ...]) -> str:
+        return f'update {table} set {",".join(f"{c}=%s" for c in cols)} where {" and ".join(conditions)}'
+
+    @staticmethod
+    def _prepare(template: str, params) -> PreparedStatement:
+        return PreparedStatement(template, tuple(Statement._to_param(v) for v in params))
+
+    @staticmethod
+    def _prepare_conditions(items: List[Tuple[str, Any]]) -> Tuple[Tuple[str, ...], List[Any]]:
+        """
+        Keep the conditions, e.g. `symbol=%s`, whose value is not None
+        """
+        conditions = []
+        params = []
+        for condition, value in items:
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+        return tuple(conditions), params
+
+    @staticmethod
+    def _to_param(v):
+        if isinstance(v, datetime):
+            return v.replace(tzinfo=None)
+        elif isinstance(v, Enum):
+            return v.value
+        return v
+
+    @staticmethod
+    def prepare_account_select_by_id(account_id: str) -> PreparedStatement:
+        template = Statement._select_template((TableAccount.ID, TableAccount.CASH, TableAccount.CURRENCY),
+                                              TableAccount.table_name, (f'{TableAccount.ID}=%s',))
+        return Statement._prepare(template, [account_id])
+
+    @staticmethod
+    def prepare_execution_select_by_broker_id_and_date(broker_id: str, broker_execution_id: str = None,
+                                                       execution_datetime: datetime = None) -> PreparedStatement:
+        conditions, params = Statement._prepare_conditions([
+            (f'{TableExecution.BROKER_ID}=%s', broker_id),
+            (f'{TableExecution.BROKER_EXECUTION_ID}=%s', broker_execution_id),
+            (f'{TableExecution.EXECUTION_DATETIME}>=%s', execution_datetime)])
+        template = Statement._select_template(
+            (TableExecution.BROKER_ID, TableExecution.BROKER_ORDER_ID, TableExecution.BROKER_EXECUTION_ID,
+             TableExecution.GATEWAY_ORDER_ID, TableExecution.IS_BUY, TableExecution.QUANTITY, TableExecution.PRICE,
+             TableExecution.LEAVE_QUANTITY, TableExecution.EXECUTION_DATETIME), TableExecution.table_name, conditions)
+        return Statement._prepare(template, params)
+
+    @staticmethod
+    def prepare_execution_select_ids(execution_datetime: datetime) -> PreparedStatement:
+        """
+        IDs of the executions of every broker since a point in time
+        """
+        template = Statement._select_template(
+            (TableExecution.BROKER_ID, TableExecution.BROKER_EXECUTION_ID, TableExecution.EXECUTION_DATETIME),
+            TableExecution.table_name, (f'{TableExecution.EXECUTION_DATETIME}>=%s',))
+        return Statement._prepare(template, [execution_datetime])
+
+    @staticmethod
+    def prepare_instrument_select() -> PreparedStatement:
+        template = Statement._select_template(
+            (TableInstrument.MARKET, TableInstrument.SYMBOL, TableInstrument.CODE, TableInstrument.EXPIRY),
+            TableInstrument.table_name)
+        return Statement._prepare(template, [])
+
+    @staticmethod
+    def prepare_order_select(broker_id: str = None, session_id: str = None, order_id: int = None,
+                             broker_order_id: str = None, symbol: str = None, action: Action = None,
+                             portfolio: str = None, strategy: str = None, order_type: str = None,
+                             active_orders_only: bool = False, order_by_last_modified: bool = False,
+                             order_by_created: bool = False) -> PreparedStatement:
+        conditions, params = Statement._prepare_conditions([
+            (f'{TableOrder.BROKER_ID}=%s', broker_id),
+            (f'{TableOrder.SESSION_ID}=%s', session_id),
+            (f'{TableOrder.ORDER_ID}=%s', order_id),
+            (f'{TableOrder.BROKER_ORDER_ID}=%s', str(broker_order_id) if broker_order_id is not None else None),
+            (f'{TableOrder.SYMBOL}=%s', symbol),
+            (f'{TableOrder.ACTION}=%s', action),
+            (f'{TableOrder.PORTFOLIO}=%s', portfolio),
+            (f'{TableOrder.STRATEGY}=%s', strategy),
+            (f'{TableOrder.TYPE}=%s', order_type)])
+        if active_orders_only:
+            conditions += (f"{TableOrder.STATE} in "
+                           f"({','.join(map(Statement._to_insert_value, TableOrder.ACTIVE_STATES))})",)
+
+        order_by = ''
+        if order_by_last_modified:
+            order_by = f' order by {AllTables.LAST_MODIFIED} desc'
+        elif order_by_created:
+            order_by = f' order by {AllTables.CREATED}'
+
+        template = Statement._select_template(
+            (TableOrder.SESSION_ID, TableOrder.ORDER_ID, TableOrder.PARENT_ORDER_ID, TableOrder.BROKER_ID,
+             TableOrder.BROKER_ORDER_ID, TableOrder.MARKET, TableOrder.SYMBOL, TableOrder.TYPE, TableOrder.IS_BUY,
+             TableOrder.QUANTITY, TableOrder.PRICE, TableOrder.STATE, TableOrder.QUALIFIER, TableOrder.PORTFOLIO,
+             TableOrder.ACTION, TableOrder.STRATEGY, TableOrder.REFERENCE, TableOrder.COMMENT,
+             TableOrder.FILLED_QUANTITY, TableOrder.REMAINING_QUANTITY), TableOrder.table_name, conditions, order_by)
+        return Statement._prepare(template, params)
+
+    @staticmethod
+    def prepare_portfolio_select_by_id_and_account_id(portfolio_id: str = None,
+                                                      account_id: str = None) -> PreparedStatement:
+        conditions, params = Statement._prepare_conditions([(f'{TablePortfolio.ID}=%s', portfolio_id),
+                                                            (f'{TablePortfolio.ACCOUNT_ID}=%s', account_id)])
+        template = Statement._select_template((TablePortfolio.ID, TablePortfolio.ACCOUNT_ID),
+                                              TablePortfolio.table_name, conditions)
+        return Statement._prepare(template, params)
+
+    @staticmethod
+    def prepare_position_select(portfolio_id: str = None, strategy: str = None, market: str = None,
+                                symbol: str = None) -> PreparedStatement:
+        conditions, params = Statement._prepare_conditions([(f'{TablePosition.PORTFOLIO_ID}=%s', portfolio_id),
+                                                            (f'{TablePosition.STRATEGY}=%s', strategy),
+                                                            (f'{TablePosition.MARKET}=%s', market),
+                                                            (f'{TablePosition.SYMBOL}=%s', symbol)])
+        template = Statement._select_template(
+            (TablePosition.PORTFOLIO_ID, TablePosition.STRATEGY, TablePosition.MARKET, TablePosition.SYMBOL,
+             TablePosition.POSITION, TablePosition.AVG_PRICE), TablePosition.table_name, conditions)
+        return Statement._prepare(template, params)
+
+    @staticmethod
+    def prepare_operation_select(portfolio_id: str = None, strategy: str = None,
+                                 order_reference: str = None) -> PreparedStatement:
+        conditions, params = Statement._prepare_conditions([
+            (f'{TableOperation.PORTFOLIO_ID}=%s', portfolio_id),
+            (f'{TableOperation.STRATEGY}=%s', strategy),
+            (f'{TableOperation.ORDER_REFERENCE}=%s', order_reference)])
+        template = Statement._select_template(
+            (TableOperation.CREATED, TableOperation.ACTION, TableOperation.POSITION, TableOperation.PRICE,
+             TableOperation.IDENTITY), TableOperation.table_name, conditions)
+        return Statement._prepare(template, params)
+
+    @staticmethod
+    def prepare_position_sum(symbol: str) -> PreparedStatement:
+        template = Statement._select_template(
+            (TablePosition.SYMBOL, f'sum({TablePosition.POSITION}) as {TablePosition.POSITION}'),
+            TablePosition.table_name, (f'{TablePosition.SYMBOL}=%s',))
+        return Statement._prepare(template, [symbol])
+
+    @staticmethod
+    def prepare_session_select_by_id(session_id: str) -> PreparedStatement:
+        template = Statement._select_template((TableSession.ID, TableSession.NEXT_REQUEST_ID, TableSession.IP),
+                                              TableSession.table_name, (f'{TableSession.ID}=%s',))
+        return Statement._prepare(template, [session_id])
+
+    @staticmethod
+    def prepare_find_account_portfolio_strategy(account: str, portfolio: str, strategy: str) -> PreparedStatement:
+        return Statement._prepare("select a.id, p.id, s.id from account as a inner join portfolio as p inner join "
+                                  "strategy as s on a.id=p.account_id where a.id=%s and p.id=%s and s.id=%s",
+                                  [account, portfolio, strategy])
+
+    @staticmethod
+    def prepare_execution_insert(broker_id: str, broker_order_id: str, broker_execution_id: str,
+                                 gateway_order_id: str, is_buy: bool, symbol: str, quantity: int, price: float,
+                                 leave_quantity: int, commission: float, currency: str,
+                                 execution_datetime: datetime) -> PreparedStatement:
+        template = Statement._insert_template(
+            (TableExecution.BROKER_ID, TableExecution.BROKER_ORDER_ID, TableExecution.BROKER_EXECUTION_ID,
+             TableExecution.GATEWAY_ORDER_ID, TableExecution.IS_BUY, TableExecution.SYMBOL, TableExecution.QUANTITY,
+             TableExecution.PRICE, TableExecution.LEAVE_QUANTITY, TableExecution.COMMISSION, TableExecution.CURRENCY,
+             TableExecution.EXECUTION_DATETIME), TableExecution.table_name)
+        return Statement._prepare(template, [broker_id, broker_order_id, broker_execution_id, gateway_order_id, is_buy,
+                                             symbol, quantity, price, leave_quantity, commission, currency,
+                                             execution_datetime])
+
+    @staticmethod
+    def prepare_instrument_insert_or_update(market: str, symbol: str, code: str,
+                                            expiry: datetime) -> PreparedStatement:
+        template = Statement._insert_template(
+            (TableInstrument.MARKET, TableInstrument.SYMBOL, TableInstrument.CODE, TableInstrument.EXPIRY),
+            TableInstrument.table_name,
+            suffix=(f' on duplicate key update {TableInstrument.CODE}=values({TableInstrument.CODE}), '
+                    f'{TableInstrument.EXPIRY}=values({TableInstrument.EXPIRY})'))
+        return Statement._prepare(template, [market, symbol, code, expiry])
+
+    @staticmethod
+    def prepare_instrument_insert_or_update_many(
+            instruments: List[Tuple[str, str, str, datetime]]) -> PreparedStatement:
+        """
+        Same as `prepare_instrument_insert_or_update` for several instruments in one statement
+
+        :param instruments: market, symbol, code and expiry of each instrument
+        """
+        row = f'({",".join(["%s"] * 4)})'
+        template = (f'insert into {TableInstrument.table_name} ({TableInstrument.MARKET},{TableInstrument.SYMBOL},'
+                    f'{TableInstrument.CODE},{TableInstrument.EXPIRY}) values {",".join([row] * len(instruments))}'
+                    f' on duplicate key update {TableInstrument.CODE}=values({TableInstrument.CODE}), '
+                    f'{TableInstrument.EXPIRY}=values({TableInstrument.EXPIRY})')
+        return Statement._prepare(template, [v for instrument in instruments for v in instrument])
+
+    @staticmethod
+    def prepare_order_insert(session_id: str, order_id: int, parent_order_id: int, broker_id: str,
+                             broker_order_id: str, market: str, symbol: str, type_: str, is_buy: bool, quantity: int,
+                             price: float, qualifier, portfolio: str, action: str, strategy: str, reference: str,
+                             comment: Dict[str, Any]) -> PreparedStatement:
+        comment_serialized = None
+        if comment is not None:
+            comment_serialized = ujson.dumps(comment)
+        order_state = OrderState.NEW.value.lower()
+
+        template = Statement._insert_template(
+            (TableOrder.SESSION_ID, TableOrder.ORDER_ID, TableOrder.PARENT_ORDER_ID, TableOrder.BROKER_ID,
+             TableOrder.BROKER_ORDER_ID, TableOrder.MARKET, TableOrder.SYMBOL, TableOrder.TYPE, TableOrder.IS_BUY,
+             TableOrder.QUANTITY, TableOrder.PRICE, TableOrder.STATE, TableOrder.QUALIFIER, TableOrder.PORTFOLIO,
+             TableOrder.ACTION, TableOrder.STRATEGY, TableOrder.REFERENCE, TableOrder.COMMENT), TableOrder.table_name)
+        return Statement._prepare(template, [session_id, order_id, parent_order_id, broker_id, str(broker_order_id),
+                                             market, symbol, type_, is_buy, quantity, price, order_state, qualifier,
+                                             portfolio, action, strategy, reference, comment_serialized])
+
+    @staticmethod
+    def prepare_order_update(broker_id: str, broker_order_id: str, quantity: int = None, price: float = None,
+                             remaining_quantity: int = None, filled_quantity: int = None, state: OrderState = None,
+                             action: Action = None) -> PreparedStatement:
+        cols = []
+        values = []
+        Statement._append_value(cols, values, TableOrder.QUANTITY, quantity)
+        Statement._append_value(cols, values, TableOrder.PRICE, price)
+        Statement._append_value(cols, values, TableOrder.REMAINING_QUANTITY, remaining_quantity)
+        Statement._append_value(cols, values, TableOrder.FILLED_QUANTITY, filled_quantity)
+        Statement._append_value(cols, values, TableOrder.STATE, state)
+        Statement._append_value(cols, values, TableOrder.ACTION, action)
+
+        template = Statement._update_template(TableOrder.table_name, tuple(cols),
+                                              (f'{TableOrder.BROKER_ID}=%s', f'{TableOrder.BROKER_ORDER_ID}=%s'))
+        return Statement._prepare(template, values + [broker_id, str(broker_order_id)])
+
+    @staticmethod
+    def prepare_position_insert_or_update(portfolio_id: str, strategy: str, market: str, symbol: str, position: int,
+                                          avg_price: float = None) -> PreparedStatement:
+        if avg_price:
+            template = Statement._insert_template(
+                (TablePosition.PORTFOLIO_ID, TablePosition.STRATEGY, TablePosition.MARKET, TablePosition.SYMBOL,
+                 TablePosition.POSITION, TablePosition.AVG_PRICE), TablePosition.table_name,
+                suffix=(f' on duplicate key update {TablePosition.POSITION}={TablePosition.POSITION}+%s, '
+                        f'{TablePosition.AVG_PRICE}=%s'))
+            params = [portfolio_id, strategy, market, symbol, position, avg_price, position, avg_price]
+        else:
+            template = Statement._insert_template(
+                (TablePosition.PORTFOLIO_ID, TablePosition.STRATEGY, TablePosition.MARKET, TablePosition.SYMBOL,
+                 TablePosition.POSITION), TablePosition.table_name,
+                suffix=f' on duplicate key update {TablePosition.POSITION}={TablePosition.POSITION}+%s')
+            params = [portfolio_id, strategy, market, symbol, 0, position]
+        return Statement._prepare(template, params)
+
+    @staticmethod
+    def prepare_position_update(portfolio_id: str, strategy: str, position: int,
+                                avg_price: float = None) -> PreparedStatement:
+        cols = []
+        values = []
+        Statement._append_value(cols, values, TablePosition.POSITION, position)
+        Statement._append_value(cols, values, TablePosition.AVG_PRICE, avg_price)
+        template = Statement._update_template(TablePosition.table_name, tuple(cols),
+                                              (f'{TablePosition.PORTFOLIO_ID}=%s', f'{TablePosition.STRATEGY}=%s'))
+        return Statement._prepare(template, values + [portfolio_id, strategy])
+
+    @staticmethod
+    def prepare_position_by_entry_insert(portfolio_id: str, strategy: str, market: str, symbol: str, position: int,
+                                         avg_price: float, session_id: str, order_id: int, state: str,
+                                         order_reference: str) -> PreparedStatement:
+        template = Statement._insert_template(
+            (TablePositionByEntry.PORTFOLIO_ID, TablePositionByEntry.STRATEGY, TablePositionByEntry.MARKET,
+             TablePositionByEntry.SYMBOL, TablePositionByEntry.POSITION, TablePositionByEntry.AVG_PRICE,
+             TablePositionByEntry.SESSION_ID, TablePositionByEntry.ORDER_ID, TablePositionByEntry.STATE,
+             TablePositionByEntry.ORDER_REFERENCE), TablePositionByEntry.table_name)
+        return Statement._prepare(template, [portfolio_id, strategy, market, symbol, position, avg_price, session_id,
+                                             order_id, state, order_reference])
+
+    @staticmethod
+    def prepare_operation_insert(portfolio_id: str, strategy: str, action: str, position: int, order_reference: str,
+                                 price: float, identity: str) -> PreparedStatement:
+        template = Statement._insert_template(
+            (TableOperation.PORTFOLIO_ID, TableOperation.STRATEGY, TableOperation.ACTION, TableOperation.POSITION,
+             TableOperation.ORDER_REFERENCE, TableOperation.PRICE, TableOperation.IDENTITY),
+            TableOperation.table_name)
+        return Statement._prepare(template, [portfolio_id, strategy, action, position, order_reference, price,
+                                             identity])
+
+    @staticmethod
+    def prepare_position_by_entry_select_by_position(portfolio_id: str, strategy: str, market: str,
+                                                     symbol: str) -> PreparedStatement:
+        template = (f"select p.{TablePositionByEntry.POSITION},p.{TablePositionByEntry.AVG_PRICE},"
+                    f"p.{TablePositionByEntry.ORDER_REFERENCE},p.{TablePositionByEntry.STATE},"
+                    f"p.{TablePositionByEntry.CREATED},o.{TableOrder.ORDER_ID},o.{TableOrder.TYPE},"
+                    f"o.{TableOrder.IS_BUY},o.{TableOrder.QUANTITY},o.{TableOrder.PRICE},o.{TableOrder.ACTION},"
+                    f"o.{TableOrder.REFERENCE},o.{TableOrder.COMMENT} from "
+                    f"{TablePositionByEntry.table_name} as p inner join {TableOrder.table_name} as o on "
+                    f"p.{TablePositionByEntry.SESSION_ID}=o.{TableOrder.SESSION_ID} and "
+                    f"p.{TablePositionByEntry.ORDER_ID}=o.{TableOrder.ORDER_ID} where "
+                    f"p.{TablePositionByEntry.PORTFOLIO_ID}=%s and p.{TablePositionByEntry.STRATEGY}=%s and "
+                    f"p.{TablePositionByEntry.MARKET}=%s and p.{TablePositionByEntry.SYMBOL}=%s and "
+                    f"p.{TablePositionByEntry.STATE} in "
+                    f"('{TablePositionByEntry.STATE_PENDING}','{TablePositionByEntry.STATE_FULLY_FILLED}') "
+                    f"order by p.{TablePositionByEntry.CREATED} desc")
+        return Statement._prepare(template, [portfolio_id, strategy, market, symbol])
+
+    @staticmethod
+    def prepare_position_select_by_account(account_id: str, strategy: str) -> PreparedStatement:
+        """
+        Positions of a strategy in every portfolio of an account
+        """
+        template = (f"select p.{TablePosition.PORTFOLIO_ID},p.{TablePosition.STRATEGY},p.{TablePosition.MARKET},"
+                    f"p.{TablePosition.SYMBOL},p.{TablePosition.POSITION},p.{TablePosition.AVG_PRICE} from "
+                    f"{TablePosition.table_name} as p inner join {TablePortfolio.table_name} as f on "
+                    f"p.{TablePosition.PORTFOLIO_ID}=f.{TablePortfolio.ID} where "
+                    f"f.{TablePortfolio.ACCOUNT_ID}=%s and p.{TablePosition.STRATEGY}=%s")
+        return Statement._prepare(template, [account_id, strategy])
+
+    @staticmethod
+    def prepare_position_by_entry_select_by_account(account_id: str, strategy: str) -> PreparedStatement:
+        """
+        Same rows as `prepare_position_by_entry_select_by_position` for every position of a strategy in an account,
+        with the position columns added, ordered by creation date in descending order
+        """
+        template = (f"select p.{TablePositionByEntry.PORTFOLIO_ID},p.{TablePositionByEntry.MARKET},"
+                    f"p.{TablePositionByEntry.SYMBOL},p.{TablePositionByEntry.POSITION},"
+                    f"p.{TablePositionByEntry.AVG_PRICE},p.{TablePositionByEntry.ORDER_REFERENCE},"
+                    f"p.{TablePositionByEntry.STATE},p.{TablePositionByEntry.CREATED},o.{TableOrder.ORDER_ID},"
+                    f"o.{TableOrder.TYPE},o.{TableOrder.IS_BUY},o.{TableOrder.QUANTITY},o.{TableOrder.PRICE},"
+                    f"o.{TableOrder.ACTION},o.{TableOrder.REFERENCE},o.{TableOrder.COMMENT} from "
+                    f"{TablePositionByEntry.table_name} as p inner join {TableOrder.table_name} as o on "
+                    f"p.{TablePositionByEntry.SESSION_ID}=o.{TableOrder.SESSION_ID} and "
+                    f"p.{TablePositionByEntry.ORDER_ID}=o.{TableOrder.ORDER_ID} inner join "
+                    f"{TablePortfolio.table_name} as f on p.{TablePositionByEntry.PORTFOLIO_ID}=f.{TablePortfolio.ID} "
+                    f"where f.{TablePortfolio.ACCOUNT_ID}=%s and p.{TablePositionByEntry.STRATEGY}=%s and "
+                    f"p.{TablePositionByEntry.STATE} in "
+                    f"('{TablePositionByEntry.STATE_PENDING}','{TablePositionByEntry.STATE_FULLY_FILLED}') "
+                    f"order by p.{TablePositionByEntry.CREATED} desc")
+        return Statement._prepare(template, [account_id, strategy])
+
+    @staticmethod
+    def prepare_operation_select_by_account(account_id: str, strategy: str) -> PreparedStatement:
+        """
+        Operations of a strategy in every portfolio of an account, in the order they were inserted
+        """
+        template = (f"select o.{TableOperation.PORTFOLIO_ID},o.{TableOperation.ORDER_REFERENCE},"
+                    f"o.{TableOperation.CREATED},o.{TableOperation.ACTION},o.{TableOperation.POSITION},"
+                    f"o.{TableOperation.PRICE},o.{TableOperation.IDENTITY} from {TableOperation.table_name} as o "
+                    f"inner join {TablePortfolio.table_name} as f on "
+                    f"o.{TableOperation.PORTFOLIO_ID}=f.{TablePortfolio.ID} "
+                    f"where f.{TablePortfolio.ACCOUNT_ID}=%s and o.{TableOperation.STRATEGY}=%s "
+                    f"order by o.{TableOperation.ID}")
+        return Statement._prepare(template, [account_id, strategy])
+
+    @staticmethod
+    def prepare_position_by_entry_update(session_id: str = None, order_id: int = None, portfolio_id: str = None,
+                                         strategy: str = None, order_reference: str = None, avg_price: float = None,
+                                         state: str = None, position: int = None) -> PreparedStatement:
+        cols = []
+        values = []
+        Statement._append_value(cols, values, TablePositionByEntry.AVG_PRICE, avg_price)
+        Statement._append_value(cols, values, TablePositionByEntry.STATE, state)
+        Statement._append_value(cols, values, TablePositionByEntry.POSITION, position)
+
+        if session_id is not None:
+            conditions = (f'{TablePositionByEntry.SESSION_ID}=%s', f'{TablePositionByEntry.ORDER_ID}=%s')
+            values += [session_id, order_id]
+        else:
+            conditions = (f'{TablePositionByEntry.PORTFOLIO_ID}=%s', f'{TablePositionByEntry.STRATEGY}=%s',
+                          f'{TablePositionByEntry.ORDER_REFERENCE}=%s')
+            values += [portfolio_id, strategy, order_reference]
+
+        template = Statement._update_template(TablePositionByEntry.table_name, tuple(cols), conditions)
+        return Statement._prepare(template, values)
+
+    @staticmethod
+    def prepare_position_by_entry_delete(session_id: str, order_id: int) -> PreparedStatement:
+        return Statement._prepare(f'delete from {TablePositionByEntry.table_name} where '
+                                  f'{TablePositionByEntry.SESSION_ID}=%s and {TablePositionByEntry.ORDER_ID}=%s',
+                                  [session_id, order_id])
+
+    @staticmethod
+    def prepare_session_insert(session_id: str, ip: str) -> PreparedStatement:
+        template = Statement._insert_template((TableSession.ID, TableSession.NEXT_REQUEST_ID, TableSession.IP),
+                                              TableSession.table_name)
+        return Statement._prepare(template, [session_id, 1, ip])
+
+    @staticmethod
+    def prepare_session_increment_next_request_id(session_id: str, count: int = 1) -> PreparedStatement:
+        return Statement._prepare(f'update {TableSession.table_name} set {TableSession.NEXT_REQUEST_ID} = '
+                                  f'{TableSession.NEXT_REQUEST_ID} + %s where {TableSession.ID}=%s', [count, session_id])
+
+    @staticmethod
+    def prepare_strategy_insert(strategy: str) -> PreparedStatement:
+        template = Statement._insert_template((TableStrategy.ID, TableStrategy.DESCRIPTION), TableStrategy.table_name,
+                                              ignore=True)
+        return Statement._prepare(template, [strategy, ''])
@@ -0,0 +1,462 @@
+import itertools
+import logging
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from enum import Enum
+from threading import RLock
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import ujson
+
+from smartquant.execution.base import Action, OrderState, OrderType
+from .statement import AllTables, TableExecution, TableOrder, TablePosition
+
+OrderKey = Tuple[str, str]
+# row, creation and modification sequence of an order in the order store, None if it is not in the store
+OrderCheckpoint = Optional[Tuple[dict, int, int]]
+# portfolio, strategy and symbol
+CoverageKey = Tuple[str, str, str]
+
+
+class OrderStore:
+    """
+    Authoritative in-memory copy of the `order_` table.
+
+    The store is loaded once at startup and every write to the ledger is applied to it afterwards (write-through), so
+    order lookups never need a round trip to the database. Rows are kept in the same shape as the rows returned by a
+    `select` on `order_`, i.e. the callers cannot tell whether a row comes from the store or from MySQL.
+    """
+    PRICE_SCALE = Decimal('0.00001')
+
+    def __init__(self):
+        self._logger = logging.getLogger(__name__)
+        self._lock = RLock()
+        self._seq = itertools.count()
+
+        self._orders: Dict[OrderKey, dict] = dict()
+        self._created: Dict[OrderKey, int] = dict()
+        self._last_modified: Dict[OrderKey, int] = dict()
+
+        self._by_broker: Dict[str, Set[OrderKey]] = dict()
+        self._by_session_order: Dict[Tuple[str, int], Set[OrderKey]] = dict()
+        self._by_session: Dict[str, Set[OrderKey]] = dict()
+        self._by_portfolio: Dict[str, Set[OrderKey]] = dict()
+        self._by_strategy: Dict[str, Set[OrderKey]] = dict()
+        self._by_type: Dict[str, Set[OrderKey]] = dict()
+        self._active: Set[OrderKey] = set()
+
+    def __len__(self):
+        return len(self._orders)
+
+    @property
+    def lock(self):
+        return self._lock
+
+    def load(self, rows: Iterable[dict]):
+        """
+        Populate the store with rows selected by `Statement.build_stmt_order_select_all`
+
+        :param rows: rows ordered by creation time, each has the extra columns `created` and `last_modified`
+        """
+        with self._lock:
+            rows = list(rows)
+            for row in rows:
+                row = dict(row)
+                row.pop(AllTables.CREATED, None)
+                row.pop(AllTables.LAST_MODIFIED, None)
+                # MySQL returns the enum values as declared, SQLite as written
+                for column in (TableOrder.STATE, TableOrder.QUALIFIER):
+                    if row[column] is not None:
+                        row[column] = row[column].upper()
+                self._add(row)
+
+            # the creation sequence follows the order of the rows, the modification sequence is re-built from the
+            # last modified timestamp of each row
+            for row in sorted(rows, key=lambda r: r[AllTables.LAST_MODIFIED]):
+                self._last_modified[self._key(row[TableOrder.BROKER_ID], row[TableOrder.BROKER_ORDER_ID])] = \
+                    next(self._seq)
+        self._logger.info(f'Loaded {len(self._orders)} order(s), {len(self._active)} active')
+
+    def insert(self, session_id: str, order_id: int, parent_order_id: int, broker_id: str, broker_order_id: str,
+               market: str, symbol: str, order_type: OrderType, is_buy: bool, quantity: int, price: float,
+               qualifier: str, portfolio: str, action: str, strategy: str, reference: str, comment: Dict[str, Any]):
+        row = {
+            TableOrder.SESSION_ID: session_id,
+            TableOrder.ORDER_ID: int(order_id),
+            TableOrder.PARENT_ORDER_ID: int(parent_order_id) if parent_order_id is not None else None,
+            TableOrder.BROKER_ID: broker_id,
+            TableOrder.BROKER_ORDER_ID: str(broker_order_id),
+            TableOrder.MARKET: self._to_str(market),
+            TableOrder.SYMBOL: symbol,
+            TableOrder.TYPE: self._to_str(order_type).upper(),
+            TableOrder.IS_BUY: int(bool(is_buy)),
+            TableOrder.QUANTITY: int(quantity),
+            TableOrder.PRICE: self._to_price(price),
+            TableOrder.STATE: OrderState.NEW.value.upper(),
+            TableOrder.QUALIFIER: self._to_str(qualifier).upper() if qualifier is not None else None,
+            TableOrder.PORTFOLIO: portfolio,
+            TableOrder.ACTION: self._to_str(action).upper() if action is not None else None,
+            TableOrder.STRATEGY: strategy,
+            TableOrder.REFERENCE: reference,
+            TableOrder.COMMENT: ujson.dumps(comment) if comment is not None else None,
+            TableOrder.FILLED_QUANTITY: None,
+            TableOrder.REMAINING_QUANTITY: None,
+        }
+        with self._lock:
+            self._add(row)
+
+    def update(self, broker_id: str, broker_order_id: str, quantity: int = None, price: float = None,
+               remaining_quantity: int = None, filled_quantity: int = None, state: OrderState = None,
+               action: Action = None):
+        key = self._key(broker_id, broker_order_id)
+        with self._lock:
+            row = self._orders.get(key)
+            if row is None:
+                self._logger.warning(f'Order {key} is not found in the order store, nothing to update')
+                return
+
+            if quantity is not None:
+                row[TableOrder.QUANTITY] = int(round(quantity))
+            if price is not None:
+                row[TableOrder.PRICE] = self._to_price(price)
+            if remaining_quantity is not None:
+                row[TableOrder.REMAINING_QUANTITY] = int(round(remaining_quantity))
+            if filled_quantity is not None:
+                row[TableOrder.FILLED_QUANTITY] = int(round(filled_quantity))
+            if action is not None:
+                row[TableOrder.ACTION] = self._to_str(action).upper()
+            if state is not None:
+                row[TableOrder.STATE] = self._to_str(state).upper()
+                if row[TableOrder.STATE] in TableOrder.ACTIVE_STATES:
+                    self._active.add(key)
+                else:
+                    self._active.discard(key)
+            self._last_modified[key] = next(self._seq)
+
+    def checkpoint(self, broker_id: str, broker_order_id: str) -> OrderCheckpoint:
+        key = self._key(broker_id, broker_order_id)
+        with self._lock:
+            row = self._orders.get(key)
+            if row is None:
+                return None
+            return dict(row), self._created[key], self._last_modified[key]
+
+    def rollback(self, broker_id: str, broker_order_id: str, before: OrderCheckpoint, after: OrderCheckpoint) -> bool:
+        """
+        Undo a write which is not committed to the ledger, i.e. put the order back as it was before the write
+
+        :param before: checkpoint of the order taken before the write was applied
+        :param after: checkpoint of the order taken after the write was applied
+        :return: False if the order has been written again since, it is left as it is
+        """
+        key = self._key(broker_id, broker_order_id)
+        with self._lock:
+            current = self._last_modified.get(key)
+            if current != (after[2] if after is not None else None):
+                return False
+            if key in self._orders:
+                self._remove(key)
+            if before is not None:
+                row, created, last_modified = before
+                self._add(dict(row))
+                self._created[key] = created
+                self._last_modified[key] = last_modified
+        return True
+
+    def query(self, broker_id: str = None, session_id: str = None, order_id: int = None,
+              broker_order_id: str = None, symbol: str = None, action: Action = None, portfolio: str = None,
+              strategy: str = None, order_type: OrderType = None, active_orders_only: bool = False,
+              order_by_last_modified=False, order_by_created=False) -> List[dict]:
+        """
+        Same filters and ordering as `Statement.build_stmt_order_select`
+        """
+        with self._lock:
+            if broker_id is not None and broker_order_id is not None:
+                key = self._key(broker_id, broker_order_id)
+                candidates = [{key} if key in self._orders else set()]
+            else:
+                candidates = []
+                if broker_id is not None:
+                    candidates.append(self._by_broker.get(broker_id, set()))
+                if session_id is not None and order_id is not None:
+                    candidates.append(self._by_session_order.get((session_id, int(order_id)), set()))
+                elif session_id is not None:
+                    candidates.append(self._by_session.get(session_id, set()))
+                if portfolio is not None:
+                    candidates.append(self._by_portfolio.get(portfolio, set()))
+                if strategy is not None:
+                    candidates.append(self._by_strategy.get(strategy, set()))
+                if order_type is not None:
+                    candidates.append(self._by_type.get(self._to_str(order_type), set()))
+                if active_orders_only:
+                    candidates.append(self._active)
+
+            if candidates:
+                candidates.sort(key=len)
+                keys = candidates[0].intersection(*candidates[1:])
+            else:
+                keys = self._orders.keys()
+
+            broker_order_id = str(broker_order_id) if broker_order_id is not None else None
+            order_id = int(order_id) if order_id is not None else None
+            action = self._to_str(action).upper() if action is not None else None
+            order_type = self._to_str(order_type) if order_type is not None else None
+
+            result = []
+            for key in keys:
+                row = self._orders[key]
+                if ((broker_id is not None and row[TableOrder.BROKER_ID] != broker_id) or
+                        (session_id is not None and row[TableOrder.SESSION_ID] != session_id) or
+                        (order_id is not None and row[TableOrder.ORDER_ID] != order_id) or
+                        (broker_order_id is not None and row[TableOrder.BROKER_ORDER_ID] != broker_order_id) or
+                        (symbol is not None and row[TableOrder.SYMBOL] != symbol) or
+                        (action is not None and row[TableOrder.ACTION] != action) or
+                        (portfolio is not None and row[TableOrder.PORTFOLIO] != portfolio) or
+                        (strategy is not None and row[TableOrder.STRATEGY] != strategy) or
+                        (order_type is not None and row[TableOrder.TYPE] != order_type) or
+                        (active_orders_only and key not in self._active)):
+                    continue
+                result.append(key)
+
+            if order_by_last_modified:
+                result.sort(key=self._last_modified.__getitem__, reverse=True)
+            else:
+                result.sort(key=self._created.__getitem__)
+            return [dict(self._orders[k]) for k in result]
+
+    def _add(self, row: dict):
+        row[TableOrder.BROKER_ORDER_ID] = str(row[TableOrder.BROKER_ORDER_ID])
+        key = self._key(row[TableOrder.BROKER_ID], row[TableOrder.BROKER_ORDER_ID])
+        if key in self._orders:
+            self._logger.warning(f'Order {key} is in the order store already, replacing it')
+            self._remove(key)
+
+        seq = next(self._seq)
+        self._orders[key] = row
+        self._created[key] = seq
+        self._last_modified[key] = seq
+
+        self._index(self._by_broker, row[TableOrder.BROKER_ID], key)
+        self._index(self._by_session_order, (row[TableOrder.SESSION_ID], row[TableOrder.ORDER_ID]), key)
+        self._index(self._by_session, row[TableOrder.SESSION_ID], key)
+        self._index(self._by_portfolio, row[TableOrder.PORTFOLIO], key)
+        self._index(self._by_strategy, row[TableOrder.STRATEGY], key)
+        self._index(self._by_type, row[TableOrder.TYPE], key)
+        if row[TableOrder.STATE] in TableOrder.ACTIVE_STATES:
+            self._active.add(key)
+
+    def _remove(self, key: OrderKey):
+        row = self._orders.pop(key)
+        self._created.pop(key, None)
+        self._last_modified.pop(key, None)
+        self._unindex(self._by_broker, row[TableOrder.BROKER_ID], key)
+        self._unindex(self._by_session_order, (row[TableOrder.SESSION_ID], row[TableOrder.ORDER_ID]), key)
+        self._unindex(self._by_session, row[TableOrder.SESSION_ID], key)
+        self._unindex(self._by_portfolio, row[TableOrder.PORTFOLIO], key)
+        self._unindex(self._by_strategy, row[TableOrder.STRATEGY], key)
+        self._unindex(self._by_type, row[TableOrder.TYPE], key)
+        self._active.discard(key)
+
+    @staticmethod
+    def _index(index: Dict[Any, Set[OrderKey]], value, key: OrderKey):
+        keys = index.get(value)
+        if keys is None:
+            keys = index[value] = set()
+        keys.add(key)
+
+    @staticmethod
+    def _unindex(index: Dict[Any, Set[OrderKey]], value, key: OrderKey):
+        keys = index.get(value)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del index[value]
+
+    @staticmethod
+    def _key(broker_id: str, broker_order_id) -> OrderKey:
+        return broker_id, str(broker_order_id)
+
+    @staticmethod
+    def _to_price(price) -> Optional[Decimal]:
+        if price is None:
+            return None
+        return Decimal(str(price)).quantize(OrderStore.PRICE_SCALE)
+
+    @staticmethod
+    def _to_str(v) -> str:
+        if isinstance(v, Enum):
+            return str(v.value)
+        return str(v)
+
+
+ExecutionKey = Tuple[str, str]
+
+
+class ExecutionStore:
+    """
+    IDs of the executions in the `execution` table, by broker and broker execution ID, so a replayed execution is
+    recognized without a round trip to the database.
+
+    The IDs are partitioned by day of execution and only the last `retention_days` days are kept, a gateway replays the
+    executions of the current day when it reconnects. Executions older than that are not `covered` by the store.
+    """
+    DEFAULT_RETENTION_DAYS = 3
+
+    def __init__(self, retention_days: int = DEFAULT_RETENTION_DAYS):
+        self._logger = logging.getLogger(__name__)
+        self._lock = RLock()
+        self._retention = timedelta(days=max(int(retention_days), 1))
+        self._days: Dict[date, Set[ExecutionKey]] = dict()
+        self._oldest = date.today() - self._retention + timedelta(days=1)
+
+    def __contains__(self, key: ExecutionKey) -> bool:
+        with self._lock:
+            return any(key in ids for ids in self._days.values())
+
+    def __len__(self):
+        return sum(len(ids) for ids in self._days.values())
+
+    @property
+    def oldest_day(self) -> date:
+        return self._oldest
+
+    def add(self, broker_id: str, broker_execution_id: str, execution_datetime: datetime = None):
+        day = execution_datetime.date() if execution_datetime is not None else date.today()
+        with self._lock:
+            if day < self._oldest:
+                return
+            ids = self._days.get(day)
+            if ids is None:
+                ids = self._days[day] = set()
+                self._expire(day)
+            ids.add((broker_id, str(broker_execution_id)))
+
+    def discard(self, broker_id: str, broker_execution_id: str, execution_datetime: datetime = None):
+        day = execution_datetime.date() if execution_datetime is not None else date.today()
+        with self._lock:
+            ids = self._days.get(day)
+            if ids is not None:
+                ids.discard((broker_id, str(broker_execution_id)))
+
+    def covers(self, execution_datetime: datetime = None) -> bool:
+        """
+        Whether the store holds all executions of the day of the execution, i.e. the day is not expired
+        """
+        return execution_datetime is None or execution_datetime.date() >= self._oldest
+
+    def load(self, rows: Iterable[dict]):
+        """
+        :param rows: rows selected by `Statement.prepare_execution_select_ids`
+        """
+        for row in rows:
+            self.add(row[TableExecution.BROKER_ID], row[TableExecution.BROKER_EXECUTION_ID],
+                     row[TableExecution.EXECUTION_DATETIME])
+        self._logger.info(f'Loaded {len(self)} execution ID(s) since {self._oldest}')
+
+    def _expire(self, newest: date):
+        oldest = newest - self._retention + timedelta(days=1)
+        if oldest <= self._oldest:
+            return
+        self._oldest = oldest
+        for day in [d for d in self._days if d < oldest]:
+            del self._days[day]
+
+
+class StopCoverage:
+    """
+    Net position and quantity covered by the active stop orders, by portfolio, strategy and symbol. A long position is
+    covered by sell stops of the same quantity, a short position by buy stops.
+
+    It is loaded with the order store and updated with every write of a position or an order to the ledger, a position
+    which is not covered is known as soon as the write is applied instead of by querying the ledger periodically.
+    """
+    STOP_TYPE = OrderType.STP.value.upper()
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self._logger = logging.getLogger(__name__)
+        self._lock = RLock()
+        self._clock = clock
+        self._positions: Dict[CoverageKey, int] = dict()
+        self._covered: Dict[CoverageKey, int] = dict()
+        # key and quantity covered of each active stop order
+        self._stops: Dict[OrderKey, Tuple[CoverageKey, int]] = dict()
+        # when the position of a key stopped being covered
+        self._uncovered: Dict[CoverageKey, float] = dict()
+
+    def coverage(self, portfolio: str, strategy: str, symbol: str) -> Tuple[int, int]:
+        """
+        :return: position and quantity covered by the active stop orders
+        """
+        key = (portfolio, strategy, symbol)
+        with self._lock:
+            return self._positions.get(key, 0), self._covered.get(key, 0)
+
+    def load(self, positions: Iterable[dict], stop_orders: Iterable[dict]):
+        """
+        :param positions: rows of the `position` table
+        :param stop_orders: active stop orders of the order store
+        """
+        with self._lock:
+            for row in positions:
+                self.add_position(row[TablePosition.PORTFOLIO_ID], row[TablePosition.STRATEGY],
+                                  row[TablePosition.SYMBOL], row[TablePosition.POSITION])
+            for row in stop_orders:
+                self.update_stop(row)
+        self._logger.info(f'Loaded stop coverage of {len(self._positions)} position(s), '
+                          f'{len(self._uncovered)} not covered')
+
+    def add_position(self, portfolio: str, strategy: str, symbol: str, position: int):
+        key = (portfolio, strategy, symbol)
+        with self._lock:
+            self._positions[key] = self._positions.get(key, 0) + int(position)
+            self._refresh(key)
+
+    def update_stop(self, row: dict):
+        """
+        Apply the current state of an order of the order store, only the active stop orders cover a position
+        """
+        order_key = (row[TableOrder.BROKER_ID], str(row[TableOrder.BROKER_ORDER_ID]))
+        with self._lock:
+            previous = self._stops.pop(order_key, None)
+            if previous is not None:
+                key, covered = previous
+                self._covered[key] -= covered
+                self._refresh(key)
+
+            if row[TableOrder.TYPE] == self.STOP_TYPE and row[TableOrder.STATE] in TableOrder.ACTIVE_STATES:
+                key = (row[TableOrder.PORTFOLIO], row[TableOrder.STRATEGY], row[TableOrder.SYMBOL])
+                remaining = row[TableOrder.REMAINING_QUANTITY]
+                quantity = int(remaining if remaining is not None else row[TableOrder.QUANTITY])
+                covered = -quantity if row[TableOrder.IS_BUY] else quantity
+                self._stops[order_key] = (key, covered)
+                self._covered[key] = self._covered.get(key, 0) + covered
+                self._refresh(key)
+
+    def remove_stop(self, broker_id: str, broker_order_id: str):
+        """
+        Forget an order which is not in the order store any more
+        """
+        with self._lock:
+            previous = self._stops.pop((broker_id, str(broker_order_id)), None)
+            if previous is not None:
+                key, covered = previous
+                self._covered[key] -= covered
+                self._refresh(key)
+
+    def uncovered(self, min_age_in_sec: float = 0) -> List[Tuple[CoverageKey, int, int]]:
+        """
+        :param min_age_in_sec: only the positions not covered for that long, e.g. to skip those whose stop order is
+                               being sent
+        :return: key, position and quantity covered of each position not covered
+        """
+        now = self._clock()
+        with self._lock:
+            return [(k, self._positions.get(k, 0), self._covered.get(k, 0))
+                    for k, since in self._uncovered.items() if now - since >= min_age_in_sec]
+
+    def _refresh(self, key: CoverageKey):
+        if self._positions.get(key, 0) == self._covered.get(key, 0):
+            self._uncovered.pop(key, None)
+        elif key not in self._uncovered:
+            self._uncovered[key] = self._clock()
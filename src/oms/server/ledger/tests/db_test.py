@@ -1,6 +1,6 @@
 from datetime import datetime, timezone
 
-from oms.server.ledger.statement import Statement
+from oms.server.ledger.statement import PreparedStatement, Statement, statement_kind
 from smartquant.execution.base import Action, OrderState
 
 
@@ -147,6 +147,12 @@ class TestStatement:
                         "and action='STOP_LOSS' and state in ('NEW','PENDING','ACTIVE','PARTICALLY_FILLED') order by "
                         "last_modified desc")
 
+    def test_build_stmt_order_select_all(self):
+        stmt = Statement.build_stmt_order_select_all()
+        assert stmt == ("select session_id,order_id,parent_order_id,broker_id,broker_order_id,market,symbol,type,"
+                        "is_buy,quantity,price,state,qualifier,portfolio,action,strategy,reference,comment,"
+                        "filled_quantity,remaining_quantity,created,last_modified from order_  order by created")
+
     def test_build_stmt_order_update(self):
         stmt = Statement.build_stmt_order_update('ibtws_broker', '12345678', filled_quantity=1, remaining_quantity=9)
         assert stmt == ("update order_ set remaining_quantity=9,filled_quantity=1 where broker_id='ibtws_broker' and "
@@ -254,3 +260,82 @@ class TestStatement:
                         "order_ as o on p.session_id=o.session_id and p.order_id=o.order_id where "
                         "p.portfolio_id='portfolio_101' and p.strategy='simple_strategy' and p.market='GLOBEX' and "
                         "p.symbol='NQ' and p.state in ('PENDING','FULLY_FILLED') order by p.created desc")
+
+    def test_build_stmt_position_by_entry_delete(self):
+        stmt = Statement.build_stmt_position_by_entry_delete('client_session_000', 1234567)
+        assert stmt == "delete from position_by_entry where session_id='client_session_000' and order_id=1234567"
+
+
+class TestPreparedStatement:
+    def test_prepare_order_select(self):
+        stmt = Statement.prepare_order_select(broker_id='broker_001', broker_order_id=123456)
+        assert stmt == PreparedStatement(
+            "select session_id,order_id,parent_order_id,broker_id,broker_order_id,market,symbol,type,is_buy,quantity,"
+            "price,state,qualifier,portfolio,action,strategy,reference,comment,filled_quantity,remaining_quantity "
+            "from order_ where broker_id=%s and broker_order_id=%s", ('broker_001', '123456'))
+
+        stmt = Statement.prepare_order_select(session_id='client_session_000', action=Action.ENTRY,
+                                              active_orders_only=True, order_by_last_modified=True)
+        assert stmt.template.endswith("from order_ where session_id=%s and action=%s and "
+                                      "state in ('NEW','PENDING','ACTIVE','PARTICALLY_FILLED') "
+                                      "order by last_modified desc")
+        assert stmt.params == ('client_session_000', Action.ENTRY.value)
+
+    def test_prepare_order_update(self):
+        stmt = Statement.prepare_order_update('broker_001', 123456, remaining_quantity=1, state=OrderState.FULLY_FILLED)
+        assert stmt == PreparedStatement(
+            "update order_ set remaining_quantity=%s,state=%s where broker_id=%s and broker_order_id=%s",
+            (1, OrderState.FULLY_FILLED.value, 'broker_001', '123456'))
+
+    def test_prepare_template_is_shared(self):
+        stmt1 = Statement.prepare_position_select('portfolio_101', 'simple_strategy')
+        stmt2 = Statement.prepare_position_select('portfolio_102', 'other_strategy')
+        assert stmt1.template is stmt2.template
+        assert stmt1.template == ("select portfolio_id,strategy,market,symbol,position,avg_price from position "
+                                  "where portfolio_id=%s and strategy=%s")
+        assert stmt2.params == ('portfolio_102', 'other_strategy')
+
+    def test_prepare_position_insert_or_update(self):
+        stmt = Statement.prepare_position_insert_or_update('portfolio_101', 'simple_strategy', 'GLOBEX', 'NQ', -2,
+                                                           7000.25)
+        assert stmt == PreparedStatement(
+            "insert into position (portfolio_id,strategy,market,symbol,position,avg_price) values (%s,%s,%s,%s,%s,%s) "
+            "on duplicate key update position=position+%s, avg_price=%s",
+            ('portfolio_101', 'simple_strategy', 'GLOBEX', 'NQ', -2, 7000.25, -2, 7000.25))
+
+    def test_prepare_instrument_insert_or_update_many(self):
+        stmt = Statement.prepare_instrument_insert_or_update_many([('NYMEX', 'CL', 'CLX9', datetime(2019, 11, 22)),
+                                                                   ('GLOBEX', 'NQ', 'NQZ9', datetime(2019, 12, 20))])
+        assert stmt == PreparedStatement(
+            "insert into instrument (market,symbol,code,expiry) values (%s,%s,%s,%s),(%s,%s,%s,%s) "
+            "on duplicate key update code=values(code), expiry=values(expiry)",
+            ('NYMEX', 'CL', 'CLX9', datetime(2019, 11, 22), 'GLOBEX', 'NQ', 'NQZ9', datetime(2019, 12, 20)))
+
+    def test_prepare_execution_select_by_broker_id_and_date(self):
+        stmt = Statement.prepare_execution_select_by_broker_id_and_date(
+            'broker_001', execution_datetime=datetime(2011, 11, 2, 23, 50, 13, tzinfo=timezone.utc))
+        assert stmt.template.endswith("from execution where broker_id=%s and execution_datetime>=%s")
+        assert stmt.params == ('broker_001', datetime(2011, 11, 2, 23, 50, 13))
+
+    def test_prepare_position_select_by_account(self):
+        stmt = Statement.prepare_position_select_by_account('simple_account', 'simple_strategy')
+        assert stmt == PreparedStatement(
+            "select p.portfolio_id,p.strategy,p.market,p.symbol,p.position,p.avg_price from position as p "
+            "inner join portfolio as f on p.portfolio_id=f.id where f.account_id=%s and p.strategy=%s",
+            ('simple_account', 'simple_strategy'))
+
+    def test_prepare_operation_select_by_account(self):
+        stmt = Statement.prepare_operation_select_by_account('simple_account', 'simple_strategy')
+        assert stmt == PreparedStatement(
+            "select o.portfolio_id,o.order_reference,o.created,o.action,o.position,o.price,o.identity "
+            "from operation as o inner join portfolio as f on o.portfolio_id=f.id where f.account_id=%s and "
+            "o.strategy=%s order by o.id", ('simple_account', 'simple_strategy'))
+
+
+class TestStatementKind:
+    def test_statement_kind(self):
+        assert statement_kind('select a,b from order_ where id=%s') == 'SELECT order_'
+        assert statement_kind('insert ignore into strategy (id) values (%s)') == 'INSERT strategy'
+        assert statement_kind('update order_ set state=%s where id=%s') == 'UPDATE order_'
+        assert statement_kind('delete from position_by_entry where order_id=%s') == 'DELETE position_by_entry'
+        assert statement_kind(Statement.prepare_order_select(broker_id='b').template) == 'SELECT order_'
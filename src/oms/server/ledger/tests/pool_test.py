@@ -0,0 +1,67 @@
+import mysql.connector
+import pytest
+
+from oms.server.ledger.pool import ConnectionPool
+from oms.server.ledger.statement import PreparedStatement
+
+
+class Cursor:
+    def __init__(self, cnx):
+        self._cnx = cnx
+        self._session = cnx.session
+
+    def execute(self, operation, params=()):
+        # the statements prepared on a lost connection are gone
+        if not self._cnx.is_connected or self._session != self._cnx.session:
+            raise mysql.connector.errors.OperationalError('MySQL Connection not available')
+        self._cnx.executed.append((operation, params))
+
+    def close(self):
+        pass
+
+
+class Connection:
+    """
+    Connection which is lost when the server restarts, until it is reconnected by a ping
+    """
+    def __init__(self, **kwargs):
+        self.is_connected = True
+        self.session = 0
+        self.executed = []
+
+    def cursor(self, prepared=False):
+        return Cursor(self)
+
+    def ping(self, reconnect=False, attempts=1, delay=0):
+        if not self.is_connected and reconnect:
+            self.is_connected = True
+            self.session += 1
+
+    def restart_server(self):
+        self.is_connected = False
+
+    def close(self):
+        pass
+
+
+def execute(pool, cnx, stmt):
+    with pool.cursor(cnx, stmt) as cursor:
+        pool.execute(cursor, stmt)
+
+
+class TestConnectionPool:
+    def test_retry(self):
+        pool = ConnectionPool(dict(), 1, connect=Connection)
+        stmt = PreparedStatement('update session set next_request_id=%s', (2,))
+        with pool.connection() as cnx:
+            execute(pool, cnx, stmt)
+            cnx.restart_server()
+            # the connection is reconnected and the statement prepared again
+            pool.retry(cnx, lambda: execute(pool, cnx, stmt))
+            assert cnx.executed == [(stmt.template, stmt.params)] * 2
+            assert cnx.session == 1
+
+            cnx.restart_server()
+            with pytest.raises(mysql.connector.errors.OperationalError):
+                execute(pool, cnx, stmt)
+        pool.close()
@@ -0,0 +1,201 @@
+from concurrent.futures import Future
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+
+import pytest
+
+from oms.server.ledger.factory import LedgerFactory
+from oms.server.ledger.sqlite import DbSqlite
+from oms.server.ledger.statement import TableOrder, TablePosition
+from smartquant.execution.base import Action, OrderState, OrderType
+
+SAMPLES = str(Path(DbSqlite.DEFAULT_SCHEMA).with_name('setup.samples.sqlite.sql'))
+
+
+def create_ledger(database: str = ':memory:'):
+    return LedgerFactory.create_ledger({'ledger': {'sqlite': {'database': database, 'scripts': [SAMPLES]}}})
+
+
+def insert_order(ledger, broker_order_id: str, order_id: int = 1):
+    ledger.insert_order('session_001', order_id, order_id, 'broker_001', broker_order_id, 'GLOBEX', 'NQ',
+                        OrderType.LMT, True, 2, 7000.25, 'WRCP001', Action.ENTRY.value, 'OMS', 'ref_001',
+                        {'stop_loss_offset': -10})
+
+
+class PendingWriter:
+    """
+    Write-behind writer which leaves the statements to the test to commit or fail
+    """
+    def __init__(self):
+        self.futures = []
+
+    def submit(self, stmts):
+        future = Future()
+        self.futures.append(future)
+        return future
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def ledger():
+    ledger = create_ledger()
+    yield ledger
+    ledger.close()
+
+
+class TestDbSqlite:
+    def test_account(self, ledger):
+        assert ledger.query_account('WRCA001') == ('WRCA001', Decimal('10000000.00000'), 'USD')
+        assert ledger.verify_account_portfolio_strategy('WRCA001', 'WRCP001', 'OMS')
+        assert not ledger.verify_account_portfolio_strategy('WRCA001', 'WRCP001', 'strategy_001')
+
+        ledger.insert_strategy('strategy_001')
+        ledger.insert_strategy('strategy_001')
+        assert ledger.verify_account_portfolio_strategy('WRCA001', 'WRCP001', 'strategy_001')
+
+    def test_session(self, ledger):
+        assert ledger.query_session('session_001') == (None, None, None)
+        ledger.insert_session('session_001').result()
+        ledger.increment_next_request_id('session_001')
+        assert ledger.query_session('session_001') == ('session_001', 2, 'dummy')
+
+    def test_order_log(self, ledger):
+        insert_order(ledger, '1001')
+        ledger.update_order('broker_001', '1001', remaining_quantity=0, filled_quantity=2,
+                            state=OrderState.FULLY_FILLED)
+
+        orders = ledger.query_order(broker_order_id='1001')
+        assert len(orders) == 1
+        assert orders[0][TableOrder.STATE] == OrderState.FULLY_FILLED.value
+
+        logs = ledger._exec_query('select table_action, state, price from order_log order by pk')
+        assert [(r['table_action'], r['state'].upper()) for r in logs] == [('INSERT', 'NEW'),
+                                                                            ('UPDATE', 'FULLY_FILLED')]
+        assert logs[0]['price'] == Decimal('7000.25000')
+
+    def test_position_upsert(self, ledger):
+        ledger.update_position('WRCP001', 'OMS', 'GLOBEX', 'NQ', 2, 7000.5)
+        ledger.update_position('WRCP001', 'OMS', 'GLOBEX', 'NQ', -1)
+
+        positions = ledger.query_position(portfolio_id='WRCP001', strategy='OMS')
+        assert len(positions) == 1
+        assert positions[0][TablePosition.POSITION] == 1
+        assert positions[0][TablePosition.AVG_PRICE] == Decimal('7000.50000')
+        assert ledger.query_total_position('NQ')[0][TablePosition.POSITION] == 1
+        assert [r['table_action'] for r in ledger._exec_query('select table_action from position_log')] == \
+            ['INSERT', 'UPDATE']
+
+    def test_instrument_upsert(self, ledger):
+        ledger.update_instrument('GLOBEX', 'NQ', 'NQH1', datetime(2021, 3, 19))
+        ledger.update_instrument('GLOBEX', 'NQ', 'NQM1', datetime(2021, 6, 18))
+
+        instruments = ledger.query_instruments()
+        assert len(instruments) == 1
+        assert instruments[0]['code'] == 'NQM1'
+        assert instruments[0]['expiry'] == date(2021, 6, 18)
+
+    def test_instrument_upsert_many(self, ledger):
+        ledger.update_instrument('GLOBEX', 'NQ', 'NQH1', datetime(2021, 3, 19))
+        ledger.INSTRUMENT_BATCH_SIZE = 2
+        ledger.update_instruments([('GLOBEX', 'NQ', 'NQM1', datetime(2021, 6, 18)),
+                                   ('GLOBEX', 'ES', 'ESM1', datetime(2021, 6, 18)),
+                                   ('NYMEX', 'CL', 'CLN1', datetime(2021, 6, 22))]).result()
+        assert ledger.update_instruments([]).result() is None
+
+        instruments = {i['symbol']: i['code'] for i in ledger.query_instruments()}
+        assert instruments == {'NQ': 'NQM1', 'ES': 'ESM1', 'CL': 'CLN1'}
+
+    def test_stop_coverage(self, ledger):
+        ledger.update_position('WRCP001', 'OMS', 'GLOBEX', 'NQ', 2, 7000.25)
+        ledger.insert_order('session_001', 0, 1, 'broker_001', '1002', 'GLOBEX', 'NQ', OrderType.STP, False, 2,
+                            6990.25, 'WRCP001', Action.STOP_LOSS.value, 'OMS', None, None)
+        assert ledger.stop_coverage.coverage('WRCP001', 'OMS', 'NQ') == (2, 2)
+
+        with ledger.transaction():
+            ledger.update_order('broker_001', '1002', state=OrderState.CANCELLED)
+            assert ledger.stop_coverage.coverage('WRCP001', 'OMS', 'NQ') == (2, 2)
+        assert ledger.stop_coverage.uncovered() == [(('WRCP001', 'OMS', 'NQ'), 2, 0)]
+
+    def test_stop_coverage_load(self, tmp_path):
+        database = str(tmp_path / 'ledger.db')
+        ledger = create_ledger(database)
+        ledger.update_position('WRCP001', 'OMS', 'GLOBEX', 'NQ', -1, 7000.25)
+        ledger.insert_order('session_001', 0, 1, 'broker_001', '1002', 'GLOBEX', 'NQ', OrderType.STP, True, 1,
+                            7010.25, 'WRCP001', Action.STOP_LOSS.value, 'OMS', None, None)
+        ledger.update_position('WRCP001', 'other_strategy', 'GLOBEX', 'ES', 1, 4000.25)
+        ledger.close()
+
+        ledger = create_ledger(database)
+        assert ledger.stop_coverage.coverage('WRCP001', 'OMS', 'NQ') == (-1, -1)
+        assert ledger.stop_coverage.uncovered() == [(('WRCP001', 'other_strategy', 'ES'), 1, 0)]
+        ledger.close()
+
+    def test_position_by_entry(self, ledger):
+        insert_order(ledger, '1001')
+        ledger.insert_position_by_entry('WRCP001', 'OMS', 'GLOBEX', 'NQ', 2, 'session_001', 1, 'ref_001')
+        ledger.update_position_by_entry('session_001', 1, avg_price=7000.5, state='FULLY_FILLED')
+
+        entries = ledger.query_position_by_entry_by_account('WRCA001', 'OMS')
+        assert len(entries) == 1
+        assert entries[0][TableOrder.ORDER_ID] == 1
+        assert isinstance(entries[0]['created'], datetime)
+
+    def test_transaction_rollback(self, ledger):
+        with pytest.raises(RuntimeError):
+            with ledger.transaction():
+                insert_order(ledger, '1001')
+                raise RuntimeError('rollback')
+
+        assert ledger.query_order(broker_order_id='1001') == []
+        assert ledger._exec_query('select * from order_') == []
+
+    def test_write_behind_failure(self, ledger):
+        ledger._writer = writer = PendingWriter()
+        insert_order(ledger, '1001')
+        with ledger.transaction():
+            insert_order(ledger, '1002', 2)
+            ledger.update_order('broker_001', '1002', state=OrderState.ACTIVE)
+            ledger.update_position('WRCP001', 'OMS', 'GLOBEX', 'NQ', 2, 7000.25)
+        ledger.update_order('broker_001', '1001', state=OrderState.CANCELLED)
+        # the writes are applied to the order store once handed over
+        assert len(ledger.query_order(broker_id='broker_001')) == 2
+
+        writer.futures[0].set_result(None)
+        writer.futures[1].set_exception(RuntimeError('connection lost'))
+        writer.futures[2].set_exception(RuntimeError('connection lost'))
+        orders = ledger.query_order(broker_id='broker_001')
+        assert [(o[TableOrder.BROKER_ORDER_ID], o[TableOrder.STATE]) for o in orders] == [('1001', 'NEW')]
+        assert ledger.stop_coverage.coverage('WRCP001', 'OMS', 'NQ') == (0, 0)
+
+    def test_reopen_file(self, tmp_path):
+        database = str(tmp_path / 'oms.db')
+        ledger = create_ledger(database)
+        insert_order(ledger, '1001')
+        ledger.close()
+
+        ledger = create_ledger(database)
+        assert len(ledger.query_order(broker_order_id='1001')) == 1
+        # the schema and the scripts only run on a new database
+        assert len(ledger._exec_query('select * from account')) == 1
+        ledger.close()
+
+    def test_has_execution(self, tmp_path):
+        database = str(tmp_path / 'oms.db')
+        ledger = create_ledger(database)
+        now = datetime.now()
+        ledger.insert_execution('broker_001', '1001', 'e1', '1', True, 'NQH1', 1, 7000.25, 0, 1.5, 'USD', now)
+        assert ledger.has_execution('broker_001', 'e1', now)
+        assert not ledger.has_execution('broker_001', 'e2', now)
+        ledger.close()
+
+        # loaded at startup, older executions are queried
+        ledger = create_ledger(database)
+        assert ledger.has_execution('broker_001', 'e1')
+        ledger.insert_execution('broker_001', '1002', 'e0', '2', True, 'NQH1', 1, 7000.25, 0, 1.5, 'USD',
+                                now - timedelta(days=30))
+        assert ledger.has_execution('broker_001', 'e0', now - timedelta(days=30))
+        assert not ledger.has_execution('broker_001', 'e3', now - timedelta(days=30))
+        ledger.close()
@@ -0,0 +1,177 @@
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+
+from oms.server.ledger.statement import TableExecution, TableOrder, TablePosition
+from oms.server.ledger.store import ExecutionStore, OrderStore, StopCoverage
+from smartquant.execution.base import Action, OrderState, OrderType
+
+
+def _row(broker_order_id: str, order_id: int, order_type: str, action: str, state: str, created: datetime,
+         last_modified: datetime, strategy: str = 'simple_strategy'):
+    return {
+        TableOrder.SESSION_ID: 'client_session_000', TableOrder.ORDER_ID: order_id,
+        TableOrder.PARENT_ORDER_ID: order_id, TableOrder.BROKER_ID: 'ibtws',
+        TableOrder.BROKER_ORDER_ID: broker_order_id, TableOrder.MARKET: 'GLOBEX', TableOrder.SYMBOL: 'NQ',
+        TableOrder.TYPE: order_type, TableOrder.IS_BUY: 1, TableOrder.QUANTITY: 1,
+        TableOrder.PRICE: Decimal('7000.00000'), TableOrder.STATE: state, TableOrder.QUALIFIER: 'NONE',
+        TableOrder.PORTFOLIO: 'portfolio_1', TableOrder.ACTION: action, TableOrder.STRATEGY: strategy,
+        TableOrder.REFERENCE: None, TableOrder.COMMENT: None, TableOrder.FILLED_QUANTITY: None,
+        TableOrder.REMAINING_QUANTITY: None, 'created': created, 'last_modified': last_modified
+    }
+
+
+class TestOrderStore:
+    def _store(self):
+        store = OrderStore()
+        store.load([
+            _row('100', 1, 'LMT', 'ENTRY', 'FULLY_FILLED', datetime(2020, 1, 1, 9), datetime(2020, 1, 1, 12)),
+            _row('101', 0, 'STP', 'STOP_LOSS', 'ACTIVE', datetime(2020, 1, 1, 10), datetime(2020, 1, 1, 10)),
+            _row('102', 2, 'LMT', 'ENTRY', 'ACTIVE', datetime(2020, 1, 1, 11), datetime(2020, 1, 1, 11)),
+        ])
+        return store
+
+    def test_query(self):
+        store = self._store()
+        assert len(store) == 3
+
+        orders = store.query('ibtws', broker_order_id=100)
+        assert len(orders) == 1
+        assert orders[0][TableOrder.ORDER_ID] == 1
+        assert 'created' not in orders[0]
+
+        orders = store.query('ibtws', order_type=OrderType.LMT, action=Action.ENTRY, active_orders_only=True)
+        assert [o[TableOrder.BROKER_ORDER_ID] for o in orders] == ['102']
+
+        orders = store.query(session_id='client_session_000', order_id=0)
+        assert [o[TableOrder.BROKER_ORDER_ID] for o in orders] == ['101']
+
+        orders = store.query(strategy='simple_strategy', order_by_created=True)
+        assert [o[TableOrder.BROKER_ORDER_ID] for o in orders] == ['100', '101', '102']
+
+        orders = store.query(strategy='simple_strategy', order_by_last_modified=True)
+        assert [o[TableOrder.BROKER_ORDER_ID] for o in orders] == ['100', '102', '101']
+
+        assert store.query(strategy='unknown_strategy') == []
+
+    def test_insert_and_update(self):
+        store = self._store()
+        store.insert('client_session_000', 3, 2, 'ibtws', 103, 'GLOBEX', 'NQ', OrderType.STP, False, 1, 6990.25,
+                     'none', 'portfolio_1', Action.STOP_LOSS.value, 'simple_strategy', None, {'order_reference': 'a'})
+
+        order = store.query('ibtws', broker_order_id='103')[0]
+        assert order[TableOrder.BROKER_ORDER_ID] == '103'
+        assert order[TableOrder.TYPE] == 'STP'
+        assert order[TableOrder.IS_BUY] == 0
+        assert order[TableOrder.PRICE] == Decimal('6990.25000')
+        assert order[TableOrder.STATE] == 'NEW'
+        assert order[TableOrder.QUALIFIER] == 'NONE'
+        assert order[TableOrder.COMMENT] == '{"order_reference":"a"}'
+        assert len(store.query(order_type=OrderType.STP, active_orders_only=True)) == 2
+
+        store.update('ibtws', '103', remaining_quantity=0, filled_quantity=1, state=OrderState.FULLY_FILLED)
+        order = store.query('ibtws', broker_order_id='103')[0]
+        assert order[TableOrder.FILLED_QUANTITY] == 1
+        assert order[TableOrder.STATE] == 'FULLY_FILLED'
+        assert len(store.query(order_type=OrderType.STP, active_orders_only=True)) == 1
+
+        orders = store.query(strategy='simple_strategy', order_by_last_modified=True)
+        assert orders[0][TableOrder.BROKER_ORDER_ID] == '103'
+
+    def test_rollback(self):
+        store = self._store()
+        before = store.checkpoint('ibtws', '102')
+        store.update('ibtws', '102', state=OrderState.CANCELLED)
+        after = store.checkpoint('ibtws', '102')
+        assert store.rollback('ibtws', '102', before, after)
+        assert store.query('ibtws', broker_order_id='102')[0][TableOrder.STATE] == 'ACTIVE'
+        assert [o[TableOrder.BROKER_ORDER_ID] for o in store.query(active_orders_only=True)] == ['101', '102']
+
+        store.insert('client_session_000', 3, 3, 'ibtws', 103, 'GLOBEX', 'NQ', OrderType.LMT, True, 1, 7000,
+                     'none', 'portfolio_1', Action.ENTRY.value, 'simple_strategy', None, None)
+        after = store.checkpoint('ibtws', '103')
+        store.update('ibtws', '103', state=OrderState.ACTIVE)
+        # written again since, it is left as it is
+        assert not store.rollback('ibtws', '103', None, after)
+        assert store.rollback('ibtws', '103', None, store.checkpoint('ibtws', '103'))
+        assert store.query('ibtws', broker_order_id='103') == []
+        assert len(store) == 3
+
+
+class TestExecutionStore:
+    def test_load_and_add(self):
+        now = datetime.now()
+        store = ExecutionStore(retention_days=2)
+        store.load([{TableExecution.BROKER_ID: 'ibtws', TableExecution.BROKER_EXECUTION_ID: 'e1',
+                     TableExecution.EXECUTION_DATETIME: now},
+                    {TableExecution.BROKER_ID: 'ibtws', TableExecution.BROKER_EXECUTION_ID: 'e0',
+                     TableExecution.EXECUTION_DATETIME: now - timedelta(days=5)}])
+        assert ('ibtws', 'e1') in store
+        assert ('ibtws', 'e0') not in store
+        assert ('other', 'e1') not in store
+        assert len(store) == 1
+
+        store.add('ibtws', 'e2', now.replace(tzinfo=timezone.utc))
+        store.add('ibtws', 3)
+        assert ('ibtws', 'e2') in store
+        assert ('ibtws', '3') in store
+
+        assert store.covers(now - timedelta(days=1))
+        assert not store.covers(now - timedelta(days=2))
+        assert store.covers(None)
+
+    def test_expire(self):
+        today = date.today()
+        store = ExecutionStore(retention_days=2)
+        store.add('ibtws', 'e1', datetime.combine(today, datetime.min.time()))
+        tomorrow = datetime.combine(today + timedelta(days=1), datetime.min.time())
+        store.add('ibtws', 'e2', tomorrow)
+        assert ('ibtws', 'e1') in store
+        store.add('ibtws', 'e3', tomorrow + timedelta(days=1))
+        assert ('ibtws', 'e1') not in store
+        assert ('ibtws', 'e2') in store
+        assert store.oldest_day == today + timedelta(days=1)
+
+
+class TestStopCoverage:
+    def _stop(self, broker_order_id: str, state: str = 'ACTIVE', is_buy: int = 0, quantity: int = 2,
+              remaining: int = None):
+        row = _row(broker_order_id, 0, 'STP', 'STOP_LOSS', state, datetime(2020, 1, 1), datetime(2020, 1, 1))
+        row.update({TableOrder.IS_BUY: is_buy, TableOrder.QUANTITY: quantity, TableOrder.REMAINING_QUANTITY: remaining})
+        return row
+
+    def test_load(self):
+        coverage = StopCoverage()
+        coverage.load([{TablePosition.PORTFOLIO_ID: 'portfolio_1', TablePosition.STRATEGY: 'simple_strategy',
+                        TablePosition.SYMBOL: 'NQ', TablePosition.POSITION: 2}], [self._stop('101')])
+        assert coverage.coverage('portfolio_1', 'simple_strategy', 'NQ') == (2, 2)
+        assert coverage.uncovered() == []
+
+    def test_update(self):
+        clock = [0.0]
+        coverage = StopCoverage(lambda: clock[0])
+        key = ('portfolio_1', 'simple_strategy', 'NQ')
+
+        # entry filled, the stop order follows
+        coverage.add_position(*key, 2)
+        assert coverage.uncovered() == [(key, 2, 0)]
+        clock[0] = 1.0
+        assert coverage.uncovered(min_age_in_sec=5) == []
+        coverage.update_stop(self._stop('101'))
+        assert coverage.uncovered() == []
+
+        # partially filled stop
+        coverage.add_position(*key, -1)
+        coverage.update_stop(self._stop('101', state='PARTICALLY_FILLED', remaining=1))
+        assert coverage.coverage(*key) == (1, 1)
+
+        # stop cancelled
+        coverage.update_stop(self._stop('101', state='CANCELLED', remaining=1))
+        clock[0] = 10.0
+        assert coverage.uncovered(min_age_in_sec=5) == [(key, 1, 0)]
+
+        # a short position is covered by buy stops, other orders are ignored
+        coverage.add_position(*key, -2)
+        coverage.update_stop(self._stop('102', is_buy=1, quantity=1))
+        coverage.update_stop(_row('103', 1, 'LMT', 'ENTRY', 'ACTIVE', datetime(2020, 1, 1), datetime(2020, 1, 1)))
+        assert coverage.coverage(*key) == (-1, -1)
+        assert coverage.uncovered() == []
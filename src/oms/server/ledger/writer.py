@@ -0,0 +1,176 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from queue import Empty, Queue
+from typing import Any, Dict, List, NamedTuple, Union
+
+import mysql.connector
+
+from oms.common.log import RateLimitedLog
+from .pool import ConnectionPool
+from .statement import PreparedStatement, statement_kind, statement_sql
+
+Stmt = Union[str, PreparedStatement]
+
+
+class _Unit(NamedTuple):
+    stmts: List[Stmt]
+    future: Future
+
+
+class WriterStopped(Exception):
+    pass
+
+
+class LedgerWriter:
+    """
+    Write-behind queue for ledger statements.
+
+    A dedicated thread drains the queue and commits the statements in batches, a batch is closed when it has
+    `batch_size` statements or when `window_in_ms` has passed since its first statement was taken. Statements are
+    committed in the order they are submitted. Each call to `submit` returns a future which is resolved once the
+    statements are committed, or set to the exception raised by MySQL. Once the writer stops, the statements which
+    are not committed yet fail with `WriterStopped`.
+    """
+    DEFAULT_BATCH_SIZE = 100
+    DEFAULT_WINDOW_IN_MS = 2
+    # statements logged per second for each kind of statement
+    SQL_LOG_RATE = 10
+
+    def __init__(self, cfg: Dict[str, Any], batch_size: int = DEFAULT_BATCH_SIZE,
+                 window_in_ms: float = DEFAULT_WINDOW_IN_MS):
+        self._logger = logging.getLogger(__name__)
+        self._sql_log = RateLimitedLog(self._logger, rate=self.SQL_LOG_RATE)
+        self._pool = ConnectionPool(cfg, 1)
+        self._batch_size = batch_size
+        self._window = window_in_ms / 1000
+        self._queue = Queue()
+        self._lock = threading.Lock()
+        self._is_stopped = False
+        # batch being committed
+        self._batch: List[_Unit] = []
+        self._thread = threading.Thread(target=self._run, name='LedgerWriter', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        self._pool.close()
+
+    def flush(self) -> Future:
+        """
+        :return: a future resolved when every statement submitted before this call is committed
+        """
+        return self.submit([])
+
+    def submit(self, stmts: List[Stmt]) -> Future:
+        """
+        Queue statements to be committed atomically, i.e. in the same transaction
+        """
+        future = Future()
+        with self._lock:
+            if self._is_stopped:
+                future.set_exception(WriterStopped('The ledger writer is stopped'))
+                return future
+            self._queue.put(_Unit(stmts, future))
+        return future
+
+    def _run(self):
+        error = WriterStopped('The ledger writer is stopped')
+        try:
+            self._drain()
+        except BaseException as e:
+            self._logger.exception('Ledger writer failed')
+            error = WriterStopped(f'The ledger writer failed: {e!r}')
+            raise
+        finally:
+            with self._lock:
+                self._is_stopped = True
+            # nothing is queued any more, fail what is left so that nobody waits for it
+            pending = list(self._batch)
+            while True:
+                try:
+                    pending.append(self._queue.get_nowait())
+                except Empty:
+                    break
+            n_failed = 0
+            for unit in pending:
+                if unit is not None and not unit.future.done():
+                    unit.future.set_exception(error)
+                    n_failed += 1
+            if n_failed:
+                self._logger.error(f'{n_failed} request(s) are not committed, the ledger writer is stopped')
+
+    def _drain(self):
+        running = True
+        while running:
+            unit = self._queue.get()
+            if unit is None:
+                break
+
+            batch = [unit]
+            n_stmts = len(unit.stmts)
+            deadline = time.monotonic() + self._window
+            while n_stmts < self._batch_size:
+                try:
+                    timeout = deadline - time.monotonic()
+                    unit = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except Empty:
+                    break
+                if unit is None:
+                    running = False
+                    break
+                batch.append(unit)
+                n_stmts += len(unit.stmts)
+
+            self._batch = batch
+            try:
+                self._commit(batch, n_stmts)
+            except Exception as e:
+                # e.g. the connection is lost, the writer goes on with the next batch
+                self._logger.exception(f'Failed to commit a batch of {n_stmts} statement(s)')
+                for unit in batch:
+                    if not unit.future.done():
+                        unit.future.set_exception(e)
+        self._logger.info('Ledger writer stops')
+
+    def _commit(self, batch: List[_Unit], n_stmts: int):
+        with self._pool.connection() as cnx:
+            try:
+                stmts = [stmt for unit in batch for stmt in unit.stmts]
+                self._pool.retry(cnx, lambda: self._execute(cnx, stmts))
+                self._logger.debug(f'Committed {n_stmts} statement(s) of {len(batch)} request(s)')
+                for unit in batch:
+                    unit.future.set_result(None)
+                return
+            except ConnectionPool.CONNECTION_ERRORS:
+                # the connection is lost again once reconnected, the server is not reachable
+                raise
+            except mysql.connector.Error as e:
+                self._logger.warning(f'Batch of {n_stmts} statement(s) failed, commit one request at a time: {e}')
+
+            # isolate the failed request(s), so that the others are still committed
+            for unit in batch:
+                try:
+                    self._pool.retry(cnx, lambda: self._execute(cnx, unit.stmts))
+                    unit.future.set_result(None)
+                except ConnectionPool.CONNECTION_ERRORS:
+                    raise
+                except mysql.connector.Error as e:
+                    self._logger.exception(f'MySQL exception when executing: {unit.stmts}')
+                    unit.future.set_exception(e)
+
+    def _execute(self, cnx, stmts: List[Stmt]):
+        if not stmts:
+            return
+        try:
+            cnx.start_transaction()
+            for stmt in stmts:
+                self._sql_log.log(statement_kind(statement_sql(stmt)), 'Execute: %s', stmt)
+                with self._pool.cursor(cnx, stmt) as cursor:
+                    self._pool.execute(cursor, stmt)
+            cnx.commit()
+        except mysql.connector.Error:
+            self._pool.rollback(cnx)
+            raise
@@ -2,21 +2,23 @@ import asyncio
 import concurrent.futures
 import logging
 import math
+import signal
 import time
 from asyncio import AbstractEventLoop
 from collections import deque, OrderedDict
 from datetime import datetime, timedelta
 from decimal import Decimal
-from threading import Lock
-from typing import Dict, List, Set, Tuple
+from threading import Lock, RLock
+from typing import Callable, Dict, List, Optional, Set, Tuple
 
 import ujson
 import zmq
-from zmq.asyncio import Context, Poller
+from zmq.asyncio import Context
 
 import gateway_lib as gl
-from oms.common.config import (CFG_BROKER, CFG_BROKERS, CFG_CONNECTION, CFG_MESSAGING, CFG_NAME, CFG_NUM_OF_WORKERS,
-                               CFG_OMS)
+from oms.common.config import (CFG_BROKER, CFG_BROKERS, CFG_CONNECTION, CFG_LEAST_OUTSTANDING, CFG_MESSAGING, CFG_NAME,
+                               CFG_NUM_OF_WORKERS, CFG_OMS, CFG_ROUTING)
+from oms.common.latency import LATENCY, now
 from oms.common.message import ErrorCode, MsgType, OmsMessage, OmsMessageError
 from smartquant.common.config import CFG_LONG, CFG_SHORT
 from smartquant.common.instrument import Instrument, InstrumentRepository
@@ -26,14 +28,30 @@ from smartquant.common.price import Price
 from smartquant.execution.base import Action, OrderType, OrderState
 from smartquant.strategy.base import DirtectionFactory
 from .broker import Broker, BrokerFactory
+from .broker.router import BrokerRouter
+from .broker.simulated import OrderError as SimulatedOrderError
+from .contracts import ContractTable
+from .executor import ShardedExecutor
 from .ledger.factory import LedgerFactory
 from .ledger.statement import TableInstrument, TableOrder, TablePortfolio, TablePosition, TablePositionByEntry
+from .ledger.store import CoverageKey
+from .order import OrderRequest
+from .reconcile import diff_open_orders
+from .roll import RollState, RollTracker, SymbolRoll
 from .session import ClientSession
 
 
 class Oms:
     STRATEGY_NAME = 'OMS'
     PING_INTERVAL = timedelta(seconds=5)
+    HOUSEKEEPING_INTERVAL_IN_SEC = 1
+    LATENCY_LOG_INTERVAL_IN_SEC = 60
+    ROLL_BROKER_TIMEOUT = timedelta(seconds=30)
+    ROLL_FILL_TIMEOUT = timedelta(minutes=5)
+    ROLL_PROGRESS_INTERVAL_IN_SEC = 10
+    # a position is reported as not covered by stop orders once it is not covered for that long, e.g. the stop order
+    # of an entry order is sent after the execution
+    STOP_COVERAGE_GRACE_IN_SEC = 5
 
     FROM_GW_ORDER_TYPE: Dict[gl.OrderType, OrderType] = {
         gl.OrderType.MKT: OrderType.MKT,
@@ -69,6 +87,10 @@ class Oms:
         False: gl.OrderAction.SELL
     }
 
+    DONE_ORDER_STATUSES = (gl.OrderStatus.FILLED, gl.OrderStatus.CANCELLED, gl.OrderStatus.INACTIVE,
+                           gl.OrderStatus.REJECTED)
+    ORDER_REJECTED_CODES = (103, 107, 109, 110, 116, 200, 201, 10149)
+
     def __init__(self, config: OrderedDict):
         self._logger = logging.getLogger(__name__)
 
@@ -82,15 +104,20 @@ class Oms:
 
         self._n_workers = int(cfg[CFG_NUM_OF_WORKERS])
         self._sessions: Dict[str, ClientSession] = dict()
+        self._sessions_by_id: Dict[str, ClientSession] = dict()
+        self._sessions_lock = RLock()
+        self._order_owners: Dict[int, Tuple[ClientSession, int]] = dict()
         self._ledger = LedgerFactory.create_ledger(config)
 
         self._pending_messages = deque()
+        self._loop: Optional[AbstractEventLoop] = None
+        self._socket = None
 
         self._brokers = dict()
         brokers = config[CFG_BROKERS]
         for b in brokers:
             broker_name = b[CFG_NAME]
-            if broker_name in brokers:
+            if broker_name in self._brokers:
                 raise ValueError(f'Broker {broker_name} is duplicated')
             broker = BrokerFactory.create_broker(b)
             broker.gateway.events.on_error(self.handle_broker_error)
@@ -101,16 +128,25 @@ class Oms:
             broker.gateway.events.on_position_update(self.handle_position_update)
             broker.gateway.events.on_open_order_end(self.handle_open_order_end)
             self._brokers[broker_name] = broker
+        self._router = BrokerRouter(self._brokers, config.get(CFG_ROUTING) or CFG_LEAST_OUTSTANDING)
+        self._logger.info(f'Route orders to {len(self._brokers)} broker(s) by {self._router.policy}')
 
-        self._roll_orders: Set[int] = set()
+        self._rolls = RollTracker()
+        self._roll_task: Optional[asyncio.Task] = None
+        self._contracts = ContractTable()
+        self._uncovered: Set[CoverageKey] = set()
 
     def init(self, loop: AbstractEventLoop):
-        with concurrent.futures.ThreadPoolExecutor(len(self._brokers)) as pool:
-            for n, b in self._brokers.items():
-                self._logger.info(f'Connecting broker {n}...')
-                loop.run_in_executor(pool, b.connect)
+        pool = concurrent.futures.ThreadPoolExecutor(len(self._brokers))
+        for n, b in self._brokers.items():
+            self._logger.info(f'Connecting broker {n}...')
+            loop.run_in_executor(pool, b.connect)
+        pool.shutdown(wait=False)
 
-        self._roll_contracts()
+        # the instruments are reconciled while the brokers connect, the contracts are rolled on the event loop so the
+        # client sessions are served in the meantime
+        roll_list = self._reconcile_instruments()
+        self._roll_task = loop.create_task(self._roll_contracts(roll_list))
 
     def close(self):
         self._logger.info('Shutting down OMS...')
@@ -119,11 +155,23 @@ class Oms:
             b.disconnect()
         self._ledger.close()
 
-    def get_broker(self) -> Broker:
-        for _, broker in self._brokers.items():
-            # TODO: return first broker for the time being, cause we got IB only anyway
-            if broker.is_healthy:
-                return broker
+    def cancel_order(self, broker_id: str, broker_order_id):
+        """
+        Cancel an order with the broker it was sent to
+        """
+        broker = self.get_broker(broker_id)
+        if broker is None:
+            self._logger.error(f'Cannot find broker {broker_id} of order {broker_order_id}, unable to cancel it')
+            return
+        broker.cancel_order(broker_order_id)
+
+    def get_broker(self, name: str = None) -> Optional[Broker]:
+        """
+        :param name: broker of an existing order, a healthy broker is chosen for a new order if not given
+        """
+        if name is not None:
+            return self._router.get(name)
+        return self._router.select()
 
     def get_next_id(self) -> int:
         with self._lock:
@@ -138,42 +186,41 @@ class Oms:
 
         # syncchronize database records of open orders
         # by comparing against the open order snapshot of the broker
-
-        def order_key1(x):
-            return x.gateway_id + x.order_ref
-
-        available_indexes = [order_key1(x) for x in event.open_orders if x.order_ref != None]
-
-        self._logger.info(f'Open order(s): {event.open_orders}')
-
-        def order_key2(x):
-            return x[TableOrder.BROKER_ID] + x[TableOrder.BROKER_ORDER_ID]
+        self._brokers[src.name].reset_outstanding(x.order_ref for x in event.open_orders if x.order_ref is not None)
+        self._logger.info('%d open order(s): %s', len(event.open_orders), event.open_orders)
 
         # clean up open entry orders that are not listed on broker's open order list
         orders = self._ledger.query_order(src.name,
             order_type=OrderType.LMT, action=Action.ENTRY, active_orders_only=True)
-        for order in orders:
-            key = order_key2(order)
-            if key not in available_indexes:
-                order_id = order[TableOrder.BROKER_ORDER_ID]
-                session_id = order[TableOrder.SESSION_ID]
-                session_order_id = order[TableOrder.ORDER_ID]
-                # unfilled
-                if order[TableOrder.FILLED_QUANTITY] == 0:
-                    self._ledger.update_order(event.gateway_id, order_id, state=OrderState.CANCELLED)
-                    self._ledger.delete_position_by_entry(session_id, session_order_id)
-                    self._housekeep_expired_order(order_id)
-                elif order[TableOrder.REMAINING_QUANTITY] > 0:
-                    # partial filled is handled by `handle_order_update`
-                    filled = order[TableOrder.FILLED_QUANTITY]
-                    self._handle_partial_filled_order(
-                        order_ref=order_id, broker_id=src.name,
-                        session_id=session_id, session_order_id=session_order_id,
-                        qty=filled, remaining=0, filled=filled, order=order)
-
+        diff = diff_open_orders(event.open_orders, orders)
+        if not diff:
+            return
+        self._logger.info(f'{len(diff.cancelled)} order(s) cancelled and {len(diff.partially_filled)} order(s) '
+                          f'partially filled while not connected to broker {src.name}')
+
+        # the ledger is updated in one transaction, the sessions and the broker are called once it is committed
+        with self._ledger.transaction():
+            for order in diff.cancelled:
+                self._ledger.update_order(event.gateway_id, order[TableOrder.BROKER_ORDER_ID],
+                                          state=OrderState.CANCELLED)
+                self._ledger.delete_position_by_entry(order[TableOrder.SESSION_ID], order[TableOrder.ORDER_ID])
+            for order in diff.partially_filled:
+                # partial filled is handled by `handle_order_update`
+                filled = order[TableOrder.FILLED_QUANTITY]
+                self._record_partial_filled_order(
+                    order_ref=order[TableOrder.BROKER_ORDER_ID], broker_id=src.name,
+                    session_id=order[TableOrder.SESSION_ID], session_order_id=order[TableOrder.ORDER_ID],
+                    qty=filled, remaining=0, filled=filled, order=order)
+
+        for order in diff.cancelled:
+            self._housekeep_expired_order(order[TableOrder.BROKER_ORDER_ID])
+        for order in diff.partially_filled:
+            self._stop_partial_filled_order(order_ref=order[TableOrder.BROKER_ORDER_ID],
+                                            session_id=order[TableOrder.SESSION_ID],
+                                            qty=order[TableOrder.FILLED_QUANTITY], order=order)
 
     def handle_account_info_update(self, src: gl.AbstractGateway, event: gl.AccountUpdate):
-        self._logger.debug(f'handle_account_info_update: {src}, {event}')
+        self._logger.debug('handle_account_info_update: %s, %s', src, event)
 
     def handle_broker_connection_update(self, src: gl.AbstractGateway, event: gl.ConnectionUpdate):
         self._logger.info(f'handle_broker_connection_update: {src}, {event}')
@@ -185,11 +232,15 @@ class Oms:
             broker.is_connected = False
 
     def handle_broker_error(self, src: gl.AbstractGateway, event: gl.ErrorMessage):
-        self._logger.info(f'handle_broker_error: {src}, {event}')
+        self._logger.info('handle_broker_error: %s, %s', src, event)
 
-        if type(event) is gl.OrderError:
+        if type(event) in (gl.OrderError, SimulatedOrderError):
             order_id = int(event.order_id)
-            s = self._lookup_session_by_order_id(order_id)
+            s, session_order_id = self._lookup_session_order(order_id)
+            if event.code in self.ORDER_REJECTED_CODES:
+                self._brokers[src.name].order_done(event.order_id)
+                if self._rolls.on_rejected(order_id) is not None:
+                    self._logger.error(f'Roll order {order_id} is rejected: {event.msg}')
 
             #TODO: error code not exists on IB website e.g. 10147, 10149
             #TODO: there are more order error code e.g. 202
@@ -197,10 +248,9 @@ class Oms:
                 self._ledger.update_order(event.gateway_id, order_id, state=OrderState.INACTIVE)
             elif s is not None:
                 self._logger.info(f'Order {order_id} belongs to session {s.id}')
-                if event.code in [103, 107, 109, 110, 116, 200, 201, 10149]:
+                if event.code in self.ORDER_REJECTED_CODES:
                     orders = self._ledger.query_order(broker_id=src.name,
                         broker_order_id=event.order_id, action=Action.ENTRY)
-                    session_order_id = s.find_session_order_id(order_id)
                     if session_order_id is not None:
                         if len(orders) == 1:
                             # remove `position_by_entry` record of a rejected entry order
@@ -220,15 +270,15 @@ class Oms:
                 broker.is_connected = True
 
     def handle_execution(self, src: gl.AbstractGateway, event: gl.ExecutionUpdate):
-        self._logger.info(f'handle_execution: {src}, {event}')
+        received = now()
+        self._logger.info('handle_execution: %s, %s', src, event)
 
         # only handle execution update originates by OMS
         if src.identity != event.client_id:
             self._logger.info(f"Ignore execution update due to client id is not '{src.identity}'")
             return
 
-        executions = self._ledger.query_executions(src.name, event.exec_id)
-        if executions:
+        if self._ledger.has_execution(src.name, event.exec_id, event.timestamp):
             self._logger.info(f'Receive old execution: {src.name},{event.exec_id}, nothing needs to be done')
         else:
             self._logger.info(f'Process new execution: {src.name},{event.exec_id}')
@@ -268,9 +318,12 @@ class Oms:
             # Handle auto contract roll order
             if order[TableOrder.STRATEGY] == self.STRATEGY_NAME:
                 self._logger.info(f'The order {event.order_ref} was sent by OMS, do not need to update position')
-                if fullyfilled and int(event.order_ref) in self._roll_orders:
+                if fullyfilled:
                     self._logger.info(f'The roll order {event.order_ref} has been filled completely')
-                    self._roll_orders.remove(int(event.order_ref))
+                    self._brokers[src.name].order_done(event.order_ref)
+                    roll = self._rolls.on_filled(int(event.order_ref))
+                    if roll is not None:
+                        self._logger.info(f'All roll orders of {roll} have been filled')
                 return
 
             positions = self._ledger.query_position(portfolio_id=portfolio, strategy=strategy, market=str(market),
@@ -287,6 +340,7 @@ class Oms:
 
             self._ledger.update_position(portfolio, strategy, str(market), symbol, position, avg_price)
             if fullyfilled:
+                self._brokers[src.name].order_done(event.order_ref)
                 # In case there is no OrderUpdate event if order is executed when disconnected from TWS
                 self._ledger.update_order(event.gateway_id, event.order_ref,
                     remaining_quantity=0, filled_quantity=order_quantity,
@@ -296,6 +350,7 @@ class Oms:
             if session:
                 self._logger.info(f'Order {event.order_ref} belongs to session {session.id}')
                 session.publish_execution(event, order)
+                LATENCY.record('execution', 'publish', received)
                 session.publish_position()
 
             # Update stop-loss
@@ -305,7 +360,7 @@ class Oms:
                     self._logger.info(f'Entry order {event.order_ref} is fully filled, send stop-loss order. '
                                       f'Execution ID: {event.exec_id}')
 
-                    instrument = InstrumentRepository().find(market=market, symbol=symbol)
+                    instrument = self._contracts.instrument(market, symbol)
                     is_buy = False if int(order[TableOrder.IS_BUY]) else True
                     comment = ujson.loads(order[TableOrder.COMMENT])
                     offset = float(comment[TableOrder.COMMENT_STOP_LOSS_OFFSET])
@@ -402,11 +457,10 @@ class Oms:
     def _housekeep_expired_order(self, order_ref):
         # update strategy order cancelled to reset projected position.
         order_id = int(order_ref)
-        s = self._lookup_session_by_order_id(order_id)
+        s, session_order_id = self._lookup_session_order(order_id)
         if not s:
             self._logger.warning(f"Failed to find the session with order reference '{order_id}'")
             return
-        session_order_id = s.find_session_order_id(order_id)
         if session_order_id is None:
             self._logger.warning(f"Failed to find the session order id with order reference '{order_id}'")
             return
@@ -418,6 +472,13 @@ class Oms:
         """
         Treat partial filled LMT order as a fully filled order.
         """
+        self._record_partial_filled_order(order_ref, broker_id, session_id, session_order_id, qty, remaining, filled,
+                                          order)
+        self._stop_partial_filled_order(order_ref, session_id, qty, order)
+
+    def _record_partial_filled_order(self, order_ref, broker_id: str,
+        session_id :str, session_order_id,
+        qty, remaining, filled, order):
         # update order to traded size
         self._ledger.update_order(broker_id, order_ref,
             quantity=qty, remaining_quantity=remaining, filled_quantity=filled,
@@ -429,6 +490,7 @@ class Oms:
             avg_price=order[TableOrder.PRICE],
             state=OrderState.FULLY_FILLED.value)
 
+    def _stop_partial_filled_order(self, order_ref, session_id: str, qty, order):
         session = self._lookup_session_by_order_id(int(order_ref))
         if not session:
             self._logger.warning(f"Failed to find the session with order reference '{order_ref}'")
@@ -451,13 +513,18 @@ class Oms:
         session.publish_position_renew()
 
     def handle_order_update(self, src: gl.AbstractGateway, event: gl.OrderUpdate):
-        self._logger.info(f'handle_order_update: {src}, {event}')
+        self._logger.info('handle_order_update: %s, %s', src, event)
 
         # only handle order update originates by OMS
         if src.identity != event.client_id:
             self._logger.info(f"Ignore order update due to client id is not '{src.identity}'")
             return
 
+        if event.status in self.DONE_ORDER_STATUSES:
+            self._brokers[src.name].order_done(event.order_ref)
+            if event.status != gl.OrderStatus.FILLED and self._rolls.on_rejected(event.order_ref) is not None:
+                self._logger.error(f'Roll order {event.order_ref} is done without being filled: {event.status}')
+
         # update position_by_entry for cancelled LMT order
         if event.status == gl.OrderStatus.CANCELLED and not event.is_historical:
             orders = self._ledger.query_order(src.name, broker_order_id=event.order_ref,
@@ -545,39 +612,227 @@ class Oms:
                                   event.remaining, event.filled, self.FROM_GW_ORDER_STATUS[event.status], order_action)
 
 
+    def register_order(self, broker_order_id: int, session: ClientSession, session_order_id: int):
+        self._order_owners[broker_order_id] = (session, session_order_id)
+
+    def unregister_order(self, broker_order_id: int, session: ClientSession):
+        owner = self._order_owners.get(broker_order_id)
+        if owner is not None and owner[0] is session:
+            self._order_owners.pop(broker_order_id)
+
     def handle_position_update(self, src: gl.AbstractGateway, event: gl.PositionUpdate):
-        self._logger.debug(f'handle_position_update: {src}, {event}')
+        self._logger.debug('handle_position_update: %s, %s', src, event)
 
     def install_loops(self, loop: AbstractEventLoop):
         asyncio.ensure_future(self.run(loop))
 
     def is_ready(self):
-        for b in self._brokers.values():
-            if not b.is_connected:
-                return False
-        return True
+        # new orders are routed to the connected brokers
+        return any(b.is_connected for b in self._brokers.values())
 
     def place_order(self, market: Market, symbol: str,
         order_type: OrderType, is_buy: bool, quantity: int, price: float,
-        good_till: str=""):
-        # Use the symbol directly if can't find in instrument repository, otherwise pick the front month contract
-        order_symbol = symbol
-        instrument = InstrumentRepository().find(market, symbol)
-        if instrument is not None and instrument.symbol == symbol:
-            order_symbol = instrument.front_month.symbol
-            self._logger.info(
-                f'Front month contract for symbol {symbol} is {order_symbol}, will send order with this symbol instead')
+        good_till: str="", record: Callable[[str, int], None] = None):
+        """
+        :param record: called with the broker and the ID of the order before it is sent, see `place_orders`
+        :return: (broker, order ID), (None, None) if the order was not sent
+        """
+        def record_order(order_ids: List[Optional[Tuple[str, int]]]):
+            if order_ids[0] is not None:
+                record(*order_ids[0])
 
-        gl_order_type = int(self.TO_GW_ORDER_TYPE[order_type])
-        action = int(self.TO_ACTION[is_buy])
+        sent, = self.place_orders([OrderRequest(market, symbol, order_type, is_buy, quantity, price, good_till)],
+                                  record_order if record is not None else None)
+        return sent if sent is not None else (None, None)
 
-        broker = self.get_broker()
+    def place_orders(self, requests: List[OrderRequest], record: Callable[[List[Optional[Tuple[str, int]]]], None] = None
+                     ) -> List[Optional[Tuple[str, int]]]:
+        """
+        Send orders back to back. A broker is chosen and an ID is taken for every order first, then `record` is called
+        once with the (broker, order ID) of every order, None for an order without broker, and the orders are sent
+        after it returns, so the executions of the orders always find them. An order recorded but not sent is
+        rejected.
 
-        if broker is None:
+        No lock is held while the orders are recorded, the records of different sessions run in parallel. IB requires
+        the order IDs of a connection to be sent in increasing order, so a broker sends an order once the orders with a
+        lower ID are sent: an order may wait for the record of an order which took its ID before.
+
+        :return: (broker, order ID) of every order, None for an order which was not sent
+        """
+        orders = [self._build_order(r) for r in requests]
+        brokers = [self.get_broker() for _ in requests]
+        if not all(brokers):
             self._logger.warning(f'Cannot find any available broker')
-            return None, None
 
-        req_id = self.get_next_id()
+        order_ids = [(b.name, b.reserve_id(self.get_next_id)) if b is not None else None for b in brokers]
+        results: List[Optional[Tuple[str, int]]] = [None] * len(requests)
+        unsent = []
+        n_tried = 0
+        try:
+            if record is not None:
+                record(order_ids)
+
+            # the IDs are taken in the order of the orders, they are sent in that order
+            for broker, order, order_id in zip(brokers, orders, order_ids):
+                if broker is not None:
+                    with LATENCY.measure('broker', broker.name):
+                        self._logger.info('Send order to broker %s: %s,%r', broker.name, order_id[1], order)
+                        is_sent = broker.place_order(f'{order_id[1]}', order)
+                    if is_sent:
+                        results[n_tried] = order_id
+                    elif record is not None:
+                        unsent.append(order_id)
+                n_tried += 1
+        finally:
+            # e.g. the record failed, the orders with a higher ID must not wait for these
+            for broker, order_id in zip(brokers[n_tried:], order_ids[n_tried:]):
+                if broker is not None:
+                    broker.release_id(order_id[1])
+
+        for broker_id, broker_order_id in unsent:
+            self._reject_unsent_order(broker_id, broker_order_id, f'Order was not sent, broker {broker_id} is down')
+        return results
+
+    async def run(self, loop: AbstractEventLoop):
+        self._logger.info(f'Start listening with {self._n_workers} workers...')
+
+        cfg = self._config[CFG_MESSAGING][CFG_OMS]
+        socket = self._context.socket(zmq.DEALER)
+        broker_addr = cfg[CFG_CONNECTION][CFG_BROKER]
+        self._logger.info(f'Connect to messaging proxy at {broker_addr}...')
+        socket.connect(broker_addr)
+
+        # each client session is pinned to a lane, its messages are processed one at a time in the order received
+        with ShardedExecutor(self._n_workers, 'Session') as lanes, \
+                concurrent.futures.ThreadPoolExecutor(max(len(self._brokers), 1), 'Broker') as broker_pool:
+            self._socket = socket
+            self._loop = loop
+            # messages published before the loop started
+            while len(self._pending_messages) > 0:
+                self._send(self._pending_messages.popleft())
+
+            try:
+                loop.add_signal_handler(signal.SIGUSR1, self._log_latency)
+            except (AttributeError, NotImplementedError, RuntimeError):
+                self._logger.info('Unable to dump latency on SIGUSR1, the latency is only logged periodically')
+
+            await asyncio.gather(self._receive(loop, lanes, socket),
+                                 self._housekeep_brokers(loop, broker_pool),
+                                 self._housekeep_sessions(loop, lanes),
+                                 self._housekeep_latency(loop))
+
+    def publish_msg(self, msg: list):
+        """
+        Send a message to a client, it can be called from any thread
+        """
+        if self._loop is None:
+            self._pending_messages.append(msg)
+        else:
+            self._loop.call_soon_threadsafe(self._send, msg)
+
+    async def _receive(self, loop: AbstractEventLoop, lanes: ShardedExecutor, socket):
+        while loop.is_running():
+            msg = await socket.recv_multipart()
+            received = now()
+            self._logger.debug('OMS receives: %s', msg)
+            future = asyncio.wrap_future(lanes.submit_to(msg[0], self._process_zmq_msg, msg, received), loop=loop)
+            future.add_done_callback(self._send_result)
+
+    async def _housekeep_brokers(self, loop: AbstractEventLoop, pool: concurrent.futures.Executor):
+        last_ping: Dict[str, datetime] = dict()
+        while loop.is_running():
+            for name, b in self._brokers.items():
+                if not b.is_connected and b.is_time_to_reconnect():
+                    self._logger.info(f'Try to reconnect broker {name}, retry interval: '
+                                      f'{b.reconnect_interval_in_sec} sec...')
+                    if not b.is_connecting:
+                        loop.run_in_executor(pool, b.connect)
+                    else:
+                        self._logger.info(f'Broker {name} is already trying to reconnect')
+                elif b.is_connected and datetime.now() - last_ping.get(name, datetime.min) > self.PING_INTERVAL:
+                    last_ping[name] = datetime.now()
+                    loop.run_in_executor(pool, b.ping)
+            await asyncio.sleep(self.HOUSEKEEPING_INTERVAL_IN_SEC)
+
+    async def _housekeep_sessions(self, loop: AbstractEventLoop, lanes: ShardedExecutor):
+        while loop.is_running():
+            sessions = self._sessions
+            for sid in list(sessions.keys()):
+                session = sessions[sid]
+                if session.is_expired:
+                    self._logger.warning(f'Lost heartbeat from client {sid}, {session}, disconnecting...')
+                    self._remove_session(sid)
+                else:
+                    if session.is_heartbeat_due:
+                        future = asyncio.wrap_future(lanes.submit_to(sid, self._send_heartbeat, sid, session),
+                                                     loop=loop)
+                        future.add_done_callback(self._send_result)
+            self._check_stop_coverage()
+            await asyncio.sleep(self.HOUSEKEEPING_INTERVAL_IN_SEC)
+
+    async def _housekeep_latency(self, loop: AbstractEventLoop):
+        while loop.is_running():
+            await asyncio.sleep(self.LATENCY_LOG_INTERVAL_IN_SEC)
+            self._log_latency(reset=True)
+
+    def _log_latency(self, reset: bool = False):
+        """
+        Log the latency histograms, since the last periodic log
+
+        :param reset: start a new period
+        """
+        lines = LATENCY.report(reset)
+        self._logger.info('Latency in microseconds:\n' + '\n'.join(lines) if lines else 'No latency recorded')
+
+    def _send(self, msg: list):
+        self._logger.debug('OMS sends: %s', msg)
+        self._socket.send_multipart(msg)
+
+    def _send_result(self, future: asyncio.Future):
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            self._logger.error(f'Worker failed: {future.exception()!r}')
+            return
+        result = future.result()
+        if result is not None:
+            self._send(result)
+
+    def _check_stop_coverage(self):
+        """
+        Report the positions which are not covered by stop orders, and those covered again. The coverage is kept up to
+        date by the ledger, nothing is queried.
+        """
+        uncovered = {k: (position, covered) for k, position, covered in
+                     self._ledger.stop_coverage.uncovered(self.STOP_COVERAGE_GRACE_IN_SEC)}
+        for key in uncovered.keys() - self._uncovered:
+            portfolio, strategy, symbol = key
+            position, covered = uncovered[key]
+            # Choose not to send error msg to client
+            # because smartquant only handle order reject.
+            self._logger.warning(f"Stop order check failed for strategy '{strategy}', portfolio {portfolio}, "
+                                 f"symbol {symbol}. Strategy position is {position} but the total STP order quantity "
+                                 f"is {-covered}")
+        for portfolio, strategy, symbol in self._uncovered - uncovered.keys():
+            self._logger.info(f"Position of strategy '{strategy}', portfolio {portfolio}, symbol {symbol} is covered "
+                              f"by stop orders again")
+        self._uncovered = set(uncovered)
+
+    @property
+    def ledger(self):
+        return self._ledger
+
+    def _build_order(self, request: OrderRequest) -> gl.Order:
+        market, symbol, order_type, is_buy, quantity, price, good_till = request
+
+        # Use the symbol directly if can't find in instrument repository, otherwise pick the front month contract
+        contract = self._contracts.resolve(market, symbol)
+        if contract.symbol != symbol:
+            self._logger.info('Front month contract for symbol %s is %s, will send order with this symbol instead',
+                              symbol, contract.symbol)
+
+        gl_order_type = int(self.TO_GW_ORDER_TYPE[order_type])
+        action = int(self.TO_ACTION[is_buy])
 
         rth = order_type in [OrderType.STP, OrderType.STP_LMT]
         _lmt_price, _stop_price = None, None
@@ -593,10 +848,8 @@ class Oms:
         if good_till:
             tif = gl.TIF.GTD
 
-        order = gl.Order(
-            symbol=order_symbol,
-            exchange=gl.Exchange.from_str(market.value),
-            contractType=gl.ContractType.Future,
+        return gl.Order(
+            **contract.order_fields,
             orderType=gl_order_type,
             action=action,
             quantity=quantity,
@@ -605,90 +858,6 @@ class Oms:
             tif=tif,
             outsideRth=rth,
             goodTillDate=good_till)
-        self._logger.info(f'Send order to broker: {req_id},{repr(order)}')
-        with self._lock:
-            broker.place_order(f'{req_id}', order)
-
-        return broker.name, req_id
-
-    async def run(self, loop: AbstractEventLoop):
-        self._logger.info(f'Start listening with {self._n_workers} workers...')
-
-        cfg = self._config[CFG_MESSAGING][CFG_OMS]
-        socket = self._context.socket(zmq.DEALER)
-        broker_addr = cfg[CFG_CONNECTION][CFG_BROKER]
-        self._logger.info(f'Connect to messaging proxy at {broker_addr}...')
-        socket.connect(broker_addr)
-
-        poller = Poller()
-        poller.register(socket, zmq.POLLIN)
-        future_results = []
-
-        with concurrent.futures.ThreadPoolExecutor(self._n_workers) as pool:
-            last_ping = datetime.min
-
-            while loop.is_running():
-                for f in list(future_results):
-                    if f.done():
-                        try:
-                            result = f.result()
-                            if result is not None:
-                                self._logger.debug(f'OMS sends: {result}')
-                                socket.send_multipart(result)
-                        finally:
-                            future_results.remove(f)
-
-                while len(self._pending_messages) > 0:
-                    msg = self._pending_messages.popleft()
-                    self._logger.debug(f'OMS sends: {msg}')
-                    socket.send_multipart(msg)
-
-                socks = dict(await poller.poll(timeout=1))
-                if socks.get(socket) == zmq.POLLIN:
-                    msg = await socket.recv_multipart()
-                    self._logger.debug(f'OMS receives: {msg}')
-                    future_results.append(loop.run_in_executor(pool, self._process_zmq_msg, msg))
-
-                for name, b in self._brokers.items():
-                    if not b.is_connected and b.is_time_to_reconnect():
-                        self._logger.info(f'Try to reconnect broker {name}, retry interval: '
-                                          f'{b.reconnect_interval_in_sec} sec...')
-                        if not b.is_connecting:
-                            loop.run_in_executor(pool, b.connect)
-                        else:
-                            self._logger.info(f'Broker {name} is already trying to reconnect')
-                    elif b.is_connected and datetime.now() - last_ping > self.PING_INTERVAL:
-                        last_ping = datetime.now()
-                        loop.run_in_executor(pool, b.ping)
-
-                sessions = self._sessions
-                for sid in list(sessions.keys()):
-                    session = sessions[sid]
-                    if session.is_expired:
-                        self._logger.warning(f'Lost heartbeat from client {sid}, {session}, disconnecting...')
-                        sessions.pop(sid)
-                    else:
-                        if session.is_heartbeat_due:
-                            future = loop.run_in_executor(pool, self._send_heartbeat, sid, session)
-                            future_results.append(future)
-
-                        if session.require_stop_check():
-                            loop.run_in_executor(pool, self._check_positions, session)
-
-
-    def publish_msg(self, msg: list):
-        self._pending_messages.append(msg)
-
-    def _check_positions(self, session):
-        errMsg = session.validate_stop_orders()
-        if errMsg:
-            # Choose not to send error msg to client
-            # because smartquant only handle order reject.
-            self._logger.warning(errMsg)
-
-    @property
-    def ledger(self):
-        return self._ledger
 
     @staticmethod
     def _build_error_reply(code: ErrorCode, msg: str):
@@ -707,11 +876,44 @@ class Oms:
     def _get_direction(is_buy: bool):
         return 1 if is_buy else -1
 
-    def _lookup_session_by_order_id(self, broker_order_id: int):
-        for _, s in self._sessions.items():
-            if s.is_own_order(broker_order_id):
-                return s
-        return None
+    def _lookup_session_by_order_id(self, broker_order_id: int) -> Optional[ClientSession]:
+        return self._lookup_session_order(broker_order_id)[0]
+
+    def _lookup_session_order(self, broker_order_id: int) -> Tuple[Optional[ClientSession], Optional[int]]:
+        """
+        Find the session owning a broker order, and the order ID used by that session
+
+        :param broker_order_id:
+        :return: (session, session order ID), session order ID is 0 for orders sent by OMS on behalf of the session
+        """
+        return self._order_owners.get(broker_order_id, (None, None))
+
+    def _reject_unsent_order(self, broker_id: str, broker_order_id: int, msg: str):
+        """
+        Reject an order recorded before it was sent, as if the broker rejected it
+        """
+        self._logger.error(f'Reject order {broker_order_id} of broker {broker_id}: {msg}')
+        self._ledger.update_order(broker_id, broker_order_id, state=OrderState.REJECTED)
+        if self._rolls.on_rejected(broker_order_id) is not None:
+            self._logger.error(f'Roll order {broker_order_id} is rejected: {msg}')
+
+        s, session_order_id = self._lookup_session_order(broker_order_id)
+        if s is not None and session_order_id:
+            orders = self._ledger.query_order(broker_id=broker_id, broker_order_id=broker_order_id,
+                                              action=Action.ENTRY)
+            if len(orders) == 1:
+                self._ledger.delete_position_by_entry(s.id, session_order_id)
+            s.publish_order_rejected(session_order_id, msg)
+
+    def _remove_session(self, src_id):
+        with self._sessions_lock:
+            session = self._sessions.pop(src_id, None)
+            if session is None:
+                return
+            if self._sessions_by_id.get(session.id) is session:
+                self._sessions_by_id.pop(session.id)
+            for broker_order_id in session.broker_order_ids:
+                self.unregister_order(broker_order_id, session)
 
     def _place_stop(self, session_id: str, market: Market, symbol: str, is_buy: bool, quantity: int, price: float,
                     portfolio: str, strategy: str, parent_order_id: int, comment: Dict[str, str] = None,
@@ -721,41 +923,50 @@ class Oms:
             self._logger.warning(f'OMS is not ready, order {args} was not sent')
             return
 
-        broker_id, broker_order_id = self.place_order(market, symbol, OrderType.STP, is_buy, quantity, price)
-
-        if broker_order_id is not None:
+        # the order is recorded before it is sent, its updates can be received before `place_order` returns
+        def record(broker_id: str, broker_order_id: int):
             self.ledger.insert_order(session_id, 0, parent_order_id, broker_id, broker_order_id, market, symbol,
                                      OrderType.STP, is_buy, quantity, price, portfolio, Action.STOP_LOSS, strategy,
                                      None, comment)
+            if session is not None:
+                session.notify_unsolicited_order(broker_order_id)
 
-        if session is not None:
-            session.notify_unsolicited_order(broker_order_id)
+        self.place_order(market, symbol, OrderType.STP, is_buy, quantity, price, record=record)
 
-    def _process_zmq_msg(self, msg):
-        self._logger.debug(f'Worker receives: {msg}')
+    def _process_zmq_msg(self, msg, received: int = None):
+        """
+        :param received: stamp taken when the message is received from the socket
+        """
+        started = now()
+        self._logger.debug('Worker receives: %s', msg)
 
         src_id = msg[0]
         payload = msg[1]
+        msg_type = 'unknown'
         try:
-            message = OmsMessage.from_json(payload)
-            self._logger.debug(f'Decoded: {message}')
-
-            if src_id in self._sessions:
-                session = self._sessions[src_id]
-            else:
+            message = OmsMessage.from_bytes(payload)
+            msg_type = message.msg_type
+            LATENCY.record('decode', msg_type, started)
+            if received is not None:
+                LATENCY.record('queue', msg_type, received, started)
+            self._logger.debug('Decoded: %s', message)
+
+            session = self._sessions.get(src_id)
+            if session is None:
                 if message.msg_type == MsgType.INIT:
                     session_id = message.session_id
 
-                    for s in self._sessions.values():
-                        if s.id == session_id:
+                    with self._sessions_lock:
+                        if session_id in self._sessions_by_id:
                             reply = self._build_error_reply(ErrorCode.DUPLICATED_SESSION_ID,
                                                             f'An OMS client with same session ID {session_id} has '
                                                             f'logged in already.')
                             msg[1] = reply.to_bytes()
                             return msg
 
-                    session = ClientSession(session_id, src_id, self)
-                    self._sessions[src_id] = session
+                        session = ClientSession(session_id, src_id, self)
+                        self._sessions[src_id] = session
+                        self._sessions_by_id[session_id] = session
                     self._logger.info(f'Create session {session}, with source ID {src_id}')
                 else:
                     if message.msg_type != MsgType.HEARTBEAT:
@@ -768,125 +979,175 @@ class Oms:
                         self._logger.info(f'Ignore heartbeat from non-logged in connection: {message}')
                         return None
 
-            reply = session.process(message)
+            with LATENCY.measure('process', msg_type):
+                reply = session.process(message)
             if reply is not None:
-                msg[1] = reply.to_bytes()
+                msg[1] = reply.encode(session.codec)
                 return msg
         except ValueError as e:
             self._logger.exception(f'Error occurred when decoding client message: {payload}', e)
+        finally:
+            if received is not None:
+                LATENCY.record('total', msg_type, received)
 
         return None
 
     def _reconcile_instruments(self) -> List[Tuple[str, Instrument]]:
         """
-        Reconcile the instrument data from JSON with those already stored in database
+        Reconcile the instrument data from JSON with those already stored in database. The new instruments and the
+        rolled front months are written in one batch.
 
-        :return:
+        :return: the front month code recorded before the roll and the instrument, of each instrument to roll
         """
-        db_insts = self._ledger.query_instruments()
+        recorded = {(dbi[TableInstrument.MARKET], dbi[TableInstrument.SYMBOL]): dbi
+                    for dbi in self._ledger.query_instruments()}
 
         roll_list = []
+        updates = []
         for instrument in InstrumentRepository().instruments:
-            is_new_instrument = True
-            for dbi in db_insts:
-                if (dbi[TableInstrument.MARKET] == instrument.market.value and
-                        dbi[TableInstrument.SYMBOL] == instrument.symbol):
-                    is_new_instrument = False
-                    if (dbi[TableInstrument.CODE] != instrument.front_month.symbol and
-                            dbi[TableInstrument.EXPIRY] < instrument.front_month.expiry.date()):
-                        self._logger.info(f'Contract roll detected, symbol: {instrument.symbol}, from '
-                                          f'{dbi[TableInstrument.CODE]}|{dbi[TableInstrument.EXPIRY]}, to '
-                                          f'{instrument.front_month.symbol}|{instrument.front_month.expiry}')
-                        roll_list.append((dbi[TableInstrument.CODE], instrument))
-
-                        self._logger.info(
-                            f'Instrument {instrument}, update front month contract to {instrument.front_month.symbol}')
-                        self._ledger.update_instrument(instrument.market, instrument.symbol,
-                                                       instrument.front_month.symbol,
-                                                       instrument.front_month.expiry)
-                    else:
-                        continue
-
-            if is_new_instrument:
-                self._logger.info(
-                    f'Instrument {instrument}, {instrument.front_month.symbol} is not found in OMS before, adding it')
-                self._ledger.update_instrument(instrument.market, instrument.symbol, instrument.front_month.symbol,
-                                               instrument.front_month.expiry)
+            front_month = instrument.front_month
+            dbi = recorded.get((instrument.market.value, instrument.symbol))
+            if dbi is None:
+                self._logger.info(f'Instrument {instrument}, {front_month.symbol} is not found in OMS before, adding it')
+            elif (dbi[TableInstrument.CODE] != front_month.symbol and
+                    dbi[TableInstrument.EXPIRY] < front_month.expiry.date()):
+                roll_list.append((dbi[TableInstrument.CODE], instrument))
+            else:
+                continue
+            updates.append((instrument.market, instrument.symbol, front_month.symbol, front_month.expiry))
+
+        if updates:
+            self._ledger.update_instruments(updates)
+        if roll_list:
+            plan = ', '.join(f'{i.symbol}: {code} -> {i.front_month.symbol}|{i.front_month.expiry}'
+                             for code, i in roll_list)
+            self._logger.info(f'Contract roll plan, {len(roll_list)} contract(s): {plan}')
+
+        # orders are sent for the front months recorded above
+        self._contracts.rebuild()
         return roll_list
 
-    def _roll_contracts(self):
+    async def _roll_contracts(self, roll_list: List[Tuple[str, Instrument]] = None):
+        """
+        Roll the contracts on the event loop: the symbols are rolled concurrently, each one through the states of
+        `RollState`, and the progress is logged until all of them are done
+        """
         self._logger.info("Check if OMS needs to roll any contract")
 
-        roll_list = self._reconcile_instruments()
+        if roll_list is None:
+            roll_list = self._reconcile_instruments()
 
-        if len(roll_list) > 0:
-            self._logger.info("Contract roll is required, waiting for all broker connections to be ready...")
-            self._wait_for_brokers(timeout=timedelta(seconds=30))
+        if len(roll_list) == 0:
+            self._logger.info(f'No contract requires rolling')
+            return
 
+        rolls = self._rolls.start(roll_list)
+        for roll in rolls:
+            roll.state = RollState.WAITING_FOR_BROKERS
+        self._logger.info("Contract roll is required, waiting for all broker connections to be ready...")
+        if not await self._wait_for_brokers(timeout=self.ROLL_BROKER_TIMEOUT):
             for broker_name, b in self._brokers.items():
                 if not b.is_connected:
                     self._logger.info(f'The broker {broker_name} is not connected yet, skip contract roll this time')
-                    return
-
-            self._logger.info("All brokers are connected")
+            for roll in rolls:
+                roll.finish(RollState.SKIPPED, 'brokers not connected')
+            return
 
+        self._logger.info("All brokers are connected")
+        progress = asyncio.ensure_future(self._report_roll_progress())
+        try:
             # TODO: figure out which broker hold the position, assume only IB now
-            for roll in roll_list:
-                last_month_code = roll[0]
-                instrument = roll[1]
+            await asyncio.gather(*(self._roll_one_symbol(roll) for roll in rolls))
+        finally:
+            progress.cancel()
+        self._logger.info(f'Contract roll finished: {self._rolls.report()}')
 
-                self._logger.info(f'Roll contract {instrument.symbol}...')
+    async def _roll_one_symbol(self, roll: SymbolRoll) -> None:
+        loop = asyncio.get_running_loop()
+        instrument = roll.instrument
+        last_month_code = roll.from_code
+        self._logger.info(f'Roll contract {instrument.symbol}...')
 
-                now_in_exch_time = datetime.now(tz=instrument.timezone)
-                roll_instruction = instrument.roll_instruction
-                if (roll_instruction and
+        try:
+            now_in_exch_time = datetime.now(tz=instrument.timezone)
+            roll_instruction = instrument.roll_instruction
+            if not (roll_instruction and
                     roll_instruction.roll_on_next_start and
                     roll_instruction.from_ == last_month_code and
                     roll_instruction.to == instrument.front_month.symbol and
                     roll_instruction.date == now_in_exch_time.date()):
-                    expected = roll_instruction.net_position
-                    self._logger.info(f'Roll instruction found, from {roll_instruction.from_} to '
-                                      f'{roll_instruction.to}, roll on {roll_instruction.date},'
-                                      f' offset {roll_instruction.offset}, position {expected}, can carry out rolling')
-
-                    result = self._ledger.query_total_position(instrument.symbol)
-                    total_position = result[0][TablePosition.POSITION]
-                    assert total_position == expected, f"Expected roll positiion {expected} but was {total_position}"
-
-                    self._roll_one_symbol(instrument, roll_instruction, total_position)
-                else:
-                    self._logger.info(f'Cannot find any roll instruction to roll from {last_month_code} to '
-                                      f'{instrument.front_month.symbol} on {now_in_exch_time.date()}, no rolling '
-                                      f'occurred')
-        else:
-            self._logger.info(f'No contract requires rolling')
-
-    def _roll_one_symbol(self, instrument: Instrument, roll_instruction: RollInstruction, total_position: int) -> None:
-        # Roll position if the net position of the same instrument of all strategies is not zero
-        if total_position == 0:
-            self._logger.info(f'The aggregated position of {instrument.symbol} is 0, no position rolling is required')
-        else:
-            self._logger.info(f'The aggregated position of {instrument.symbol} is {total_position}, position rolling is required')
-            portfolios = self.ledger.query_portfolio()
-            portfolio = portfolios[0][TablePortfolio.ID]
-
-            self._roll_orders.clear()
-            # Liquidate front month
-            is_buy = True if total_position < 0 else False
-            self._send_roll_order(instrument.market, instrument.symbol, roll_instruction.from_, is_buy,
-                                total_position, portfolio)
-
-            # Establish position with next month
-            is_buy = not is_buy
-            self._send_roll_order(instrument.market, instrument.symbol, roll_instruction.to, is_buy,
-                                total_position, portfolio)
+                self._logger.info(f'Cannot find any roll instruction to roll from {last_month_code} to '
+                                  f'{instrument.front_month.symbol} on {now_in_exch_time.date()}, no rolling '
+                                  f'occurred')
+                roll.finish(RollState.SKIPPED, 'no roll instruction')
+                return
 
-            self._logger.info('Waiting for all roll order to be filled...')
-            self._wait_for_roll_orders()
-            self._logger.info('All roll orders has been filled')
+            expected = roll_instruction.net_position
+            self._logger.info(f'Roll instruction found, from {roll_instruction.from_} to '
+                              f'{roll_instruction.to}, roll on {roll_instruction.date},'
+                              f' offset {roll_instruction.offset}, position {expected}, can carry out rolling')
+
+            # the ledger and the brokers are called from the default executor, the event loop keeps serving sessions
+            result = await loop.run_in_executor(None, self._ledger.query_total_position, instrument.symbol)
+            total_position = result[0][TablePosition.POSITION]
+            if total_position != expected:
+                self._logger.critical(f'Expected roll position {expected} of {instrument.symbol} but was '
+                                      f'{total_position}, unable to roll')
+                roll.finish(RollState.FAILED, f'position {total_position} instead of {expected}')
+                return
 
-        # Roll stop orders if strategy has position, even when the net position of an instrument is 0
-        self._roll_stop_loss_orders(instrument, roll_instruction)
+            # Roll position if the net position of the same instrument of all strategies is not zero
+            if total_position == 0:
+                self._logger.info(f'The aggregated position of {instrument.symbol} is 0, no position rolling is '
+                                  f'required')
+            else:
+                self._logger.info(f'The aggregated position of {instrument.symbol} is {total_position}, position '
+                                  f'rolling is required')
+                roll.state = RollState.ROLLING_POSITION
+                await loop.run_in_executor(None, self._send_roll_orders, roll, roll_instruction, total_position)
+
+                self._logger.info(f'Waiting for the roll orders of {instrument.symbol} to be filled...')
+                try:
+                    filled = await asyncio.wait_for(asyncio.wrap_future(roll.filled),
+                                                    self.ROLL_FILL_TIMEOUT.total_seconds())
+                except asyncio.TimeoutError:
+                    self._logger.critical(f'The roll orders {sorted(roll.orders)} of {instrument.symbol} are not '
+                                          f'filled after {self.ROLL_FILL_TIMEOUT}, the stop orders are not rolled')
+                    roll.finish(RollState.TIMED_OUT, f'orders not filled after {self.ROLL_FILL_TIMEOUT}')
+                    return
+                if not filled:
+                    self._logger.critical(f'A roll order of {instrument.symbol} is not filled, the stop orders are '
+                                          f'not rolled')
+                    roll.finish(RollState.FAILED, 'roll order not filled')
+                    return
+                self._logger.info(f'All roll orders of {instrument.symbol} have been filled')
+
+            # Roll stop orders if strategy has position, even when the net position of an instrument is 0
+            roll.state = RollState.ROLLING_STOPS
+            await loop.run_in_executor(None, self._roll_stop_loss_orders, instrument, roll_instruction)
+            roll.finish(RollState.DONE)
+        except Exception as e:
+            self._logger.exception(f'Failed to roll {roll}')
+            roll.finish(RollState.FAILED, str(e))
+
+    async def _report_roll_progress(self):
+        while self._rolls.is_rolling:
+            await asyncio.sleep(self.ROLL_PROGRESS_INTERVAL_IN_SEC)
+            self._logger.info(f'Contract roll in progress: {self._rolls.report()}')
+
+    def _send_roll_orders(self, roll: SymbolRoll, roll_instruction: RollInstruction, total_position: int) -> None:
+        instrument = roll.instrument
+        portfolios = self.ledger.query_portfolio()
+        portfolio = portfolios[0][TablePortfolio.ID]
+
+        roll.expect(2)
+        # Liquidate front month
+        is_buy = True if total_position < 0 else False
+        self._send_roll_order(roll, roll_instruction.from_, is_buy, total_position, portfolio)
+
+        # Establish position with next month
+        is_buy = not is_buy
+        self._send_roll_order(roll, roll_instruction.to, is_buy, total_position, portfolio)
 
     def _roll_stop_loss_orders(self, instrument: Instrument, roll_instruction: RollInstruction) -> None:
         positions = self.ledger.query_position(symbol=instrument.symbol)
@@ -923,40 +1184,46 @@ class Oms:
                     parent_order_id = order[TableOrder.PARENT_ORDER_ID]
 
                     self._logger.info(f'Remove original stop-loss order: {order_id}')
-                    self.get_broker().cancel_order(order_id)
+                    self.cancel_order(order[TableOrder.BROKER_ID], order_id)
 
                     price = price + Decimal(roll_instruction.offset)
                     self._logger.info(f'Place new stop-loss order, is_buy: {is_buy}, {quantity}@{price}')
-                    broker_id, broker_order_id = self.place_order(
-                        instrument.market, instrument.symbol, OrderType.STP, is_buy, quantity, price)
-                    self.ledger.insert_order(strategy, 0, parent_order_id, broker_id, broker_order_id,
-                                             instrument.market, instrument.symbol, OrderType.STP, is_buy, quantity,
-                                             price, portfolio, Action.STOP_LOSS, strategy, None, comment)
+
+                    def record(broker_id: str, broker_order_id: int):
+                        self.ledger.insert_order(strategy, 0, parent_order_id, broker_id, broker_order_id,
+                                                 instrument.market, instrument.symbol, OrderType.STP, is_buy, quantity,
+                                                 price, portfolio, Action.STOP_LOSS, strategy, None, comment)
+                    self.place_order(instrument.market, instrument.symbol, OrderType.STP, is_buy, quantity, price,
+                                     record=record)
 
     def _send_heartbeat(self, src_id, session: ClientSession):
         payload = session.send_heartbeat()
-        msg = [src_id, payload.to_bytes()]
+        msg = [src_id, payload.encode(session.codec)]
         return msg
 
-    def _send_roll_order(self, market: Market, symbol: str, contract: str, is_buy: bool, quantity: int, portfolio: str) -> None:
+    def _send_roll_order(self, roll: SymbolRoll, contract: str, is_buy: bool, quantity: int, portfolio: str) -> None:
+        market, symbol = roll.instrument.market, roll.instrument.symbol
         qty = abs(quantity)
-        broker_id, broker_order_id = self.place_order(market=market, symbol=contract, order_type=OrderType.MKT,
-                                                      is_buy=is_buy, quantity=qty, price=0)
-        self.ledger.insert_order(self.STRATEGY_NAME, 0, 0, broker_id, broker_order_id, market, symbol, OrderType.MKT,
-                                 is_buy, qty, 0, portfolio, Action.ROLL, self.STRATEGY_NAME, None, None)
-        self._roll_orders.add(broker_order_id)
-
-    def _wait_for_brokers(self, timeout=timedelta(seconds=5)) -> None:
-        start = datetime.now()
-        while datetime.now() - start < timeout:
-            for b in self._brokers.values():
-                if not b.is_connected:
-                    time.sleep(0.5)
-                    continue
-                break
-
-    def _wait_for_roll_orders(self) -> None:
-        while True:
-            if len(self._roll_orders) == 0:
-                break
-            time.sleep(0.5)
+
+        # the order is recorded before it is sent, its execution can be received before `place_order` returns
+        def record(broker_id: str, broker_order_id: int):
+            self.ledger.insert_order(self.STRATEGY_NAME, 0, 0, broker_id, broker_order_id, market, symbol,
+                                     OrderType.MKT, is_buy, qty, 0, portfolio, Action.ROLL, self.STRATEGY_NAME, None,
+                                     None)
+            self._rolls.add_order(roll, broker_order_id)
+
+        _, broker_order_id = self.place_order(market=market, symbol=contract, order_type=OrderType.MKT,
+                                              is_buy=is_buy, quantity=qty, price=0, record=record)
+        if broker_order_id is None:
+            raise RuntimeError(f'Unable to send the roll order of {contract}, no broker is available or it is down')
+
+    async def _wait_for_brokers(self, timeout=timedelta(seconds=5)) -> bool:
+        """
+        :return: True if all brokers are connected before the timeout
+        """
+        deadline = time.monotonic() + timeout.total_seconds()
+        while not all(b.is_connected for b in self._brokers.values()):
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.5)
+        return True
@@ -0,0 +1,17 @@
+from typing import NamedTuple
+
+from smartquant.common.market import Market
+from smartquant.execution.base import OrderType
+
+
+class OrderRequest(NamedTuple):
+    """
+    New order to be sent to a broker, see `Oms.place_orders`
+    """
+    market: Market
+    symbol: str
+    order_type: OrderType
+    is_buy: bool
+    quantity: int
+    price: float
+    good_till: str = ''
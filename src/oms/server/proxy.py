@@ -38,10 +38,10 @@ class LocalBroker:
             socks = dict(await poller.poll())
             if socks.get(frontend) == zmq.POLLIN:
                 msg = await frontend.recv_multipart()
-                self._logger.debug(f'Frontend receives: {msg}')
+                self._logger.debug('Frontend receives: %s', msg)
                 backend.send_multipart(msg)
 
             if socks.get(backend) == zmq.POLLIN:
                 msg = await backend.recv_multipart()
-                self._logger.debug(f'Backend receives: {msg}')
+                self._logger.debug('Backend receives: %s', msg)
                 frontend.send_multipart(msg)
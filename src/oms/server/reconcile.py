@@ -0,0 +1,35 @@
+from typing import Iterable, List, NamedTuple
+
+from .ledger.statement import TableOrder
+
+
+class OpenOrderDiff(NamedTuple):
+    # active orders of the ledger which are not open at the broker and have not been filled
+    cancelled: List[dict]
+    # active orders of the ledger which are not open at the broker and have been partially filled
+    partially_filled: List[dict]
+
+    def __bool__(self):
+        return bool(self.cancelled or self.partially_filled)
+
+
+def diff_open_orders(open_orders: Iterable, orders: Iterable[dict]) -> OpenOrderDiff:
+    """
+    Compare the open order snapshot of a broker with the active orders recorded in the ledger, in one pass over each
+
+    :param open_orders: open orders of the broker, the orders without order reference are not sent by the OMS
+    :param orders: active orders of the ledger for the broker
+    """
+    open_keys = {(o.gateway_id, str(o.order_ref)) for o in open_orders if o.order_ref is not None}
+
+    cancelled = []
+    partially_filled = []
+    for order in orders:
+        if (order[TableOrder.BROKER_ID], str(order[TableOrder.BROKER_ORDER_ID])) in open_keys:
+            continue
+        # the filled quantity is not known until the broker reports the order
+        if not order[TableOrder.FILLED_QUANTITY]:
+            cancelled.append(order)
+        elif order[TableOrder.REMAINING_QUANTITY]:
+            partially_filled.append(order)
+    return OpenOrderDiff(cancelled, partially_filled)
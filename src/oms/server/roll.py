@@ -0,0 +1,153 @@
+import time
+from concurrent.futures import Future
+from enum import Enum
+from threading import Lock
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from smartquant.common.instrument import Instrument
+
+
+class RollState(Enum):
+    PENDING = 'pending'
+    WAITING_FOR_BROKERS = 'waiting for brokers'
+    ROLLING_POSITION = 'rolling position'
+    ROLLING_STOPS = 'rolling stops'
+    DONE = 'done'
+    SKIPPED = 'skipped'
+    TIMED_OUT = 'timed out'
+    FAILED = 'failed'
+
+    def is_final(self) -> bool:
+        return self in (RollState.DONE, RollState.SKIPPED, RollState.TIMED_OUT, RollState.FAILED)
+
+
+class SymbolRoll:
+    """
+    Roll of the position and the stop orders of one instrument from the contract recorded in the ledger to the front
+    month. `filled` is resolved with True once all roll orders are filled, or with False as soon as one of them is
+    rejected or cancelled.
+    """
+    def __init__(self, from_code: str, instrument: Instrument, clock: Callable[[], float] = time.monotonic):
+        self.from_code = from_code
+        self.instrument = instrument
+        self.state = RollState.PENDING
+        self.reason: Optional[str] = None
+        # roll orders sent and not filled yet
+        self.orders: Set[int] = set()
+        # roll orders to fill, including those not sent yet
+        self.n_pending = 0
+        self.filled: Future = Future()
+        self._clock = clock
+        self._started = clock()
+        self._finished: Optional[float] = None
+
+    def __str__(self):
+        return f'{self.instrument.symbol} {self.from_code} -> {self.instrument.front_month.symbol}'
+
+    @property
+    def elapsed(self) -> float:
+        return (self._finished if self._finished is not None else self._clock()) - self._started
+
+    def expect(self, n_orders: int):
+        """
+        Number of roll orders to fill, set before the orders are sent
+        """
+        self.n_pending = n_orders
+
+    def finish(self, state: RollState, reason: str = None):
+        self.state = state
+        self.reason = reason
+        self._finished = self._clock()
+        if not self.filled.done():
+            self.filled.set_result(state == RollState.DONE)
+
+
+class RollTracker:
+    """
+    State of the contract rolls in progress, by instrument symbol. The roll orders are tracked by broker order ID, as
+    an int or as the order reference of the gateway events, the fills and the rejections are reported from the broker
+    threads while the rolls are awaited on the event loop.
+    """
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self._lock = Lock()
+        self._rolls: Dict[str, SymbolRoll] = dict()
+        self._orders: Dict[str, SymbolRoll] = dict()
+        # orders filled before they were added, a fill can be reported before `place_order` returns
+        self._early_fills: Set[str] = set()
+
+    def __len__(self):
+        return len(self._rolls)
+
+    @property
+    def is_rolling(self) -> bool:
+        return any(not r.state.is_final() for r in self._rolls.values())
+
+    @property
+    def rolls(self) -> List[SymbolRoll]:
+        return list(self._rolls.values())
+
+    def start(self, roll_list: Iterable[Tuple[str, Instrument]]) -> List[SymbolRoll]:
+        """
+        Track a new set of rolls, replacing the previous one
+        """
+        rolls = [SymbolRoll(from_code, instrument, self._clock) for from_code, instrument in roll_list]
+        with self._lock:
+            self._rolls = {r.instrument.symbol: r for r in rolls}
+            self._orders = dict()
+            self._early_fills = set()
+        return rolls
+
+    def add_order(self, roll: SymbolRoll, order_id: int):
+        key = str(order_id)
+        with self._lock:
+            if key not in self._early_fills:
+                roll.orders.add(order_id)
+                self._orders[key] = roll
+                return
+            self._early_fills.discard(key)
+            roll.n_pending -= 1
+            if roll.n_pending > 0:
+                return
+        if not roll.filled.done():
+            roll.filled.set_result(True)
+
+    def on_filled(self, order_id: Union[int, str]) -> Optional[SymbolRoll]:
+        """
+        :return: the roll of the order if all its orders are filled now
+        """
+        key = str(order_id)
+        with self._lock:
+            roll = self._orders.pop(key, None)
+            if roll is None:
+                if self.is_rolling:
+                    self._early_fills.add(key)
+                return None
+            roll.orders.discard(int(key))
+            roll.n_pending -= 1
+            if roll.n_pending > 0:
+                return None
+        if not roll.filled.done():
+            roll.filled.set_result(True)
+        return roll
+
+    def on_rejected(self, order_id: Union[int, str]) -> Optional[SymbolRoll]:
+        """
+        :return: the roll of the order, which cannot complete any more
+        """
+        with self._lock:
+            roll = self._orders.pop(str(order_id), None)
+        if roll is not None and not roll.filled.done():
+            roll.filled.set_result(False)
+        return roll
+
+    def report(self) -> str:
+        parts = []
+        for r in self.rolls:
+            part = f'{r}: {r.state.value}'
+            if r.orders:
+                part += f', {len(r.orders)} order(s) outstanding'
+            if r.reason:
+                part += f', {r.reason}'
+            parts.append(f'{part} ({r.elapsed:.1f}s)')
+        return '; '.join(parts)
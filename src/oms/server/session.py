@@ -1,18 +1,24 @@
 import logging
+from collections import defaultdict
 from datetime import datetime, timedelta
 from enum import auto
 from threading import RLock
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
 import numpy as np
 import ujson
 
 import oms.common.message as m
+from oms.common.codec import Codec, choose_codec
 from gateway_lib import ExecutionUpdate
 from smartquant.common.market import Market
 from smartquant.common.utils.autoname import AutoName
 from smartquant.execution.base import Action, OrderType
 from .ledger.statement import TableOrder, TablePortfolio, TablePosition, TablePositionByEntry, TableOperation
+from .order import OrderRequest
+
+
+PositionKey = Tuple[str, str, str]
 
 
 class ClientSessionState(AutoName):
@@ -31,11 +37,15 @@ class ClientSession:
         self._next_request_id = None
         self._oms = oms
         self._orders: Dict[Any, int] = dict()
-        self._unsolicited_orders: List[int] = []
+        self._session_order_ids: Dict[int, Any] = dict()
+        self._unsolicited_orders: Set[int] = set()
         self._last_heartbeat_from_client: datetime = None
         self._next_heartbeat: datetime = datetime.now()
         self._lock = RLock()
-        self._last_stopcheck = datetime.now()
+        self._codec: Codec = None
+        self._position_delta = False
+        self._position_version = 0
+        self._position_state: Dict[PositionKey, Tuple[tuple, Dict[int, tuple]]] = dict()
 
         # TODO: populate self._orders from ledger
 
@@ -47,10 +57,7 @@ class ClientSession:
             for o in orders:
                 order_id = o[TableOrder.ORDER_ID]
                 broker_order_id = int(o[TableOrder.BROKER_ORDER_ID])
-                if order_id == 0:
-                    self._unsolicited_orders.append(broker_order_id)
-                else:
-                    self._orders[order_id] = broker_order_id
+                self._add_order(order_id, broker_order_id)
                 self._logger.info(
                     f'Session [{self.id}], add order: OMS order ID: {order_id}, broker order ID: {broker_order_id}')
         else:
@@ -59,6 +66,10 @@ class ClientSession:
     def __str__(self):
         return f'Session: {self.id}, Account: {self.account}, Next request ID: {self._next_request_id}'
 
+    @property
+    def broker_order_ids(self) -> List[int]:
+        return list(self._session_order_ids.keys()) + list(self._unsolicited_orders)
+
     def is_own_order(self, broker_order_id: int) -> bool:
         sid = self.find_session_order_id(broker_order_id)
         if sid is None:
@@ -66,7 +77,8 @@ class ClientSession:
         return True
 
     def notify_unsolicited_order(self, broker_order_id: int):
-        self._unsolicited_orders.append(broker_order_id)
+        if broker_order_id is not None:
+            self._add_order(0, broker_order_id)
 
     def place_order(self, session_order_id: int, market: Market, symbol: str,
         is_buy: bool, order_type: OrderType, quantity: int, price: float,
@@ -77,57 +89,102 @@ class ClientSession:
             self.publish_order_rejected(session_order_id, 'Gateway is down')
             return
 
-        if not self._oms.ledger.verify_account_portfolio_strategy(self.account, portfolio, strategy):
-            self.publish_order_rejected(session_order_id,
-                                        f"Either account: {self.account}/portfolio: {portfolio}/strategy: {strategy} doesn't exist in OMS database")
+        reason = self._check_order(market, symbol, is_buy, quantity, portfolio, strategy, comment)
+        if reason:
+            self.publish_order_rejected(session_order_id, reason)
             return
 
-        # reject incoming order request if its associated constraint is violated
-        constraint = comment.get(TableOrder.COMMENT_CONSTRAINT, None)
-        if constraint:
-            ledger = self._oms._ledger
+        def record(broker_id: str, broker_order_id: int):
+            self._record_order(session_order_id, broker_id, broker_order_id, market, symbol, is_buy, order_type,
+                               quantity, price, portfolio, action, strategy, reference, comment,
+                               session_parent_order_id)
+
+        _, broker_order_id = self._send_order(market, symbol, is_buy, order_type, quantity, price, portfolio, action,
+                                              strategy, comment, record)
+        if broker_order_id is None:
+            self._logger.warning(f'Order: {args} was not sent')
+
+    def place_orders(self, orders: List[m.OmsMessageNewOrderBatch.ItemOrder]):
+        """
+        Place the orders of a batch: every order is checked, with one lookup of each portfolio and strategy and of each
+        position, the accepted orders are recorded in one transaction and then sent to the brokers back to back. A
+        rejected order is replied with its request ID, it does not affect the other orders. If the transaction fails,
+        none of the orders is sent and all of them are rejected.
+        """
+        if not self._oms.is_ready():
+            for item in orders:
+                self.publish_order_rejected(item.request_id, 'Gateway is down')
+            return
+
+        verified: Dict[Tuple[str, str], bool] = dict()
+        positions: Dict[Tuple[str, str, str, str], Any] = dict()
+        quantities: Dict[Tuple[str, str, str, str], int] = defaultdict(int)
+        accepted = []
+        for item in orders:
             try:
-                row = ledger.query_position(portfolio_id=portfolio, strategy=strategy, market=market.value, symbol=symbol)[0]
-                current = row[TablePosition.POSITION]
-                projected = current + (quantity * (1 if is_buy else -1))
-                if ((constraint == TableOrder.Constraint.LONG_ONLY and projected < 0)
-                    or
-                    (constraint == TableOrder.Constraint.SHORT_ONLY and projected > 0)):
-                    self.publish_order_rejected(session_order_id,
-                        f"Violated '{constraint}' constraint with projected position equals {projected}")
-                    return
-            except IndexError:
-                # new strategy with no position record or misconfig will fallback to here
-                pass
+                market = Market[item.market]
+                order_type = OrderType[item.order_type]
+            except KeyError as e:
+                self.publish_order_rejected(item.request_id, f'Unknown market or order type {e}')
+                continue
+            comment = item.comment or dict()
+            reason = self._check_order(market, item.symbol, item.is_buy, item.quantity, item.portfolio, item.strategy,
+                                       comment, verified, positions, quantities)
+            if reason:
+                self.publish_order_rejected(item.request_id, reason)
+            else:
+                accepted.append((item, market, order_type, comment))
 
-        if session_parent_order_id is None:
-            session_parent_order_id = session_order_id
+        if not accepted:
+            return
 
-        if action == Action.EXIT.value:
-            self._pull_stop_orders(portfolio, strategy, market, symbol, quantity, comment)
+        requests = []
+        for item, market, order_type, comment in accepted:
+            requests.append(OrderRequest(market, item.symbol, order_type, item.is_buy, item.quantity, item.price,
+                                         comment.get(TableOrder.COMMENT_GOOD_TILL, '')))
 
-        good_till = comment.get(TableOrder.COMMENT_GOOD_TILL, "")
-        broker_id, broker_order_id = self._oms.place_order(market, symbol, order_type, is_buy, quantity, price, good_till=good_till)
+        recorded: List[Optional[Tuple[str, int]]] = []
 
-        if broker_order_id is not None:
-            self._orders[session_order_id] = broker_order_id
-            self._oms.ledger.insert_order(self._session_id, session_order_id, session_parent_order_id, broker_id,
-                                          broker_order_id, market, symbol, order_type, is_buy, quantity, price,
-                                          portfolio, action, strategy, reference, comment)
+        # the orders are sent once they are recorded, their executions can be received before `place_orders` returns
+        def record(order_ids: List[Optional[Tuple[str, int]]]):
+            added = []
+            try:
+                with self._oms.ledger.transaction():
+                    for (item, market, order_type, comment), order_id in zip(accepted, order_ids):
+                        if order_id is None:
+                            continue
+                        broker_id, broker_order_id = order_id
+                        added.append((item.request_id, broker_order_id))
+                        self._record_order(item.request_id, broker_id, broker_order_id, market, item.symbol,
+                                           item.is_buy, order_type, item.quantity, item.price, item.portfolio,
+                                           item.action, item.strategy, item.reference, comment)
+            except Exception:
+                # the transaction is rolled back, the orders are not sent
+                for session_order_id, broker_order_id in added:
+                    self._remove_order(session_order_id, broker_order_id)
+                raise
+            recorded.extend(order_ids)
+
+            # the stop orders are pulled once the exit orders are recorded, before they are sent
+            for item, market, order_type, comment in accepted:
+                if item.action == Action.EXIT.value:
+                    self._pull_stop_orders(item.portfolio, item.strategy, market, item.symbol, item.quantity, comment)
 
-            if action == Action.ENTRY.value:
-                try:
-                    order_ref = comment[TableOrder.COMMENT_ORDER_REFERENCE]
-                except KeyError:
-                    order_ref = None
-
-                if order_ref:
-                    self._logger.info(f'Found order reference in ENTRY order: {order_ref}, adding a row to position '
-                                      f'by entry table')
-                    self._oms.ledger.insert_position_by_entry(portfolio, strategy, market, symbol, quantity,
-                                                              self._session_id, session_order_id, order_ref)
-        else:
-            self._logger.warning(f'Order: {args} was not sent')
+        try:
+            sent = self._oms.place_orders(requests, record)
+        except Exception as e:
+            if recorded:
+                raise
+            # none of the orders is recorded or sent
+            self._logger.exception(f'Failed to record the orders of the batch')
+            for item, *_ in accepted:
+                self.publish_order_rejected(item.request_id, f'Order was not recorded: {e}')
+            return
+        self._logger.info(f'Sent {sum(s is not None for s in sent)} of {len(orders)} order(s) of the batch')
+        for (item, *_), order_id in zip(accepted, recorded):
+            # the orders recorded but not sent are rejected by the OMS
+            if order_id is None:
+                self.publish_order_rejected(item.request_id, 'Order was not sent, no broker is available')
 
     def place_stop(self, market: Market, symbol: str, is_buy: bool, quantity: int, price: float, portfolio: str,
                    strategy: str, parent_order_id: int, comment: Dict[str, str] = None):
@@ -135,36 +192,41 @@ class ClientSession:
                          strategy, None, comment, session_parent_order_id=parent_order_id)
 
     def process(self, message: m.OmsMessage):
-        with self._lock:
-            if hasattr(message, 'request_id'):
-                self._oms.ledger.increment_next_request_id(self._session_id)
+        """
+        Process a message of the client. Messages of a session are processed one at a time in the order they are
+        received, the OMS pins every session to one lane of its executor.
+        """
+        if hasattr(message, 'request_id'):
+            self._oms.ledger.increment_next_request_id(self._session_id)
+
+        if message.msg_type == m.MsgType.INIT:
+            return self.process_req_init(message)
+        elif message.msg_type == m.MsgType.NEXT_REQUEST_ID:
+            return self.process_req_next_request_id(message)
+        elif message.msg_type == m.MsgType.HEARTBEAT:
+            self._last_heartbeat_from_client = datetime.now()
+            return self.process_req_hearbeat(message)
+        else:
+            if not self.is_logged_in:
+                return self._build_error_reply(m.ErrorCode.NOT_LOGGED_IN, 'Session is not logged in yet')
+
+            reply = self._check_next_request_id(message.request_id)
+            if reply:
+                return reply
 
-            if message.msg_type == m.MsgType.INIT:
-                return self.process_req_init(message)
-            elif message.msg_type == m.MsgType.NEXT_REQUEST_ID:
-                return self.process_req_next_request_id(message)
+            if message.msg_type == m.MsgType.NEW_ORDER:
+                return self.process_req_new_order(message)
+            elif message.msg_type == m.MsgType.NEW_ORDER_BATCH:
+                return self.process_req_new_order_batch(message)
+            elif message.msg_type == m.MsgType.POSITION:
+                return self.process_req_position(message)
             elif message.msg_type == m.MsgType.HEARTBEAT:
-                self._last_heartbeat_from_client = datetime.now()
                 return self.process_req_hearbeat(message)
             else:
-                if not self.is_logged_in:
-                    return self._build_error_reply(m.ErrorCode.NOT_LOGGED_IN, 'Session is not logged in yet')
-
-                reply = self._check_next_request_id(message.request_id)
-                if reply:
-                    return reply
-
-                if message.msg_type == m.MsgType.NEW_ORDER:
-                    return self.process_req_new_order(message)
-                elif message.msg_type == m.MsgType.POSITION:
-                    return self.process_req_position(message)
-                elif message.msg_type == m.MsgType.HEARTBEAT:
-                    return self.process_req_hearbeat(message)
-                else:
-                    reply = m.OmsMessageError()
-                    reply.error_code = m.ErrorCode.SYSTEM_ERROR
-                    reply.message = f'Unknown message type {message.msg_type} received'
-                    return reply
+                reply = m.OmsMessageError()
+                reply.error_code = m.ErrorCode.SYSTEM_ERROR
+                reply.message = f'Unknown message type {message.msg_type} received'
+                return reply
 
     def process_req_init(self, message: m.OmsMessageInit):
         ledger = self._oms.ledger
@@ -181,6 +243,14 @@ class ClientSession:
                 self._account_id = aid
                 self._logger.info(f'Session {self.id} associated with account {self.account}')
 
+            if message.codecs:
+                self._codec = choose_codec(message.codecs)
+                self._logger.info(f'Session {self.id} uses codec {self._codec.name}')
+
+            self._position_delta = m.MsgType.POSITION_DELTA in (message.features or [])
+            if self._position_delta:
+                self._logger.info(f'Session {self.id} receives position deltas')
+
             strategies = message.strategies
 
             for strategy, portfolio in strategies.items():
@@ -205,18 +275,21 @@ class ClientSession:
                     reply.next_request_id = next_request_id
                 else:
                     self._logger.info(f'Received new session ID {session_id}, adding record')
-                    ledger.insert_session(session_id)
+                    # the session must be persisted before the client starts using request IDs
+                    ledger.insert_session(session_id).result()
                     reply = m.OmsMessageNextRequestId()
                     reply.next_request_id = 1
 
                 self._next_request_id = reply.next_request_id
+                if self._codec is not None:
+                    reply.codec = self._codec.name
                 return reply
             finally:
                 self._state = ClientSessionState.LOGGED_IN
         else:
             reply = m.OmsMessageError()
             reply.error_code = m.ErrorCode.ALREADY_LOGGED_IN
-            reply.msg = f'Session {self.id} is logged in already'
+            reply.message = f'Session {self.id} is logged in already'
             return reply
 
     def process_req_next_request_id(self, message: m.OmsMessageNextRequestId):
@@ -241,11 +314,25 @@ class ClientSession:
                          strategy, reference, comment)
         return None
 
+    def process_req_new_order_batch(self, message: m.OmsMessageNewOrderBatch):
+        # every order of the batch takes a request ID, besides the batch itself
+        if message.orders:
+            self._oms.ledger.increment_next_request_id(self._session_id, len(message.orders))
+        self.place_orders(message.orders)
+        return None
+
     def process_req_position(self, message: m.OmsMessagePosition):
-        return self._build_position_message(message.request_id)
+        # the snapshot is sent under the lock as the deltas are, a delta never overtakes the snapshot it is based on
+        with self._lock:
+            reply = self._build_position_message(message.request_id)
+            if self._position_delta:
+                # the snapshot is the new base of the deltas
+                self._position_state, _ = self._diff_position(reply)
+                reply.version = self._position_version
+            self._send_msg(reply)
 
     def process_req_hearbeat(self, message: m.OmsMessageHeartbeat):
-        self._logger.debug(f'Received heartbeat from client: {message}')
+        self._logger.debug('Received heartbeat from client: %s', message)
 
     def publish_execution(self, execution: ExecutionUpdate, order: dict):
         self._send_msg(self._build_execution_message(execution, order))
@@ -258,10 +345,10 @@ class ClientSession:
         self._send_msg(self._build_error_reply(m.ErrorCode.ORDER_REJECTED, msg, order_id))
 
     def publish_position(self):
-        self._send_msg(self._build_position_message())
+        self._publish_position()
 
     def publish_position_renew(self):
-        self._send_msg(self._build_position_message(force_renew=True))
+        self._publish_position(force_renew=True)
 
     def publish_next_request_id(self):
         self._send_msg(self._build_next_request_id_message())
@@ -276,9 +363,16 @@ class ClientSession:
         return msg
 
     def _send_msg(self, msg: m.OmsMessage):
-        reply = [self._src_id, msg.to_bytes()]
+        reply = [self._src_id, msg.encode(self._codec)]
         self._oms.publish_msg(reply)
 
+    @property
+    def codec(self) -> Codec:
+        """
+        Encoding negotiated with the client, `None` for JSON
+        """
+        return self._codec
+
     @property
     def account(self):
         return self._account_id
@@ -339,6 +433,10 @@ class ClientSession:
         return reply
 
     def _build_position_message(self, request_id: int = None, force_renew: bool = False):
+        """
+        Position tree of the strategy of this session in every portfolio of its account. The tree is assembled from
+        a fixed number of queries, whatever the number of positions, entries and operations.
+        """
         ledger = self._oms.ledger
 
         reply = m.OmsMessagePosition()
@@ -351,64 +449,136 @@ class ClientSession:
         reply.account.cash = cash
         reply.account.currency = currency
 
-        portfolios = self._oms.ledger.query_portfolio(account_id=self.account)
-        for p in portfolios:
-            portfolio_id = p[TablePortfolio.ID]
-
+        operations = defaultdict(list)
+        for op in ledger.query_operation_by_account(self.account, self._session_id):
+            key = (op.pop(TableOperation.PORTFOLIO_ID), op.pop(TableOperation.ORDER_REFERENCE))
+            operations[key].append(op)
+
+        entries = defaultdict(list)
+        for ep in ledger.query_position_by_entry_by_account(self.account, self._session_id):
+            portfolio_id = ep[TablePositionByEntry.PORTFOLIO_ID]
+            market = ep[TablePositionByEntry.MARKET]
+            symbol = ep[TablePositionByEntry.SYMBOL]
+
+            msg_position_by_entry = m.OmsMessagePosition.ItemPositionByEntry()
+            msg_position_by_entry.position = ep[TablePositionByEntry.POSITION]
+            msg_position_by_entry.avg_price = ep[TablePositionByEntry.AVG_PRICE]
+            msg_position_by_entry.state = ep[TablePositionByEntry.STATE]
+            msg_position_by_entry.created = ep[TablePositionByEntry.CREATED]
+            entry_operations = operations.get((portfolio_id, ep[TablePositionByEntry.ORDER_REFERENCE]))
+            if entry_operations:
+                msg_position_by_entry.operations = entry_operations
+            entry_order = m.OmsMessagePosition.ItemOrder()
+            entry_order.order_id = ep[TableOrder.ORDER_ID]
+            entry_order.market = market
+            entry_order.symbol = symbol
+            entry_order.order_type = ep[TableOrder.TYPE]
+            entry_order.is_buy = ep[TableOrder.IS_BUY]
+            entry_order.quantity = ep[TableOrder.QUANTITY]
+            entry_order.price = ep[TableOrder.PRICE]
+            entry_order.portfolio = portfolio_id
+            entry_order.action = ep[TableOrder.ACTION]
+            entry_order.strategy = self._session_id
+            entry_order.reference = ep[TableOrder.REFERENCE]
+            try:
+                entry_order.comment = ujson.loads(ep[TableOrder.COMMENT])
+            except TypeError:
+                entry_order.comment = None
+            msg_position_by_entry.order = entry_order
+            entries[(portfolio_id, market, symbol)].append(msg_position_by_entry)
+
+        positions = defaultdict(list)
+        for pos in ledger.query_position_by_account(self.account, self._session_id):
+            msg_position = m.OmsMessagePosition.ItemPosition()
+            msg_position.strategy = pos[TablePosition.STRATEGY]
+            msg_position.market = pos[TablePosition.MARKET]
+            msg_position.symbol = pos[TablePosition.SYMBOL]
+            msg_position.position = pos[TablePosition.POSITION]
+            msg_position.avg_price = pos[TablePosition.AVG_PRICE]
+            msg_position.force_renew = force_renew
+            portfolio_id = pos[TablePosition.PORTFOLIO_ID]
+            msg_position.positions_by_entry = entries.get((portfolio_id, msg_position.market, msg_position.symbol),
+                                                          list())
+            positions[portfolio_id].append(msg_position)
+
+        for p in ledger.query_portfolio(account_id=self.account):
             msg_portfolio = m.OmsMessagePosition.ItemPortfolio()
-            msg_portfolio.id = portfolio_id
-
-            positions = ledger.query_position(portfolio_id)
-            for pos in positions:
-                strategy = pos[TablePosition.STRATEGY]
-                if strategy != self._session_id:
-                    continue
-
-                msg_position = m.OmsMessagePosition.ItemPosition()
-                msg_position.strategy = strategy
-                msg_position.market = pos[TablePosition.MARKET]
-                msg_position.symbol = pos[TablePosition.SYMBOL]
-                msg_position.position = pos[TablePosition.POSITION]
-                msg_position.avg_price = pos[TablePosition.AVG_PRICE]
-                msg_position.force_renew = force_renew
-                msg_portfolio.positions.append(msg_position)
-
-                entry_pos = ledger.query_position_by_entry(portfolio_id, strategy, msg_position.market,
-                                                           msg_position.symbol)
-                msg_position.positions_by_entry = list()
-                for ep in entry_pos:
-                    msg_position_by_entry = m.OmsMessagePosition.ItemPositionByEntry()
-                    msg_position_by_entry.position = ep[TablePositionByEntry.POSITION]
-                    msg_position_by_entry.avg_price = ep[TablePositionByEntry.AVG_PRICE]
-                    msg_position_by_entry.state = ep[TablePositionByEntry.STATE]
-                    msg_position_by_entry.created = ep[TablePositionByEntry.CREATED]
-                    operations = ledger.query_operation(portfolio_id, strategy, ep[TablePositionByEntry.ORDER_REFERENCE])
-                    if operations:
-                        self._logger.info(f'Found operations from {ep[TablePositionByEntry.ORDER_REFERENCE]}, {str(operations)}')
-                        msg_position_by_entry.operations = operations
-                    entry_order = m.OmsMessagePosition.ItemOrder()
-                    entry_order.order_id = ep[TableOrder.ORDER_ID]
-                    entry_order.market = msg_position.market
-                    entry_order.symbol = msg_position.symbol
-                    entry_order.order_type = ep[TableOrder.TYPE]
-                    entry_order.is_buy = ep[TableOrder.IS_BUY]
-                    entry_order.quantity = ep[TableOrder.QUANTITY]
-                    entry_order.price = ep[TableOrder.PRICE]
-                    entry_order.portfolio = portfolio_id
-                    entry_order.action = ep[TableOrder.ACTION]
-                    entry_order.strategy = strategy
-                    entry_order.reference = ep[TableOrder.REFERENCE]
-                    try:
-                        entry_order.comment = ujson.loads(ep[TableOrder.COMMENT])
-                    except TypeError:
-                        entry_order.comment = None
-                    msg_position_by_entry.order = entry_order
-
-                    msg_position.positions_by_entry.append(msg_position_by_entry)
+            msg_portfolio.id = p[TablePortfolio.ID]
+            msg_portfolio.positions = positions.get(msg_portfolio.id, list())
             reply.account.portfolios.append(msg_portfolio)
 
         return reply
 
+    def _publish_position(self, force_renew: bool = False):
+        with self._lock:
+            if not self._position_delta:
+                self._send_msg(self._build_position_message(force_renew=force_renew))
+                return
+
+            snapshot = self._build_position_message(force_renew=force_renew)
+            self._position_state, items = self._diff_position(snapshot)
+            if not items:
+                self._logger.debug(f'No position change for session {self.id}')
+                return
+
+            reply = m.OmsMessagePositionDelta()
+            reply.base_version = self._position_version
+            self._position_version += 1
+            reply.version = self._position_version
+            reply.account = snapshot.account.id
+            reply.cash = snapshot.account.cash
+            reply.currency = snapshot.account.currency
+            reply.positions = items
+            self._send_msg(reply)
+
+    def _diff_position(self, snapshot: m.OmsMessagePosition):
+        """
+        Compare a position message with the state last sent to the client, the positions to renew are always sent
+
+        :return: the state of the snapshot, and the positions which differ from the state last sent
+        """
+        state = dict()
+        items = []
+        for portfolio in snapshot.account.portfolios:
+            for position in portfolio.positions:
+                key = (portfolio.id, position.market, position.symbol)
+                signature = (position.strategy, position.position, position.avg_price)
+                entries = {e.order.order_id: (self._entry_signature(e), e) for e in position.positions_by_entry}
+                state[key] = (signature, {order_id: sig for order_id, (sig, _) in entries.items()})
+
+                last_signature, last_entries = self._position_state.get(key, (None, dict()))
+                changed = [e for order_id, (sig, e) in entries.items() if last_entries.get(order_id) != sig]
+                removed = [order_id for order_id in last_entries if order_id not in entries]
+                if signature != last_signature or changed or removed or position.force_renew:
+                    item = m.OmsMessagePositionDelta.ItemPosition()
+                    item.portfolio = portfolio.id
+                    item.strategy = position.strategy
+                    item.market = position.market
+                    item.symbol = position.symbol
+                    item.position = position.position
+                    item.avg_price = position.avg_price
+                    item.force_renew = position.force_renew
+                    item.positions_by_entry = changed
+                    item.removed_order_ids = removed
+                    items.append(item)
+
+        for portfolio_id, market, symbol in self._position_state.keys() - state.keys():
+            item = m.OmsMessagePositionDelta.ItemPosition()
+            item.portfolio = portfolio_id
+            item.strategy = self._session_id
+            item.market = market
+            item.symbol = symbol
+            item.positions_by_entry = []
+            item.is_removed = True
+            items.append(item)
+        return state, items
+
+    @staticmethod
+    def _entry_signature(entry: m.OmsMessagePosition.ItemPositionByEntry) -> tuple:
+        operations = tuple(tuple(sorted(op.items())) for op in entry.operations or [])
+        return (entry.position, entry.avg_price, entry.state, entry.created, entry.order.quantity, entry.order.price,
+                operations)
+
     def _build_next_request_id_message(self):
         ledger = self._oms.ledger
         _, next_request_id, _ = ledger.query_session(self.id)
@@ -424,13 +594,108 @@ class ClientSession:
         return None
 
     def find_session_order_id(self, broker_order_id: int):
-        for sid, bid in self._orders.items():
-            if bid == broker_order_id:
-                return sid
+        sid = self._session_order_ids.get(broker_order_id)
+        if sid is not None:
+            return sid
         if broker_order_id in self._unsolicited_orders:
             return 0
         return None
 
+    def _add_order(self, session_order_id, broker_order_id: int):
+        if session_order_id == 0:
+            self._unsolicited_orders.add(broker_order_id)
+        else:
+            self._orders[session_order_id] = broker_order_id
+            self._session_order_ids[broker_order_id] = session_order_id
+        self._oms.register_order(broker_order_id, self, session_order_id)
+
+    def _remove_order(self, session_order_id, broker_order_id: int):
+        if session_order_id == 0:
+            self._unsolicited_orders.discard(broker_order_id)
+        else:
+            self._orders.pop(session_order_id, None)
+            self._session_order_ids.pop(broker_order_id, None)
+        self._oms.unregister_order(broker_order_id, self)
+
+    def _check_order(self, market: Market, symbol: str, is_buy: bool, quantity: int, portfolio: str, strategy: str,
+                     comment: Dict[str, str], verified: Dict[Tuple[str, str], bool] = None,
+                     positions: Dict[Tuple[str, str, str, str], Any] = None,
+                     quantities: Dict[Tuple[str, str, str, str], int] = None) -> Optional[str]:
+        """
+        :param verified: portfolios and strategies looked up already, by the orders of a batch
+        :param positions: positions looked up already, by the orders of a batch
+        :param quantities: net quantity of the orders of a batch accepted already, the order is added if it is accepted
+        :return: the reason to reject the order, None if it can be sent
+        """
+        verified = verified if verified is not None else dict()
+        positions = positions if positions is not None else dict()
+        quantities = quantities if quantities is not None else defaultdict(int)
+        ledger = self._oms.ledger
+
+        if (portfolio, strategy) not in verified:
+            verified[(portfolio, strategy)] = ledger.verify_account_portfolio_strategy(self.account, portfolio,
+                                                                                        strategy)
+        if not verified[(portfolio, strategy)]:
+            return (f"Either account: {self.account}/portfolio: {portfolio}/strategy: {strategy} doesn't exist in OMS "
+                    f"database")
+
+        # reject incoming order request if its associated constraint is violated
+        constraint = comment.get(TableOrder.COMMENT_CONSTRAINT, None)
+        key = (portfolio, strategy, market.value, symbol)
+        signed_quantity = quantity * (1 if is_buy else -1)
+        if constraint:
+            if key not in positions:
+                rows = ledger.query_position(portfolio_id=portfolio, strategy=strategy, market=market.value,
+                                             symbol=symbol)
+                # new strategy with no position record or misconfig will fallback to here
+                positions[key] = rows[0][TablePosition.POSITION] if rows else None
+            current = positions[key]
+            if current is not None:
+                # the orders of the batch accepted before this one are projected as well
+                projected = current + quantities[key] + signed_quantity
+                if ((constraint == TableOrder.Constraint.LONG_ONLY and projected < 0)
+                    or
+                    (constraint == TableOrder.Constraint.SHORT_ONLY and projected > 0)):
+                    return f"Violated '{constraint}' constraint with projected position equals {projected}"
+        quantities[key] += signed_quantity
+        return None
+
+    def _send_order(self, market: Market, symbol: str, is_buy: bool, order_type: OrderType, quantity: int,
+                    price: float, portfolio: str, action: str, strategy: str, comment: Dict[str, str],
+                    record: Callable[[str, int], None]) -> Tuple[Optional[str], Optional[int]]:
+        """
+        :param record: records the order before it is sent, see `Oms.place_order`
+        """
+        if action == Action.EXIT.value:
+            self._pull_stop_orders(portfolio, strategy, market, symbol, quantity, comment)
+
+        good_till = comment.get(TableOrder.COMMENT_GOOD_TILL, "")
+        return self._oms.place_order(market, symbol, order_type, is_buy, quantity, price, good_till=good_till,
+                                     record=record)
+
+    def _record_order(self, session_order_id: int, broker_id: str, broker_order_id: int, market: Market, symbol: str,
+                      is_buy: bool, order_type: OrderType, quantity: int, price: float, portfolio: str, action: str,
+                      strategy: str, reference: str, comment: Dict[str, str], session_parent_order_id: int = None):
+        if session_parent_order_id is None:
+            session_parent_order_id = session_order_id
+
+        self._add_order(session_order_id, broker_order_id)
+        self._oms.ledger.insert_order(self._session_id, session_order_id, session_parent_order_id, broker_id,
+                                      broker_order_id, market, symbol, order_type, is_buy, quantity, price,
+                                      portfolio, action, strategy, reference, comment)
+
+        if action == Action.ENTRY.value:
+            try:
+                order_ref = comment[TableOrder.COMMENT_ORDER_REFERENCE]
+            except KeyError:
+                order_ref = None
+
+            if order_ref:
+                self._logger.info(f'Found order reference in ENTRY order: {order_ref}, adding a row to position '
+                                  f'by entry table')
+                self._oms.ledger.insert_position_by_entry(portfolio, strategy, market, symbol, quantity,
+                                                          self._session_id, session_order_id, order_ref)
+
     def _invalidate(self):
         self._last_heartbeat_from_client = datetime.min
 
@@ -461,7 +726,7 @@ class ClientSession:
                 o = orders[-1]
                 order_id = o[TableOrder.BROKER_ORDER_ID]
                 self._logger.info(f'Remove stop-loss order: {order_id}')
-                self._oms.get_broker().cancel_order(order_id)
+                self._oms.cancel_order(o[TableOrder.BROKER_ID], order_id)
             else:
                 self._logger.error(f'Fail to remove stop-loss order: order was missed for {portfolio}/{symbol}/{strategy}')
         else:
@@ -477,38 +742,10 @@ class ClientSession:
                     if o_ref == stp_order_ref:
                         order_id = o[TableOrder.BROKER_ORDER_ID]
                         self._logger.info(f'Remove stop-loss order: {order_id}, {o_ref}')
-                        self._oms.get_broker().cancel_order(order_id)
+                        self._oms.cancel_order(o[TableOrder.BROKER_ID], order_id)
                         removed.append(o_ref)
 
                 not_pulled = np.setdiff1d(order_ref_list, removed)
                 if len(not_pulled) != 0:
                     self._logger.info(f'OMS did not find any stop-loss order with the following order reference: '
                                       f'{not_pulled} when handling exit')
-
-    def require_stop_check(self):
-        return datetime.now() - self._last_stopcheck > timedelta(minutes=5)
-
-    def validate_stop_orders(self):
-        # assume all positions must be covered by STP orders.
-        self._last_stopcheck = datetime.now()
-        strategyName = self._session_id
-        ledger = self._oms._ledger
-        positions = ledger.query_position(strategy=strategyName)
-        for record in positions:
-            pos = record[TablePosition.POSITION]
-            portfolio = record[TablePosition.PORTFOLIO_ID]
-            if pos != 0:
-                # assume strategy use STP order solely to control risk
-                orders = ledger.query_order(
-                    portfolio=portfolio,
-                    session_id=strategyName,
-                    order_type=OrderType.STP,
-                    active_orders_only=True)
-                stpQty = 0
-                for order in orders:
-                    # assume strategy trades the same symbol
-                    direction = -1 if order[TableOrder.IS_BUY] == 1 else 1
-                    stpQty += int(order[TableOrder.QUANTITY]) * direction
-                if pos != stpQty:
-                    return f"Stop order check failed for strategy '{strategyName}'. Strategy position is {pos} but the total STP order quantity is {-stpQty}"
-        return ""
\ No newline at end of file
@@ -0,0 +1,42 @@
+from types import SimpleNamespace
+
+import gateway_lib as gl
+from oms.server.contracts import ContractTable
+from smartquant.common.market import Market
+
+
+def create_instrument(symbol: str, front_month: str):
+    return SimpleNamespace(market=Market.GLOBEX, symbol=symbol, front_month=SimpleNamespace(symbol=front_month))
+
+
+class TestContractTable:
+    def test_resolve(self):
+        instruments = [create_instrument('NQ', 'NQH1'), create_instrument('ES', 'ESH1')]
+        table = ContractTable(lambda: instruments)
+
+        contract = table.resolve(Market.GLOBEX, 'NQ')
+        assert contract.symbol == 'NQH1'
+        assert contract.instrument is instruments[0]
+        assert contract.order_fields == dict(symbol='NQH1', exchange=gl.Exchange.GLOBEX,
+                                             contractType=gl.ContractType.Future)
+        assert table.instrument(Market.GLOBEX, 'ES') is instruments[1]
+        assert len(table) == 2
+
+        # a contract code is sent as is
+        contract = table.resolve(Market.GLOBEX, 'NQM1')
+        assert (contract.symbol, contract.instrument) == ('NQM1', None)
+
+    def test_rebuild(self):
+        instruments = [create_instrument('NQ', 'NQH1')]
+        table = ContractTable(lambda: instruments)
+        assert table.resolve(Market.GLOBEX, 'NQ').symbol == 'NQH1'
+
+        instruments[0].front_month.symbol = 'NQM1'
+        assert table.resolve(Market.GLOBEX, 'NQ').symbol == 'NQH1'
+        table.rebuild()
+        assert table.resolve(Market.GLOBEX, 'NQ').symbol == 'NQM1'
+
+        # the table expires at midnight
+        instruments[0].front_month.symbol = 'NQU1'
+        table._expires = 0
+        assert table.resolve(Market.GLOBEX, 'NQ').symbol == 'NQU1'
@@ -0,0 +1,34 @@
+import threading
+import time
+
+import pytest
+
+from oms.server.executor import ShardedExecutor
+
+
+class TestShardedExecutor:
+    def test_lane_of(self):
+        with ShardedExecutor(4) as executor:
+            assert executor.lane_of(b'client_000') == executor.lane_of(b'client_000')
+            assert executor.lane_of('client_000') == executor.lane_of(b'client_000')
+            assert 0 <= executor.lane_of(b'client_001') < executor.n_lanes
+
+    def test_submit_to_keeps_order_of_key(self):
+        results = []
+
+        def task(i):
+            # the earlier tasks are slower, they would finish last if the tasks of the key ran in parallel
+            time.sleep(0.001 * (10 - i))
+            results.append((i, threading.current_thread().name))
+
+        with ShardedExecutor(4) as executor:
+            futures = [executor.submit_to(b'client_000', task, i) for i in range(10)]
+            for f in futures:
+                f.result()
+
+        assert [i for i, _ in results] == list(range(10))
+        assert len({name for _, name in results}) == 1
+
+    def test_invalid_number_of_lanes(self):
+        with pytest.raises(ValueError):
+            ShardedExecutor(0)
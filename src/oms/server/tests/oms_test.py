@@ -0,0 +1,165 @@
+import time
+from collections import OrderedDict
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+import gateway_lib as gl
+from oms.server.ledger.sqlite import DbSqlite
+from oms.server.ledger.statement import TableOrder, TablePosition
+from oms.server.oms import Oms
+from oms.server.order import OrderRequest
+from smartquant.common.market import Market
+from smartquant.execution.base import Action, OrderState, OrderType
+
+
+def create_oms(**broker_options) -> Oms:
+    broker = OrderedDict(name='sim', type='simulated', client_id=1, reconnect_interval_in_sec=0,
+                         prices={'NQH1': 7000}, tick_interval_in_ms=0, seed=1)
+    broker.update(broker_options)
+    config = OrderedDict()
+    config['messaging'] = {'oms': {'num_of_workers': 1}}
+    config['ledger'] = {'sqlite': {'scripts': [str(Path(DbSqlite.DEFAULT_SCHEMA).with_name('setup.samples.sqlite.sql'))]}}
+    config['brokers'] = [broker]
+    return Oms(config)
+
+
+def wait_for(condition, timeout: float = 2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def oms():
+    oms = create_oms()
+    oms.ledger.insert_strategy('strategy_001')
+    oms._brokers['sim'].connect()
+    wait_for(oms.is_ready)
+    yield oms
+    oms._brokers['sim'].gateway.close()
+    oms.ledger.close()
+
+
+def test_handle_simulated_execution(oms):
+    ledger = oms.ledger
+    ledger.insert_order('session_001', 1, 1, 'sim', '101', 'GLOBEX', 'NQH1', OrderType.MKT, False, 2, 0, 'WRCP001',
+                        Action.EXIT.value, 'strategy_001', None, {'order_reference': 'ref_001'})
+    order = gl.Order(symbol='NQH1', orderType=int(gl.OrderType.MKT), action=int(gl.OrderAction.SELL), quantity=2,
+                     limit_price=None, stop_price=None)
+    oms._brokers['sim'].place_order('101', order)
+
+    def filled():
+        return ledger.query_order('sim', broker_order_id='101')[0][TableOrder.STATE] == 'FULLY_FILLED'
+    wait_for(filled)
+
+    positions = ledger.query_position(portfolio_id='WRCP001', strategy='strategy_001')
+    assert [p[TablePosition.POSITION] for p in positions] == [-2]
+    assert oms._brokers['sim'].n_outstanding == 0
+
+
+def test_handle_roll_execution(oms):
+    ledger = oms.ledger
+    ledger.insert_strategy(Oms.STRATEGY_NAME)
+    ledger.insert_order(Oms.STRATEGY_NAME, 0, 0, 'sim', '102', 'GLOBEX', 'NQH1', OrderType.MKT, True, 1, 0, 'WRCP001',
+                        Action.ROLL.value, Oms.STRATEGY_NAME, None, None)
+    broker = oms._brokers['sim']
+    # in case there is no order update, e.g. the order is filled when disconnected, the execution completes the order
+    broker.gateway.events._callbacks['order_update'].clear()
+    order = gl.Order(symbol='NQH1', orderType=int(gl.OrderType.MKT), action=int(gl.OrderAction.BUY), quantity=1,
+                     limit_price=None, stop_price=None)
+    broker.place_order('102', order)
+    wait_for(lambda: broker.n_outstanding == 0)
+    # the roll orders do not change the position of the strategies
+    assert ledger.query_position(portfolio_id='WRCP001', strategy=Oms.STRATEGY_NAME) == []
+
+
+def test_roll_order_filled_when_sent(oms):
+    oms.ledger.insert_strategy(Oms.STRATEGY_NAME)
+    gateway = oms._brokers['sim'].gateway
+    schedule_in = gateway._schedule_in
+
+    def run_now(delay, fn, *args):
+        # the order is accepted and filled before `place_order` returns
+        if fn in (gateway._accept, gateway._execute):
+            fn(*args)
+        else:
+            schedule_in(delay, fn, *args)
+    gateway._schedule_in = run_now
+
+    instrument = SimpleNamespace(market=Market.GLOBEX, symbol='NQ', front_month=SimpleNamespace(symbol='NQM1'))
+    roll, = oms._rolls.start([('NQH1', instrument)])
+    roll.expect(1)
+    oms._send_roll_order(roll, 'NQH1', False, 1, 'WRCP001')
+    assert roll.filled.result(timeout=1) is True
+    # the order is done before `place_order` returns, it is not left outstanding
+    assert oms._brokers['sim'].n_outstanding == 0
+
+
+def test_roll_order_not_sent(oms):
+    oms.ledger.insert_strategy(Oms.STRATEGY_NAME)
+    gateway = oms._brokers['sim'].gateway
+
+    def place_order(order_ref, order):
+        # the connection is lost while the order is sent
+        raise BrokenPipeError(f'Simulated gateway {gateway.name} is disconnected')
+    gateway.place_order = place_order
+
+    instrument = SimpleNamespace(market=Market.GLOBEX, symbol='NQ', front_month=SimpleNamespace(symbol='NQM1'))
+    roll, = oms._rolls.start([('NQH1', instrument)])
+    roll.expect(1)
+    with pytest.raises(RuntimeError):
+        oms._send_roll_order(roll, 'NQH1', False, 1, 'WRCP001')
+    assert roll.filled.result(timeout=1) is False
+    orders = oms.ledger.query_order(strategy=Oms.STRATEGY_NAME)
+    assert [o[TableOrder.STATE] for o in orders] == [OrderState.REJECTED.value]
+
+
+def test_place_orders_not_sent(oms):
+    ledger = oms.ledger
+    gateway = oms._brokers['sim'].gateway
+    place_order = gateway.place_order
+    sent = []
+
+    def place_order_once(order_ref, order):
+        if order.quantity > 1:
+            raise BrokenPipeError(f'Simulated gateway {gateway.name} is disconnected')
+        place_order(order_ref, order)
+        sent.append(order_ref)
+    gateway.place_order = place_order_once
+
+    def record(order_ids):
+        # the orders are recorded once they have an ID, before any is sent
+        assert sent == []
+        with ledger.transaction():
+            for i, (broker_id, broker_order_id) in enumerate(order_ids, 1):
+                ledger.insert_order('session_001', i, i, broker_id, broker_order_id, 'GLOBEX', 'NQH1', OrderType.LMT,
+                                    True, i, 6000, 'WRCP001', Action.ENTRY.value, 'strategy_001', None, None)
+
+    requests = [OrderRequest(Market.GLOBEX, 'NQH1', OrderType.LMT, True, quantity, 6000) for quantity in (1, 2)]
+    first, second = oms.place_orders(requests, record)
+    assert first[0] == 'sim' and second is None
+    orders = {o[TableOrder.ORDER_ID]: o for o in ledger.query_order('sim')}
+    assert orders[1][TableOrder.BROKER_ORDER_ID] == str(first[1])
+    assert orders[1][TableOrder.STATE] != OrderState.REJECTED.value
+    assert orders[2][TableOrder.STATE] == OrderState.REJECTED.value
+
+
+def test_place_stop_recorded_before_sent(oms):
+    ledger = oms.ledger
+    gateway = oms._brokers['sim'].gateway
+    place_order = gateway.place_order
+    recorded = []
+
+    def place_order_recorded(order_ref, order):
+        # the stop order can be updated before `place_order` returns
+        recorded.append(len(ledger.query_order('sim', broker_order_id=order_ref)))
+        place_order(order_ref, order)
+    gateway.place_order = place_order_recorded
+
+    oms._place_stop('session_001', Market.GLOBEX, 'NQH1', False, 1, 6000, 'WRCP001', 'strategy_001', 1)
+    assert recorded == [1]
+    orders = ledger.query_order('sim', action=Action.STOP_LOSS)
+    assert [o[TableOrder.PARENT_ORDER_ID] for o in orders] == [1]
@@ -0,0 +1,28 @@
+from types import SimpleNamespace
+
+from oms.server.ledger.statement import TableOrder
+from oms.server.reconcile import diff_open_orders
+
+
+def create_order(broker_order_id: str, filled: int = None, remaining: int = None):
+    return {TableOrder.BROKER_ID: 'ibtws', TableOrder.BROKER_ORDER_ID: broker_order_id,
+            TableOrder.FILLED_QUANTITY: filled, TableOrder.REMAINING_QUANTITY: remaining}
+
+
+class TestDiffOpenOrders:
+    def test_diff(self):
+        open_orders = [SimpleNamespace(gateway_id='ibtws', order_ref='101'),
+                       SimpleNamespace(gateway_id='ibtws', order_ref=None),
+                       SimpleNamespace(gateway_id='other', order_ref='103')]
+        orders = [create_order('101', 0, 2), create_order('102', 0, 2), create_order('103'),
+                  create_order('104', 1, 1), create_order('105', 2, 0)]
+
+        diff = diff_open_orders(open_orders, orders)
+        assert [o[TableOrder.BROKER_ORDER_ID] for o in diff.cancelled] == ['102', '103']
+        assert [o[TableOrder.BROKER_ORDER_ID] for o in diff.partially_filled] == ['104']
+        assert diff
+
+    def test_no_diff(self):
+        open_orders = [SimpleNamespace(gateway_id='ibtws', order_ref=str(i)) for i in range(1000)]
+        orders = [create_order(str(i), 0, 1) for i in range(1000)]
+        assert not diff_open_orders(open_orders, orders)
@@ -0,0 +1,65 @@
+from types import SimpleNamespace
+
+from oms.server.roll import RollState, RollTracker
+
+
+def create_instrument(symbol: str, front_month: str):
+    return SimpleNamespace(symbol=symbol, front_month=SimpleNamespace(symbol=front_month))
+
+
+class TestRollTracker:
+    def test_filled(self):
+        tracker = RollTracker()
+        nq, es = tracker.start([('NQH1', create_instrument('NQ', 'NQM1')), ('ESH1', create_instrument('ES', 'ESM1'))])
+        assert tracker.is_rolling
+
+        nq.expect(2)
+        tracker.add_order(nq, 101)
+        tracker.add_order(nq, 102)
+        assert tracker.on_filled('101') is None
+        assert not nq.filled.done()
+        assert tracker.on_filled(102) is nq
+        assert nq.filled.result() is True
+
+        # a fill of an unknown order is ignored
+        assert tracker.on_filled(999) is None
+
+        nq.finish(RollState.DONE)
+        es.finish(RollState.SKIPPED, 'no roll instruction')
+        assert not tracker.is_rolling
+        assert es.filled.result() is False
+
+    def test_filled_before_added(self):
+        tracker = RollTracker()
+        roll, = tracker.start([('NQH1', create_instrument('NQ', 'NQM1'))])
+        roll.expect(2)
+        tracker.add_order(roll, 101)
+        assert tracker.on_filled(102) is None
+        tracker.add_order(roll, 102)
+        assert not roll.filled.done()
+
+        tracker.on_filled(101)
+        assert roll.filled.result() is True
+
+    def test_rejected(self):
+        tracker = RollTracker()
+        roll, = tracker.start([('NQH1', create_instrument('NQ', 'NQM1'))])
+        roll.expect(2)
+        tracker.add_order(roll, 101)
+        assert tracker.on_rejected('101') is roll
+        assert roll.filled.result() is False
+        assert tracker.on_rejected('101') is None
+
+    def test_report(self):
+        clock = SimpleNamespace(t=0.0)
+        tracker = RollTracker(lambda: clock.t)
+        nq, es = tracker.start([('NQH1', create_instrument('NQ', 'NQM1')), ('ESH1', create_instrument('ES', 'ESM1'))])
+        nq.state = RollState.ROLLING_POSITION
+        nq.expect(2)
+        tracker.add_order(nq, 101)
+        clock.t = 2.0
+        es.finish(RollState.SKIPPED, 'no roll instruction')
+        clock.t = 5.0
+
+        assert tracker.report() == ('NQ NQH1 -> NQM1: rolling position, 1 order(s) outstanding (5.0s); '
+                                    'ES ESH1 -> ESM1: skipped, no roll instruction (2.0s)')
@@ -1,38 +1,237 @@
-# from collections import OrderedDict
-#
-# import pytest
-# import ujson
-#
-# from oms.server.ledger.factory import LedgerFactory
-# from oms.server.session import ClientSession
-#
-#
-# class MockOms:
-#     def __init__(self):
-#         config = OrderedDict()
-#
-#         mysql_cfg = OrderedDict()
-#         mysql_cfg['host'] = '127.0.0.1'
-#         mysql_cfg['database'] = 'oms'
-#         mysql_cfg['user'] = 'root'
-#         mysql_cfg['password'] = 'Waverider1!'
-#
-#         db_cfg = OrderedDict()
-#         db_cfg['mysql'] = mysql_cfg
-#
-#         config['ledger'] = db_cfg
-#
-#         self.ledger = LedgerFactory.create_ledger(config)
-#
-#
-# @pytest.fixture
-# def mock_oms():
-#     return MockOms()
-#
-#
-# @pytest.mark.skip(reason="avoid MySQL tests in CI")
-# def test__build_position_message(mock_oms):
-#     session = ClientSession('Client_Session_001', '0b01', mock_oms)
-#     session._account_id = 'dev_account'
-#     msg = session._build_position_message()
-#     assert False, ujson.dumps(msg)
+from collections import OrderedDict
+from decimal import Decimal
+from pathlib import Path
+
+import pytest
+
+from oms.common.message import ErrorCode, Msg, MsgType, OmsMessage
+from oms.server.ledger.factory import LedgerFactory
+from oms.server.ledger.sqlite import DbSqlite
+from oms.server.ledger.statement import TableOrder
+from oms.server.order import OrderRequest
+from oms.server.session import ClientSession, ClientSessionState
+from smartquant.execution.base import Action, OrderType
+
+
+class MockOms:
+    def __init__(self):
+        config = OrderedDict()
+
+        sqlite_cfg = OrderedDict()
+        sqlite_cfg['scripts'] = [str(Path(DbSqlite.DEFAULT_SCHEMA).with_name('setup.samples.sqlite.sql'))]
+
+        db_cfg = OrderedDict()
+        db_cfg['sqlite'] = sqlite_cfg
+
+        config['ledger'] = db_cfg
+
+        self.ledger = LedgerFactory.create_ledger(config)
+        self.orders = dict()
+        self.sent = []
+        self.published = []
+
+    def is_ready(self):
+        return True
+
+    def place_order(self, market, symbol, order_type, is_buy, quantity, price, good_till='', record=None):
+        sent, = self.place_orders([OrderRequest(market, symbol, order_type, is_buy, quantity, price, good_till)],
+                                  (lambda order_ids: record(*order_ids[0])) if record is not None else None)
+        return sent
+
+    def place_orders(self, requests, record=None):
+        order_ids = [('broker_001', 1001 + len(self.sent) + i) for i in range(len(requests))]
+        if record is not None:
+            record(order_ids)
+        for request, (broker_id, broker_order_id) in zip(requests, order_ids):
+            # the orders are recorded before they are sent
+            assert record is None or self.ledger.query_order(broker_id, broker_order_id=str(broker_order_id))
+            self.sent.append(request.symbol)
+        return order_ids
+
+    def publish_msg(self, msg):
+        self.published.append(OmsMessage.from_bytes(msg[1]))
+
+    def register_order(self, broker_order_id, session, session_order_id):
+        self.orders[broker_order_id] = (session, session_order_id)
+
+    def unregister_order(self, broker_order_id, session):
+        if self.orders.get(broker_order_id, (None,))[0] is session:
+            self.orders.pop(broker_order_id)
+
+
+@pytest.fixture
+def mock_oms():
+    oms = MockOms()
+    yield oms
+    oms.ledger.close()
+
+
+def test__build_position_message(mock_oms):
+    ledger = mock_oms.ledger
+    ledger.insert_strategy('Client_Session_001')
+    ledger.insert_order('Client_Session_001', 1, 1, 'broker_001', '1001', 'GLOBEX', 'NQ', OrderType.MKT, True, 2, 0,
+                        'WRCP001', Action.ENTRY.value, 'Client_Session_001', 'ref_001', {'order_reference': 'ref_001'})
+    ledger.update_position('WRCP001', 'Client_Session_001', 'GLOBEX', 'NQ', 2, 7000.5)
+    ledger.insert_position_by_entry('WRCP001', 'Client_Session_001', 'GLOBEX', 'NQ', 2, 'Client_Session_001', 1,
+                                    'ref_001')
+    ledger.insert_operation('WRCP001', 'Client_Session_001', 'STOP_LOSS', -2, 'ref_001', 6990, 'stop_001')
+
+    session = ClientSession('Client_Session_001', '0b01', mock_oms)
+    session._account_id = 'WRCA001'
+    msg = session._build_position_message(request_id=3)
+
+    assert msg.request_id == 3
+    assert msg.account.id == 'WRCA001'
+    assert msg.account.cash == Decimal('10000000.00000')
+    assert [p.id for p in msg.account.portfolios] == ['WRCP001']
+
+    positions = msg.account.portfolios[0].positions
+    assert [(p.symbol, p.position, p.avg_price) for p in positions] == [('NQ', 2, Decimal('7000.50000'))]
+
+    entries = positions[0].positions_by_entry
+    assert len(entries) == 1
+    assert entries[0].position == 2
+    assert entries[0].order.order_id == 1
+    assert entries[0].order.comment == {'order_reference': 'ref_001'}
+    assert len(entries[0].operations) == 1
+
+
+def test_publish_position_renew(mock_oms):
+    ledger = mock_oms.ledger
+    ledger.insert_strategy('Client_Session_001')
+    ledger.update_position('WRCP001', 'Client_Session_001', 'GLOBEX', 'NQ', 2, 7000.5)
+
+    session = ClientSession('Client_Session_001', '0b01', mock_oms)
+    session._account_id = 'WRCA001'
+    session._position_delta = True
+    session._send_msg = mock_oms.published.append
+    session.publish_position()
+    session.publish_position()
+    # nothing has changed, the renew is sent all the same
+    session.publish_position_renew()
+
+    deltas = mock_oms.published
+    assert [m.msg_type for m in deltas] == [MsgType.POSITION_DELTA, MsgType.POSITION_DELTA]
+    assert [(p.symbol, p.position, p.force_renew) for p in deltas[1].positions] == [('NQ', 2, True)]
+    assert deltas[1].base_version == deltas[0].version
+
+
+def test_position_snapshot_before_delta(mock_oms):
+    ledger = mock_oms.ledger
+    ledger.insert_strategy('Client_Session_001')
+    ledger.insert_session('Client_Session_001').result()
+    ledger.update_position('WRCP001', 'Client_Session_001', 'GLOBEX', 'NQ', 2, 7000.5)
+
+    session = ClientSession('Client_Session_001', '0b01', mock_oms)
+    session._account_id = 'WRCA001'
+    session._next_request_id = 5
+    session._state = ClientSessionState.LOGGED_IN
+    session._position_delta = True
+    session._send_msg = mock_oms.published.append
+    message = OmsMessage.from_dict({Msg.GROUP: Msg.OMS, Msg.MSG_TYPE: MsgType.POSITION, 'request_id': 5})
+    # the snapshot is sent on the path of the deltas, it is not replied
+    assert session.process(message) is None
+    ledger.update_position('WRCP001', 'Client_Session_001', 'GLOBEX', 'NQ', 3, 7000.5)
+    session.publish_position()
+
+    snapshot, delta = mock_oms.published
+    assert (snapshot.msg_type, snapshot.request_id) == (MsgType.POSITION, 5)
+    assert (delta.msg_type, delta.base_version) == (MsgType.POSITION_DELTA, snapshot.version)
+
+
+def test_new_order_batch(mock_oms):
+    ledger = mock_oms.ledger
+    ledger.insert_strategy('strategy_001')
+    ledger.insert_session('Client_Session_001').result()
+    ledger.update_position('WRCP001', 'strategy_001', 'GLOBEX', 'NQ', 1, 7000.5)
+
+    def order(request_id, symbol, is_buy, **kwargs):
+        return dict(dict(request_id=request_id, market='GLOBEX', symbol=symbol, order_type='LMT', is_buy=is_buy,
+                         quantity=1, price=7000.25, portfolio='WRCP001', action=Action.ENTRY.value,
+                         strategy='strategy_001', reference=None, comment={}), **kwargs)
+
+    message = OmsMessage.from_dict({Msg.GROUP: Msg.OMS, Msg.MSG_TYPE: MsgType.NEW_ORDER_BATCH, 'request_id': 5,
+                                    Msg.ORDERS: [order(6, 'NQ', True),
+                                                 order(7, 'NQ', False, market='UNKNOWN'),
+                                                 order(8, 'ES', True, portfolio='WRCP999'),
+                                                 order(9, 'NQ', False)]})
+    session = ClientSession('Client_Session_001', '0b01', mock_oms)
+    session._account_id = 'WRCA001'
+    session._next_request_id = 5
+    session._state = ClientSessionState.LOGGED_IN
+    assert session.process(message) is None
+
+    # the rejected orders are replied with their request ID
+    assert [(e.error_code, e.request_id) for e in mock_oms.published] == [(ErrorCode.ORDER_REJECTED, 7),
+                                                                         (ErrorCode.ORDER_REJECTED, 8)]
+    assert mock_oms.sent == ['NQ', 'NQ']
+    orders = ledger.query_order(session_id='Client_Session_001')
+    assert [(o[TableOrder.ORDER_ID], o[TableOrder.BROKER_ORDER_ID]) for o in orders] == [(6, '1001'), (9, '1002')]
+    assert session.find_session_order_id(1002) == 9
+    # the batch and each of its orders take a request ID
+    assert ledger.query_session('Client_Session_001')[1] == 6
+
+
+def test_new_order_batch_constraint(mock_oms):
+    ledger = mock_oms.ledger
+    ledger.insert_strategy('strategy_001')
+    ledger.insert_session('Client_Session_001').result()
+    ledger.update_position('WRCP001', 'strategy_001', 'GLOBEX', 'NQ', 1, 7000.5)
+
+    def order(request_id, is_buy, constraint=None):
+        return dict(request_id=request_id, market='GLOBEX', symbol='NQ', order_type='LMT', is_buy=is_buy, quantity=1,
+                    price=7000.25, portfolio='WRCP001', action=Action.ENTRY.value, strategy='strategy_001',
+                    reference=None, comment={TableOrder.COMMENT_CONSTRAINT: constraint} if constraint else {})
+
+    long_only = TableOrder.Constraint.LONG_ONLY
+    message = OmsMessage.from_dict({Msg.GROUP: Msg.OMS, Msg.MSG_TYPE: MsgType.NEW_ORDER_BATCH, 'request_id': 5,
+                                    Msg.ORDERS: [order(6, False, long_only),
+                                                 order(7, False, long_only),
+                                                 order(8, True),
+                                                 order(9, False, long_only)]})
+    session = ClientSession('Client_Session_001', '0b01', mock_oms)
+    session._account_id = 'WRCA001'
+    session._next_request_id = 5
+    session._state = ClientSessionState.LOGGED_IN
+    assert session.process(message) is None
+
+    # the position is projected with the orders of the batch accepted before, the second sell would flip it short
+    assert [(e.error_code, e.request_id) for e in mock_oms.published] == [(ErrorCode.ORDER_REJECTED, 7)]
+    orders = ledger.query_order(session_id='Client_Session_001')
+    assert [o[TableOrder.ORDER_ID] for o in orders] == [6, 8, 9]
+
+
+def test_new_order_batch_not_recorded(mock_oms):
+    ledger = mock_oms.ledger
+    ledger.insert_strategy('strategy_001')
+    ledger.insert_session('Client_Session_001').result()
+    insert_order = ledger.insert_order
+    inserted = []
+
+    def insert_order_once(*args):
+        # the database is lost while the batch is recorded
+        if inserted:
+            raise RuntimeError('MySQL Connection not available')
+        insert_order(*args)
+        inserted.append(args)
+    ledger.insert_order = insert_order_once
+
+    def order(request_id):
+        return dict(request_id=request_id, market='GLOBEX', symbol='NQ', order_type='LMT', is_buy=True, quantity=1,
+                    price=7000.25, portfolio='WRCP001', action=Action.EXIT.value, strategy='strategy_001',
+                    reference=None, comment={})
+
+    message = OmsMessage.from_dict({Msg.GROUP: Msg.OMS, Msg.MSG_TYPE: MsgType.NEW_ORDER_BATCH, 'request_id': 5,
+                                    Msg.ORDERS: [order(6), order(7)]})
+    session = ClientSession('Client_Session_001', '0b01', mock_oms)
+    session._account_id = 'WRCA001'
+    session._next_request_id = 5
+    session._state = ClientSessionState.LOGGED_IN
+    assert session.process(message) is None
+
+    # every order of the batch is rejected, none is sent or left to the session
+    assert [(e.error_code, e.request_id) for e in mock_oms.published] == [(ErrorCode.ORDER_REJECTED, 6),
+                                                                         (ErrorCode.ORDER_REJECTED, 7)]
+    assert mock_oms.sent == []
+    assert ledger.query_order(session_id='Client_Session_001') == []
+    assert session.broker_order_ids == [] and mock_oms.orders == dict()